@@ -0,0 +1,317 @@
+"""Offline retrieval benchmarks for the knowledge-base index
+
+Runs entirely locally: the synthetic Chinese corpus from corpus.py is
+embedded with the deterministic hashing embedder, so no API key or
+network is needed and runs on the same machine are comparable.
+
+Two suites are measured:
+
+* index: VectorIndexFactory on 1k to 1M chunks per index type, reporting
+  embedding and build time, index size, peak memory, single-query
+  p50/p99 latency and recall@k against exact search.
+* pipeline: the real RAGService.update_index() and RAGService.search()
+  against a temporary SQLite database, reporting rebuild time, search
+  p50/p99 latency and how often the chunk a query was taken from is
+  returned.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run_benchmarks --sizes 1000,10000,100000
+    python -m benchmarks.run_benchmarks --baseline benchmarks/results/baseline.json
+
+The JSON report is written to --output; with --baseline the run exits
+with status 1 when latency, build time or recall regress beyond the
+tolerances.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import faiss
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import SyntheticCorpus
+
+logger = logging.getLogger("benchmarks")
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "report.json")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is in KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+        "mean_ms": round(float(samples.mean()), 4)
+    }
+
+
+_worker_state = {}
+
+
+def _embed_range(job):
+    """Pool worker: generate and embed chunks [start, start + count)"""
+    start, count, dim, seed = job
+    if "provider" not in _worker_state:
+        from services.embedding_providers import HashingEmbeddingProvider
+        _worker_state["provider"] = HashingEmbeddingProvider(dim)
+        _worker_state["corpus"] = SyntheticCorpus(seed=seed)
+    provider = _worker_state["provider"]
+    return start, provider.embed_batch(list(_worker_state["corpus"].chunks(count, start)), provider)
+
+
+def embed_corpus(n_chunks, dim, seed, workers, batch=2000):
+    """Embed the first n_chunks synthetic chunks into an (n, dim) float32 matrix"""
+    vectors = np.empty((n_chunks, dim), dtype='float32')
+    jobs = [(start, min(batch, n_chunks - start), dim, seed) for start in range(0, n_chunks, batch)]
+    if workers > 1 and len(jobs) > 1:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            for start, block in pool.imap_unordered(_embed_range, jobs):
+                vectors[start:start + len(block)] = block
+    else:
+        for job in jobs:
+            start, block = _embed_range(job)
+            vectors[start:start + len(block)] = block
+    return vectors
+
+
+def bench_index(corpus, n_chunks, index_types, args):
+    """Build each index type over the same vectors and measure it against exact search"""
+    from routes.utils.config_service import get_index_settings
+    from services.vector_index import VectorIndexFactory
+    from services.embedding_providers import HashingEmbeddingProvider
+
+    start = time.perf_counter()
+    vectors = embed_corpus(n_chunks, args.dim, args.seed, args.workers)
+    embed_s = time.perf_counter() - start
+    ids = np.arange(1, n_chunks + 1, dtype='int64')
+
+    provider = HashingEmbeddingProvider(args.dim)
+    queries = corpus.queries(n_chunks, args.queries, seed=args.seed + 1)
+    query_vectors = provider.embed_batch([text for text, _ in queries], provider)
+    k = min(args.k, n_chunks)
+
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, exact_positions = exact.search(query_vectors, k)
+    exact_ids = ids[exact_positions]
+    del exact
+
+    results = []
+    for requested in index_types:
+        settings = dict(get_index_settings(), index_type=requested)
+        start = time.perf_counter()
+        index = VectorIndexFactory.build(vectors, ids, args.dim, settings)
+        build_s = time.perf_counter() - start
+
+        # 逐筆查詢以量測單一使用者提問的延遲
+        latencies, hits = [], 0
+        for row in range(len(query_vectors)):
+            t0 = time.perf_counter()
+            _, found = index.search(query_vectors[row:row + 1], k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            hits += len(set(found[0].tolist()) & set(exact_ids[row].tolist()))
+
+        result = {
+            "chunks": n_chunks,
+            "requested_type": requested,
+            "index_type": VectorIndexFactory.index_type_of(index),
+            "dim": args.dim,
+            "k": k,
+            "embed_s": round(embed_s, 3),
+            "build_s": round(build_s, 3),
+            "index_mb": round(faiss.serialize_index(index).nbytes / (1024 * 1024), 2),
+            "peak_rss_mb": peak_rss_mb(),
+            f"recall_at_{k}": round(hits / (k * len(query_vectors)), 4),
+            **percentiles(latencies)
+        }
+        logger.info(f"index {result}")
+        results.append(result)
+        del index
+    return results
+
+
+def bench_pipeline(corpus, n_chunks, args):
+    """Run RAGService.update_index() and search() on a temporary database and knowledge base"""
+    workdir = tempfile.mkdtemp(prefix="kb_bench_")
+    cwd = os.getcwd()
+    os.environ.update({
+        "EMBEDDING_BACKEND": "hashing",
+        "EMBEDDING_HASH_DIM": str(args.dim),
+        "RAG_ENABLED": "True",
+        "DEDUP_MODE": "off",
+        "RAG_INDEX_TYPE": args.pipeline_index_type
+    })
+    try:
+        os.chdir(workdir)
+        from app import create_app, db
+        from routes.utils.config_service import ConfigManager
+        ConfigManager.clear_cache()
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            "SECRET_KEY": "benchmark",
+            "TESTING": True
+        })
+        with app.app_context():
+            from rag_service import RAGService
+            from models import Document
+            db.create_all()
+
+            # 每個合成段落各自成為一份文件，重建時依正式流程切分與嵌入
+            for start in range(0, n_chunks, 1000):
+                db.session.add_all(
+                    Document(title=f"文件{i}", content=text, is_active=True)
+                    for i, text in enumerate(corpus.chunks(min(1000, n_chunks - start), start), start)
+                )
+                db.session.commit()
+
+            start = time.perf_counter()
+            ok = RAGService.update_index()
+            update_s = time.perf_counter() - start
+
+            queries = corpus.queries(n_chunks, args.queries, seed=args.seed + 1)
+            RAGService.search(queries[0][0], args.top_k)
+            latencies, found = [], 0
+            for text, source in queries:
+                t0 = time.perf_counter()
+                results = RAGService.search(text, args.top_k) or []
+                latencies.append((time.perf_counter() - t0) * 1000)
+                found += any(result["title"] == f"文件{source}" for result in results)
+
+        result = {
+            "chunks": n_chunks,
+            "index_type": args.pipeline_index_type,
+            "update_index_ok": ok,
+            "update_index_s": round(update_s, 3),
+            "top_k": args.top_k,
+            f"source_hit_at_{args.top_k}": round(found / len(queries), 4),
+            "peak_rss_mb": peak_rss_mb(),
+            **{f"search_{key}": value for key, value in percentiles(latencies).items()}
+        }
+        logger.info(f"pipeline {result}")
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(report, baseline, latency_tolerance, recall_tolerance):
+    """Regressions of this report against a baseline report, as readable strings"""
+    regressions = []
+    base_index = {(r["chunks"], r["requested_type"]): r for r in baseline.get("index", [])}
+    for result in report.get("index", []):
+        base = base_index.get((result["chunks"], result["requested_type"]))
+        if not base:
+            continue
+        label = f"index {result['requested_type']} @ {result['chunks']}"
+        for key in ("p99_ms", "build_s"):
+            if result[key] > base[key] * (1 + latency_tolerance):
+                regressions.append(f"{label}: {key} {base[key]} -> {result[key]}")
+        recall_key = f"recall_at_{result['k']}"
+        if recall_key in base and result[recall_key] < base[recall_key] - recall_tolerance:
+            regressions.append(f"{label}: {recall_key} {base[recall_key]} -> {result[recall_key]}")
+
+    base_pipeline = {r["chunks"]: r for r in baseline.get("pipeline", [])}
+    for result in report.get("pipeline", []):
+        base = base_pipeline.get(result["chunks"])
+        if not base:
+            continue
+        label = f"pipeline @ {result['chunks']}"
+        for key in ("search_p99_ms", "update_index_s"):
+            if result[key] > base[key] * (1 + latency_tolerance):
+                regressions.append(f"{label}: {key} {base[key]} -> {result[key]}")
+        hit_key = f"source_hit_at_{result['top_k']}"
+        if hit_key in base and result[hit_key] < base[hit_key] - recall_tolerance:
+            regressions.append(f"{label}: {hit_key} {base[hit_key]} -> {result[hit_key]}")
+    return regressions
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(",") if size.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline knowledge-base retrieval benchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated chunk counts for the index suite (up to 1e6)")
+    parser.add_argument("--index-types", default="flat,ivf,hnsw",
+                        help="index types to compare (flat, ivf, hnsw, auto)")
+    parser.add_argument("--pipeline-sizes", default="1000",
+                        help="chunk counts for the end-to-end RAGService suite, empty to skip")
+    parser.add_argument("--pipeline-index-type", default="auto")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10, help="k for recall@k against exact search")
+    parser.add_argument("--top-k", type=int, default=3, help="top_k passed to RAGService.search")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to generate and embed the corpus")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", help="earlier report to check for regressions")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25,
+                        help="allowed relative increase of p99 latency and build time")
+    parser.add_argument("--recall-tolerance", type=float, default=0.02,
+                        help="allowed absolute drop of recall and hit rate")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    # 索引建立的逐筆日誌會干擾量測輸出
+    logging.getLogger("rag_service").setLevel(logging.WARNING)
+    logging.getLogger("services").setLevel(logging.WARNING)
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    index_types = [t.strip() for t in args.index_types.split(",") if t.strip()]
+    report = {
+        "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "faiss": getattr(faiss, "__version__", "unknown")
+        },
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "index": [],
+        "pipeline": []
+    }
+
+    for n_chunks in parse_sizes(args.sizes):
+        report["index"].extend(bench_index(corpus, n_chunks, index_types, args))
+    for n_chunks in parse_sizes(args.pipeline_sizes):
+        report["pipeline"].append(bench_pipeline(corpus, n_chunks, args))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Wrote benchmark report to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.latency_tolerance, args.recall_tolerance)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        if regressions:
+            return 1
+        logger.info("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,7 +7,17 @@ from routes.utils.config_service import (
     get_llm_settings, 
     is_rag_enabled,
     is_web_search_enabled,
-    get_serpapi_key
+    get_serpapi_key,
+    get_embedding_settings,
+    get_chunk_settings,
+    get_index_settings,
+    get_retrieval_settings,
+    get_upload_settings,
+    get_dedup_settings,
+    get_response_cache_settings,
+    get_openai_client_settings,
+    get_streaming_settings,
+    get_pipeline_settings
 )
 
 # This file simply forwards the configuration utils
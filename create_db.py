@@ -64,6 +64,7 @@ CREATE TABLE IF NOT EXISTS bot_style (
     prompt TEXT NOT NULL,
     description TEXT,
     is_default BOOLEAN DEFAULT FALSE,
+    collections TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 )
@@ -87,7 +88,18 @@ CREATE TABLE IF NOT EXISTS document (
     filename TEXT,
     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    is_active BOOLEAN DEFAULT TRUE
+    is_active BOOLEAN DEFAULT TRUE,
+    collections TEXT
+)
+''')
+
+# 創建文檔段落表格
+cursor.execute('''
+CREATE TABLE IF NOT EXISTS document_chunk (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id INTEGER NOT NULL REFERENCES document(id),
+    content TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL
 )
 ''')
 
@@ -102,6 +114,12 @@ CREATE TABLE IF NOT EXISTS log_entry (
 )
 ''')
 
+# 為既有資料庫補上知識庫集合欄位
+for table in ("document", "bot_style"):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if "collections" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN collections TEXT")
+
 # 創建管理員帳號（如果不存在）
 cursor.execute("SELECT COUNT(*) FROM user WHERE username = 'admin'")
 admin_exists = cursor.fetchone()[0]
@@ -45,6 +45,8 @@ class BotStyleForm(FlaskForm):
     name = StringField('Style Name', validators=[DataRequired(), Length(min=1, max=64)])
     prompt = TextAreaField('System Prompt', validators=[DataRequired()])
     description = TextAreaField('Description', validators=[Optional()])
+    collections = StringField('Knowledge Base Collections', validators=[Optional(), Length(max=256)],
+                              description='Comma-separated, default for untagged documents; leave empty to search every collection')
     is_default = BooleanField('Set as Default')
     submit = SubmitField('Save Style')
 
@@ -67,6 +69,7 @@ class DocumentForm(FlaskForm):
         Optional(),
         FileAllowed(['txt', 'pdf', 'docx', 'md'], '僅支援文字文件！')
     ])
+    collections = StringField('知識庫集合', validators=[Optional(), Length(max=256)])
     submit = SubmitField('添加文件')
     
 class BulkUploadForm(FlaskForm):
@@ -77,4 +80,6 @@ class BulkUploadForm(FlaskForm):
     ])
     title_prefix = StringField('標題前綴', validators=[Optional()], 
                               description='可選的標題前綴，將加在每個檔案名之前')
+    collections = StringField('知識庫集合', validators=[Optional(), Length(max=256)],
+                              description='以逗號分隔，套用到這批所有檔案')
     submit = SubmitField('批量上傳')
@@ -35,6 +35,9 @@ def init_db():
         # 創建所有表格
         logger.info("創建資料庫表格...")
         db.create_all()
+        # 既有資料表補上新增的欄位
+        from models import upgrade_schema
+        upgrade_schema(db)
         
         # 檢查是否已有管理員
         admin = User.query.filter_by(username="admin").first()
@@ -2,6 +2,7 @@ import os
 import json
 import logging
 from openai import OpenAI
+from services.openai_clients import openai_clients
 from routes.utils.config_service import ConfigManager, get_openai_api_key, get_llm_settings
 import models
 # 避免循環導入問題
@@ -20,7 +21,8 @@ class LLMService:
             logger.error("OpenAI API key not configured")
             return None
         
-        return OpenAI(api_key=api_key)
+        # 共用同一金鑰的連線池，避免每次請求重新建立 TLS 連線
+        return openai_clients.get(api_key)
     
     @staticmethod
     def get_bot_style(style_name=None):
@@ -47,18 +49,11 @@ class LLMService:
         return style
     
     @staticmethod
-    def generate_response(user_message, style_name=None, rag_context=None):
-        """Generate a response using the OpenAI API with the specified style"""
-        client = LLMService.get_client()
-        if not client:
-            return "抱歉，無法連接 AI 服務，請檢查 API 設定。"
-        
+    def _build_messages(user_message, style_name=None, rag_context=None):
+        """Chat messages for a user message: style prompt, optional RAG context, the message"""
         # Get the bot style
         style = LLMService.get_bot_style(style_name)
         
-        # Get OpenAI settings
-        settings = get_llm_settings()
-        
         # Build the messages
         messages = [
             {"role": "system", "content": style.prompt}
@@ -73,6 +68,23 @@ class LLMService:
         
         # Add user message
         messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    @staticmethod
+    def generate_response(user_message, style_name=None, rag_context=None, raise_errors=False):
+        """Generate a response using the OpenAI API with the specified style
+
+        With raise_errors the failure is raised instead of being returned as
+        an apology text, so callers can tell real answers from errors.
+        """
+        client = LLMService.get_client()
+        if not client:
+            if raise_errors:
+                raise RuntimeError("OpenAI API key not configured")
+            return "抱歉，無法連接 AI 服務，請檢查 API 設定。"
+        
+        settings = get_llm_settings()
+        messages = LLMService._build_messages(user_message, style_name, rag_context)
         
         try:
             # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
@@ -87,8 +99,35 @@ class LLMService:
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"Error generating response: {e}")
+            if raise_errors:
+                raise
             return f"抱歉，生成回應時發生錯誤：{str(e)}"
     
+    @staticmethod
+    def stream_response(user_message, style_name=None, rag_context=None):
+        """Yield the response text in pieces as the OpenAI API streams it
+
+        Errors are raised, also after some text has been yielded.
+        """
+        client = LLMService.get_client()
+        if not client:
+            raise RuntimeError("OpenAI API key not configured")
+        
+        settings = get_llm_settings()
+        messages = LLMService._build_messages(user_message, style_name, rag_context)
+        
+        stream = client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=settings["temperature"],
+            max_tokens=settings["max_tokens"],
+            stream=True
+        )
+        for chunk in stream:
+            # 最後一個區塊可能沒有 choices
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
     @staticmethod
     def validate_api_key(api_key):
         """Validate that the provided OpenAI API key works"""
@@ -4,7 +4,7 @@ from flask import Flask, request, abort, render_template, redirect, url_for, fla
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from openai import OpenAI
+from services.openai_clients import openai_clients
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
@@ -12,6 +12,7 @@ import json
 from datetime import datetime, timezone, timedelta
 from sqlalchemy.orm import DeclarativeBase
 from services.llm_service import LLMService
+from services.shards import format_style_collections
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -58,6 +59,7 @@ class BotStyle(db.Model):
     name = db.Column(db.String(64), unique=True, nullable=False)
     prompt = db.Column(db.Text, nullable=False)
     is_default = db.Column(db.Boolean, default=False)
+    collections = db.Column(db.String(256), nullable=True)
     
 class ChatMessage(db.Model):
     """Model to store chat message history"""
@@ -101,6 +103,9 @@ class ConfigManager:
             config = Config(key=key, value=value)
             db.session.add(config)
         db.session.commit()
+        # 服務層共用的設定快取也要更新
+        from routes.utils.config_service import ConfigManager as SharedConfigManager
+        SharedConfigManager.invalidate(key)
 
 # LLM service
 def get_openai_api_key():
@@ -163,7 +168,7 @@ def generate_response(user_message, style_name=None):
     if not api_key:
         return "API key not configured, please set up OpenAI API key."
     
-    client = OpenAI(api_key=api_key)
+    client = openai_clients.get(api_key)
     
     # Get the bot style
     style = get_bot_style(style_name)
@@ -213,6 +218,9 @@ def get_line_webhook_handler():
 # Create tables and initial data
 with app.app_context():
     db.create_all()
+    # 既有資料表補上新增的欄位（create_all 只建立缺少的資料表）
+    from models import upgrade_schema
+    upgrade_schema(db)
     
     # Create initial admin user if no users exist
     if not User.query.first():
@@ -436,10 +444,17 @@ def edit_bot_style(style_id):
             flash(f'名稱為 "{name}" 的風格已存在', 'danger')
             return redirect(url_for('edit_bot_style', style_id=style_id))
         
+        try:
+            collections = format_style_collections(request.form.get('collections', ''))
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('edit_bot_style', style_id=style_id))
+        
         # Update the style
         style.name = name
         style.prompt = prompt
         style.is_default = is_default
+        style.collections = collections
         
         # If this is set as default, update all others
         if is_default:
@@ -469,7 +484,13 @@ def add_bot_style():
             flash(f'名稱為 "{name}" 的風格已存在', 'danger')
             return redirect(url_for('add_bot_style'))
         
-        style = BotStyle(name=name, prompt=prompt, is_default=is_default)
+        try:
+            collections = format_style_collections(request.form.get('collections', ''))
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('add_bot_style'))
+        
+        style = BotStyle(name=name, prompt=prompt, is_default=is_default, collections=collections)
         db.session.add(style)
         
         # If this is set as default, update all others
@@ -595,7 +616,7 @@ def get_webhook_handler():
                     if not api_key:
                         response_text = "API key 未設定，請在管理後台設定 OpenAI API key。"
                     else:
-                        client = OpenAI(api_key=api_key)
+                        client = openai_clients.get(api_key)
                         
                         # 獲取風格
                         default_style_name = ConfigManager.get("ACTIVE_BOT_STYLE", "貼心")
@@ -623,7 +644,7 @@ def get_webhook_handler():
                             if rag_enabled:
                                 try:
                                     from rag_service import RAGService
-                                    rag_context = RAGService.get_context_for_query(user_message)
+                                    rag_context = RAGService.get_context_for_query(user_message, style.name)
                                     if rag_context:
                                         messages.append({
                                             "role": "system", 
@@ -691,7 +712,7 @@ def api_chat():
         if not api_key:
             return jsonify({'error': 'API key not configured'}), 500
         
-        client = OpenAI(api_key=api_key)
+        client = openai_clients.get(api_key)
         
         # 獲取機器人風格
         if not style_name:
@@ -721,7 +742,7 @@ def api_chat():
         if rag_enabled:
             try:
                 from rag_service import RAGService
-                rag_context = RAGService.get_context_for_query(user_message)
+                rag_context = RAGService.get_context_for_query(user_message, style.name)
                 if rag_context:
                     messages.append({
                         "role": "system", 
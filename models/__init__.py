@@ -3,6 +3,10 @@ Models package initializer.
 This file helps avoid circular imports by providing a central place to import all models.
 """
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 # These will be populated when db_init is called
 User = None
 LineUser = None
@@ -13,6 +17,41 @@ Document = None
 DocumentChunk = None
 LogEntry = None
 
+# 建立資料表之後才新增的欄位；db.create_all() 不會修改已存在的資料表
+ADDED_COLUMNS = (
+    ("document", "collections", "VARCHAR(256)"),
+    ("bot_style", "collections", "VARCHAR(256)"),
+)
+
+def upgrade_schema(db):
+    """Add columns introduced after a table was created, on any database dialect
+
+    Call after db.create_all(). Existing tables are inspected and each
+    missing column in ADDED_COLUMNS is added with ALTER TABLE; tables that
+    do not exist are left to create_all. Safe to run on every start.
+    """
+    from sqlalchemy import inspect, text
+    
+    engine = db.engine
+    preparer = engine.dialect.identifier_preparer
+    tables = set(inspect(engine).get_table_names())
+    for table, column, column_type in ADDED_COLUMNS:
+        if table not in tables:
+            continue
+        if column in {info["name"] for info in inspect(engine).get_columns(table)}:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.quote(table)} ADD COLUMN {preparer.quote(column)} {column_type}"
+                ))
+            logger.info(f"Added column {table}.{column}")
+        except Exception as e:
+            # 其他 worker 可能同時完成了相同的變更
+            if column not in {info["name"] for info in inspect(engine).get_columns(table)}:
+                raise
+            logger.info(f"Column {table}.{column} was added concurrently: {e}")
+
 def init_models(db):
     """Initialize all models with the database instance to avoid circular imports."""
     
@@ -37,6 +37,8 @@ def BotStyleModel(db):
         prompt = Column(Text, nullable=False)
         description = Column(Text, nullable=True)
         is_default = Column(Boolean, default=False)
+        # 此風格搜尋的知識庫集合（逗號分隔），空值表示搜尋全部
+        collections = Column(String(256), nullable=True)
         created_at = Column(DateTime, default=datetime.utcnow)
         updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
         
@@ -16,6 +16,8 @@ def DocumentModel(db):
         uploaded_at = Column(DateTime, default=datetime.utcnow)
         updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
         is_active = Column(Boolean, default=True)
+        # 以逗號分隔的知識庫集合，空值表示預設集合
+        collections = Column(String(256), nullable=True)
         
         # 關聯會在初始化後設置
         chunks = None
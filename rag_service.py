@@ -1,211 +1,638 @@
 import os
+import json
 import logging
+from itertools import chain
 import numpy as np
-import faiss
-import pickle
 from flask import current_app
-from config import is_rag_enabled
+from datetime import datetime
+from config import is_rag_enabled, get_active_bot_style, get_index_settings, get_retrieval_settings, get_dedup_settings
 from llm_service import LLMService
+from services.embedding_service import EmbeddingService, EmbeddingCache, QueryEmbeddingCache
+from services.shards import ShardRegistry, DEFAULT_COLLECTION, parse_collections, format_collections, document_collections
+from services.text_chunker import TextChunker
+from services.vector_index import VectorIndexFactory
+from services.metadata_store import ChunkMetadataStore
+from services.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from services.reranker import cosine_similarities, hybrid_cutoff, mmr_select
+from services.index_jobs import IndexJobQueue
+from services.near_duplicates import MinHasher, NearDuplicateIndex
 from app import db
 
 # 延遲導入模型函數
 def get_document_model():
     """獲取 Document 模型"""
-    from app import Document
+    from models import Document
     return Document
 
+def get_document_chunk_model():
+    """獲取 DocumentChunk 模型"""
+    from models import DocumentChunk
+    return DocumentChunk
+
 logger = logging.getLogger(__name__)
 
 class RAGService:
     """Service for Retrieval Augmented Generation (RAG)"""
     
     # Path for storing the FAISS index
-    INDEX_PATH = "knowledge_base/faiss_index.idx"
-    EMBEDDINGS_PATH = "knowledge_base/embeddings.pkl"
+    KNOWLEDGE_BASE_DIR = "knowledge_base"
+    # 索引檔案存放在 knowledge_base/snapshots/<版本>/ 中，由 CURRENT 指向目前版本
+    INDEX_FILE = "faiss_index.idx"
+    METADATA_FILE = "chunk_metadata.bin"
+    KEYWORD_INDEX_FILE = "keyword_index.npz"
+    MANIFEST_FILE = "index_manifest.json"
+    LEGACY_EMBEDDINGS_PATH = "knowledge_base/embeddings.pkl"
+    DEDUP_SIGNATURES_PATH = "knowledge_base/near_duplicates.npz"
+    INGEST_REPORT_PATH = "knowledge_base/ingest_report.json"
+    JOB_STATUS_PATH = "knowledge_base/index_job.json"
+    JOB_LOCK_PATH = "knowledge_base/index_job.lock"
+    
+    # Query embedding cache bounds
+    QUERY_CACHE_SIZE = 2048
+    QUERY_CACHE_TTL = 3600  # seconds
+    
+    @staticmethod
+    def get_embedding_provider():
+        """The configured embedding backend (openai, onnx or hashing)"""
+        return EmbeddingService.get_provider(LLMService.get_client)
     
     @staticmethod
     def get_embedding(text, client=None):
-        """Get embedding for a text using OpenAI API"""
-        if client is None:
-            client = LLMService.get_client()
-            if not client:
-                logger.error("Failed to initialize OpenAI client for embeddings")
-                return None
-        
+        """Get embedding for a text from the configured embedding backend"""
         try:
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response.data[0].embedding
+            provider = RAGService.get_embedding_provider()
+            # 呼叫端提供的 OpenAI 客戶端只適用於 openai 後端
+            connection = client if client is not None and provider.backend == "openai" else provider.connect()
+            if connection is None:
+                logger.error(f"Embedding backend {provider.backend} is unavailable")
+                return None
+            
+            vectors = provider.embed_batch([text], connection)
+            return None if vectors is None else vectors[0]
         except Exception as e:
             logger.error(f"Error getting embedding: {e}")
             return None
     
     @staticmethod
-    def initialize_index():
-        """Initialize or load the FAISS index"""
+    def get_query_embedding(query, client=None):
+        """Get the embedding of a search query as a (1, dim) float32 array, using the LRU cache"""
+        identity = RAGService.get_embedding_provider().identity
+        vector = _query_cache.get(query, identity)
+        if vector is None:
+            embedding = RAGService.get_embedding(query, client)
+            if embedding is None:
+                return None
+            vector = np.asarray(embedding, dtype='float32')
+            _query_cache.put(query, identity, vector)
+        return vector.reshape(1, -1)
+    
+    @staticmethod
+    def get_query_cache_stats():
+        """Hit/miss counters of the query embedding cache in this process"""
+        return _query_cache.stats()
+    
+    @staticmethod
+    def get_knowledge_base_version():
+        """Published snapshot of every index shard, changes whenever documents are reindexed"""
+        return _shards.version()
+    
+    @staticmethod
+    def _create_index(dim=None):
+        """Create an empty FAISS index whose vectors are keyed by DocumentChunk.id"""
+        return VectorIndexFactory.create_empty(dim or RAGService.get_embedding_provider().dim)
+    
+    @staticmethod
+    def _embedding_mismatch(index, manifest, provider):
+        """Why vectors from ``provider`` cannot be used with this index, or None if they can"""
+        if manifest and manifest.get("embedding") != provider.identity:
+            return (f"index was built with {manifest.get('embedding')} but the current embedding "
+                    f"backend is {provider.identity}; rebuild the index")
+        if index.d != provider.dim:
+            return f"index dimension {index.d} does not match {provider.identity}; rebuild the index"
+        return None
+    
+    @staticmethod
+    def _load_manifest(directory):
+        """Embedding backend and dimension the saved index was built with, None for older indexes"""
+        try:
+            with open(os.path.join(directory, RAGService.MANIFEST_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _write_manifest(index, provider, directory):
+        manifest = {
+            "embedding": provider.identity,
+            "backend": provider.backend,
+            "model": provider.model,
+            "dim": index.d,
+            "index_type": VectorIndexFactory.index_type_of(index),
+            "vectors": int(index.ntotal)
+        }
+        with open(os.path.join(directory, RAGService.MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+    
+    @staticmethod
+    def initialize_index(read_only=False, shard=DEFAULT_COLLECTION):
+        """Initialize or load a shard's FAISS index, chunk metadata, keyword index and manifest
+
+        Searches load the index and metadata read-only and memory-mapped
+        (the index only when RAG_INDEX_MMAP is enabled); writers get a
+        private, modifiable index and the metadata as a {chunk_id: record}
+        dict. The manifest records the embedding backend of the index.
+        Every file is read from the one snapshot CURRENT points to.
+        """
         # Create knowledge_base directory if it doesn't exist
-        os.makedirs("knowledge_base", exist_ok=True)
+        os.makedirs(RAGService.KNOWLEDGE_BASE_DIR, exist_ok=True)
+        
+        # 尚未建立快照的舊安裝，預設集合的索引檔案直接位於 knowledge_base/ 中
+        directory = _shards.store(shard).current()
+        if directory is None and shard == DEFAULT_COLLECTION:
+            directory = RAGService.KNOWLEDGE_BASE_DIR
+        index_path = directory and os.path.join(directory, RAGService.INDEX_FILE)
+        metadata_path = directory and os.path.join(directory, RAGService.METADATA_FILE)
         
         # Check if index already exists
-        if os.path.exists(RAGService.INDEX_PATH) and os.path.exists(RAGService.EMBEDDINGS_PATH):
+        if directory and os.path.exists(index_path) and os.path.exists(metadata_path):
             try:
                 # Load existing index
-                index = faiss.read_index(RAGService.INDEX_PATH)
-                with open(RAGService.EMBEDDINGS_PATH, 'rb') as f:
-                    doc_embeddings = pickle.load(f)
-                logger.info("Loaded existing FAISS index")
-                return index, doc_embeddings
+                mmap = read_only and get_index_settings()["mmap"]
+                index = VectorIndexFactory.read(index_path, mmap=mmap)
+                metadata = ChunkMetadataStore.open(metadata_path)
+                
+                # 舊版索引以向量位置作為鍵值，無法單筆增刪，需重建
+                if VectorIndexFactory.is_id_keyed(index):
+                    VectorIndexFactory.configure(index)
+                    keyword_index = RAGService._load_keyword_index(metadata, directory)
+                    logger.info(f"Loaded existing {VectorIndexFactory.index_type_of(index)} FAISS index from {directory}")
+                    manifest = RAGService._load_manifest(directory)
+                    return index, metadata if read_only else metadata.to_dict(), keyword_index, manifest
+                logger.warning("Existing FAISS index is not ID-mapped, a rebuild is required")
             except Exception as e:
                 logger.error(f"Error loading FAISS index: {e}")
+        elif shard == DEFAULT_COLLECTION and os.path.exists(RAGService.LEGACY_EMBEDDINGS_PATH):
+            # 舊版 pickle 中繼資料不再載入，避免反序列化不受信任的檔案
+            logger.warning("Found legacy embeddings.pkl metadata, rebuild the index to migrate it")
         
         # Create new index
-        logger.info("Creating new FAISS index")
-        embedding_dim = 1536  # OpenAI's text-embedding-3-small dimension
-        index = faiss.IndexFlatL2(embedding_dim)
-        doc_embeddings = {}
+        logger.info(f"Creating new FAISS index for shard {shard}")
+        index = RAGService._create_index()
         
-        return index, doc_embeddings
+        return index, ChunkMetadataStore.empty() if read_only else {}, KeywordIndex(), None
     
     @staticmethod
-    def update_index():
-        """Update the FAISS index with all documents in the database"""
-        client = LLMService.get_client()
-        if not client:
-            logger.error("Cannot update index: OpenAI client initialization failed")
-            return False
-            
+    def _load_keyword_index(metadata, directory):
+        """Load the BM25 keyword index, building it from the chunk metadata if it is missing"""
+        path = os.path.join(directory, RAGService.KEYWORD_INDEX_FILE)
+        if os.path.exists(path):
+            try:
+                return KeywordIndex.load(path)
+            except Exception as e:
+                logger.error(f"Error loading keyword index: {e}")
+        
+        logger.info("Building keyword index from chunk metadata")
+        keyword_index = KeywordIndex()
+        keyword_index.add(RAGService._keyword_records(metadata.to_dict()))
+        return keyword_index
+    
+    @staticmethod
+    def _keyword_records(doc_embeddings, chunk_ids=None):
+        """(chunk_id, text) pairs for the keyword index, titles included for exact name matches"""
+        keys = doc_embeddings.keys() if chunk_ids is None else chunk_ids
+        return [
+            (key, f"{doc_embeddings[key]['title']}\n{doc_embeddings[key]['content']}")
+            for key in keys if key in doc_embeddings
+        ]
+    
+    @staticmethod
+    def _save_index(index, doc_embeddings, keyword_index, provider, shard=DEFAULT_COLLECTION):
+        """Write a shard's FAISS index, metadata, keyword index and manifest as a new snapshot
+
+        Nothing a reader might be loading is overwritten: the files go to a
+        new snapshot directory that becomes current in one atomic step.
+        """
+        snapshots = _shards.store(shard)
+        staging = snapshots.stage()
+        try:
+            VectorIndexFactory.write(index, os.path.join(staging, RAGService.INDEX_FILE))
+            ChunkMetadataStore.write(os.path.join(staging, RAGService.METADATA_FILE), doc_embeddings)
+            keyword_index.save(os.path.join(staging, RAGService.KEYWORD_INDEX_FILE))
+            RAGService._write_manifest(index, provider, staging)
+        except BaseException:
+            snapshots.discard(staging)
+            raise
+        snapshots.publish(staging)
+        # 本行程下次搜尋時載入新快照（以 mmap 讀取），不保留寫入端的私有副本
+        _shards.published(shard)
+    
+    @staticmethod
+    def _chunk_document(doc):
+        """Split a document into new DocumentChunk rows (added to the session, not committed)"""
+        DocumentChunk = get_document_chunk_model()
+        chunks = [
+            DocumentChunk(document_id=doc.id, chunk_index=i, content=text)
+            for i, text in enumerate(TextChunker.chunk_text(doc.content))
+        ]
+        db.session.add_all(chunks)
+        return chunks
+    
+    @staticmethod
+    def _chunk_metadata(doc, chunk):
+        """Build the search-result metadata stored for an indexed chunk"""
+        return {
+            "id": doc.id,
+            "chunk_id": chunk.id,
+            "chunk_index": chunk.chunk_index,
+            "title": doc.title,
+            "content": chunk.content
+        }
+    
+    @staticmethod
+    def _chunk_ids_for_documents(doc_embeddings, doc_ids):
+        """Index keys of every vector that belongs to one of the given documents"""
+        return [key for key, meta in doc_embeddings.items() if meta["id"] in doc_ids]
+    
+    @staticmethod
+    def _embed_chunks(chunk_pairs, doc_embeddings, provider, progress=None):
+        """Embed (document, chunk) pairs, record their metadata and return (ids, vectors)"""
+        # 以批次請求取得向量，每個請求包含多個段落
+        embeddings = EmbeddingService.embed_texts(
+            [chunk.content for _, chunk in chunk_pairs], provider,
+            progress=(lambda done, total: progress("embedding", done, total)) if progress else None
+        )
+        
+        ids, vectors = [], []
+        for (doc, chunk), vector in zip(chunk_pairs, embeddings):
+            if vector is None:
+                logger.error(f"Failed to get embedding for chunk {chunk.chunk_index} of document {doc.id}")
+                continue
+            ids.append(chunk.id)
+            vectors.append(vector)
+            doc_embeddings[chunk.id] = RAGService._chunk_metadata(doc, chunk)
+        
+        if not vectors:
+            return np.zeros(0, dtype='int64'), np.zeros((0, provider.dim), dtype='float32')
+        return np.array(ids, dtype='int64'), np.vstack(vectors)
+    
+    @staticmethod
+    def _remove_vectors(index, ids):
+        """Remove vectors by id; HNSW cannot remove, so its vectors stay as tombstones"""
+        if not ids:
+            return 0
+        try:
+            return index.remove_ids(np.array(ids, dtype='int64'))
+        except RuntimeError:
+            # 搜尋時會略過沒有中繼資料的向量，下次重建時清除
+            logger.info(f"{VectorIndexFactory.index_type_of(index)} index cannot remove vectors, "
+                        f"{len(ids)} left as tombstones until the next rebuild")
+            return 0
+    
+    @staticmethod
+    def _shard_rows(chunk_pairs, ids):
+        """Row positions of the embedded chunks in each collection shard"""
+        embedded = set(ids.tolist())
+        collections = {}
+        rows = {}
+        position = 0
+        for doc, chunk in chunk_pairs:
+            if chunk.id not in embedded:
+                continue
+            if doc.id not in collections:
+                collections[doc.id] = document_collections(doc)
+            for shard in collections[doc.id]:
+                rows.setdefault(shard, []).append(position)
+            position += 1
+        return rows
+    
+    @staticmethod
+    def update_index(progress=None):
+        """Rebuild every collection shard from all active documents in the database
+
+        ``progress(stage, done, total)`` is called as the rebuild advances,
+        for the background job status.
+        """
+        progress = progress or (lambda stage, done=0, total=0: None)
+        # 未變更的段落直接使用快取向量，沒有 API 金鑰時仍可重建
         try:
-            # Initialize index
-            index, doc_embeddings = RAGService.initialize_index()
+            provider = RAGService.get_embedding_provider()
+            
+            # Vectors come from the embedding cache where possible
+            os.makedirs(RAGService.KNOWLEDGE_BASE_DIR, exist_ok=True)
+            doc_embeddings = {}
             
             # Get all active documents
             Document = get_document_model()
             documents = Document.query.filter_by(is_active=True).all()
+            total_docs = len(documents)
             
-            # Reset index
-            if index.ntotal > 0:
-                index.reset()
-                doc_embeddings = {}
+            # 重新切分所有文件，段落設定可能已變更
+            DocumentChunk = get_document_chunk_model()
+            DocumentChunk.query.delete()
+            chunk_pairs = []
+            for i, doc in enumerate(documents):
+                progress("chunking", i, total_docs)
+                for chunk in RAGService._chunk_document(doc):
+                    chunk_pairs.append((doc, chunk))
+            db.session.commit()
             
-            # 分批處理文件，避免記憶體溢出
-            batch_size = 5  # 每批處理的文件數量
-            total_docs = len(documents)
-            processed_docs = 0
+            # 每個段落只嵌入一次，再依文件的集合分配到各分片
+            ids, vectors = RAGService._embed_chunks(chunk_pairs, doc_embeddings, provider, progress)
+            embedded = len(ids)
+            shard_rows = RAGService._shard_rows(chunk_pairs, ids)
+            shard_rows.setdefault(DEFAULT_COLLECTION, [])
             
-            for i in range(0, total_docs, batch_size):
-                batch_docs = documents[i:i+batch_size]
-                # Generate embeddings for documents in this batch
-                for doc in batch_docs:
-                    try:
-                        # 設置重試機制
-                        max_retries = 3
-                        retry_delay = 1
-                        embedding = None
-                        
-                        for attempt in range(max_retries):
-                            try:
-                                embedding = RAGService.get_embedding(doc.content, client)
-                                if embedding:
-                                    break
-                                
-                                if attempt < max_retries - 1:
-                                    import time
-                                    time.sleep(retry_delay)
-                                    retry_delay *= 2
-                            except Exception as retry_error:
-                                logger.warning(f"Retry {attempt+1}/{max_retries} failed for document {doc.id}: {retry_error}")
-                                if attempt < max_retries - 1:
-                                    import time
-                                    time.sleep(retry_delay)
-                                    retry_delay *= 2
-                        
-                        if embedding:
-                            # Convert to numpy array and reshape
-                            embedding_np = np.array(embedding).astype('float32').reshape(1, -1)
-                            
-                            # Add to index
-                            index.add(embedding_np)
-                            
-                            # 僅保存必要的摘要信息，節省記憶體
-                            content_preview = doc.content[:500] if len(doc.content) > 500 else doc.content
-                            doc_embeddings[index.ntotal - 1] = {
-                                "id": doc.id,
-                                "title": doc.title,
-                                "content": content_preview
-                            }
-                            processed_docs += 1
-                    except Exception as doc_error:
-                        logger.error(f"Error processing document {doc.id}: {doc_error}")
-                        continue
+            for done, (shard, rows) in enumerate(sorted(shard_rows.items())):
+                progress("building", done, len(shard_rows))
+                shard_ids, shard_vectors = ids[rows], vectors[rows]
+                shard_embeddings = {int(key): doc_embeddings[int(key)] for key in shard_ids}
                 
-                # 每批處理完成后保存一次索引，確保進度不丟失
-                if i + batch_size >= total_docs or (i > 0 and i % (batch_size * 3) == 0):
-                    faiss.write_index(index, RAGService.INDEX_PATH)
-                    with open(RAGService.EMBEDDINGS_PATH, 'wb') as f:
-                        pickle.dump(doc_embeddings, f)
-                    logger.info(f"Interim save: Processed {processed_docs}/{total_docs} documents")
+                # 依向量數量選擇索引類型，IVF 在此訓練中心點
+                index = VectorIndexFactory.build(shard_vectors, shard_ids, provider.dim)
+                keyword_index = KeywordIndex()
+                keyword_index.add(RAGService._keyword_records(shard_embeddings))
+                RAGService._save_index(index, shard_embeddings, keyword_index, provider, shard)
+                
+                # 近似索引與精確搜尋比較召回率與延遲
+                if VectorIndexFactory.index_type_of(index) != "flat":
+                    report = VectorIndexFactory.evaluate(index, shard_vectors, shard_ids)
+                    logger.info(f"Index recall check for shard {shard}: {report}")
+            
+            # 已沒有文件的集合不再保留分片
+            for shard in _shards.names():
+                if shard not in shard_rows:
+                    _shards.drop(shard)
             
-            # 最終保存索引
-            faiss.write_index(index, RAGService.INDEX_PATH)
-            with open(RAGService.EMBEDDINGS_PATH, 'wb') as f:
-                pickle.dump(doc_embeddings, f)
+            # 只保留目前段落的快取向量，避免快取無限增長
+            if embedded == len(chunk_pairs):
+                EmbeddingCache.prune(
+                    EmbeddingCache.make_key(chunk.content, provider.identity) for _, chunk in chunk_pairs
+                )
                 
-            logger.info(f"Updated FAISS index with {processed_docs}/{total_docs} documents")
+            logger.info(f"Updated FAISS index with {embedded}/{len(chunk_pairs)} chunks from {total_docs} documents "
+                        f"in {len(shard_rows)} shard(s)")
             return True
         except Exception as e:
             logger.error(f"Error updating FAISS index: {e}")
+            db.session.rollback()
             return False
     
     @staticmethod
-    def search(query, top_k=3):
-        """Search the FAISS index for relevant documents"""
+    def index_documents(docs, remove_ids=(), progress=None, reuse_chunks=False):
+        """Add or replace the chunks of many documents in one incremental index update
+
+        The chunks are embedded once, together in packed batches, and each
+        affected collection shard is loaded and saved once, so the cost
+        grows with the size of the batch rather than once per document.
+        Old vectors of the documents are removed from every shard, since
+        their collections may have changed. Inactive documents and
+        ``remove_ids`` only have their vectors removed. With
+        ``reuse_chunks``, chunks already stored at ingest are embedded as
+        they are instead of re-chunking the document.
+        """
+        progress = progress or (lambda stage, done=0, total=0: None)
+        stale_doc_ids = set(remove_ids) | {doc.id for doc in docs}
+        
+        try:
+            # 後端無法連線時 embed_texts 仍會嘗試使用快取向量
+            provider = RAGService.get_embedding_provider()
+            active_docs = [doc for doc in docs if doc.is_active]
+            shard_names = set(_shards.names())
+            for doc in active_docs:
+                shard_names.update(document_collections(doc))
+            
+            # 先載入並檢查所有分片，不同模型的向量不可混在同一個索引中
+            shards = {}
+            for shard in sorted(shard_names):
+                index, doc_embeddings, keyword_index, manifest = RAGService.initialize_index(shard=shard)
+                mismatch = RAGService._embedding_mismatch(index, manifest, provider)
+                if mismatch and index.ntotal:
+                    logger.error(f"Cannot update index shard {shard} incrementally: {mismatch}")
+                    return False
+                if mismatch:
+                    index = RAGService._create_index(provider.dim)
+                shards[shard] = (index, doc_embeddings, keyword_index)
+            
+            DocumentChunk = get_document_chunk_model()
+            stored = {}
+            if reuse_chunks and active_docs:
+                for chunk in DocumentChunk.query.filter(
+                    DocumentChunk.document_id.in_([doc.id for doc in active_docs])
+                ).order_by(DocumentChunk.chunk_index):
+                    stored.setdefault(chunk.document_id, []).append(chunk)
+            
+            rechunk_ids = [doc.id for doc in docs if doc.id not in stored]
+            if rechunk_ids:
+                DocumentChunk.query.filter(
+                    DocumentChunk.document_id.in_(rechunk_ids)
+                ).delete(synchronize_session=False)
+            chunk_pairs = []
+            for i, doc in enumerate(active_docs):
+                progress("chunking", i, len(active_docs))
+                chunks = stored.get(doc.id) or RAGService._chunk_document(doc)
+                chunk_pairs.extend((doc, chunk) for chunk in chunks)
+            db.session.commit()
+            
+            new_embeddings = {}
+            ids, vectors = RAGService._embed_chunks(chunk_pairs, new_embeddings, provider, progress)
+            shard_rows = RAGService._shard_rows(chunk_pairs, ids)
+            
+            removed = 0
+            progress("saving", len(ids), len(chunk_pairs))
+            for shard, (index, doc_embeddings, keyword_index) in shards.items():
+                # 先移除舊段落的向量，再加入重新切分後的段落
+                old_ids = RAGService._chunk_ids_for_documents(doc_embeddings, stale_doc_ids)
+                rows = shard_rows.get(shard, [])
+                if not old_ids and not rows and _shards.store(shard).current():
+                    continue
+                removed += RAGService._remove_vectors(index, old_ids)
+                keyword_index.remove(old_ids)
+                for key in old_ids:
+                    doc_embeddings.pop(key, None)
+                
+                if rows:
+                    shard_ids = ids[rows]
+                    index.add_with_ids(vectors[rows], shard_ids)
+                    for key in shard_ids.tolist():
+                        doc_embeddings[key] = new_embeddings[key]
+                    keyword_index.add(RAGService._keyword_records(doc_embeddings, shard_ids.tolist()))
+                if not doc_embeddings and shard != DEFAULT_COLLECTION:
+                    _shards.drop(shard)
+                    continue
+                RAGService._save_index(index, doc_embeddings, keyword_index, provider, shard)
+            
+            logger.info(f"Indexed {len(ids)}/{len(chunk_pairs)} chunks of {len(active_docs)} document(s) "
+                        f"into {len(shard_rows)} shard(s), removed {removed} vector(s)")
+            return len(ids) == len(chunk_pairs)
+        except Exception as e:
+            logger.error(f"Error indexing documents {sorted(stale_doc_ids)}: {e}")
+            db.session.rollback()
+            return False
+    
+    @staticmethod
+    def index_document(doc):
+        """Add or replace the chunks of a single document in the FAISS index"""
+        return RAGService.index_documents([doc])
+    
+    @staticmethod
+    def remove_from_index(doc_id):
+        """Remove the chunks of a single document from the FAISS index"""
+        return RAGService.index_documents([], remove_ids=[doc_id])
+    
+    @staticmethod
+    def schedule_index_update(rebuild=False, index_ids=(), remove_ids=()):
+        """Queue a full rebuild or per-document index updates on the background worker"""
+        return _index_jobs.submit(current_app._get_current_object(), rebuild, index_ids, remove_ids)
+    
+    @staticmethod
+    def get_index_job_status():
+        """Status and progress of the latest background index job"""
+        return _index_jobs.status()
+    
+    @staticmethod
+    def _run_index_job(rebuild, index_ids, remove_ids, progress):
+        """Background job body: a full rebuild, or per-document updates"""
+        if rebuild:
+            return RAGService.update_index(progress)
+        
+        Document = get_document_model()
+        docs = Document.query.filter(Document.id.in_(index_ids)).all() if index_ids else []
+        # 排隊期間已被刪除的文件只需移除向量
+        missing = set(index_ids) - {doc.id for doc in docs}
+        return RAGService.index_documents(docs, set(remove_ids) | missing, progress, reuse_chunks=True)
+    
+    @staticmethod
+    def _shard_candidates(shard, query, query_np, fetch_k, settings, provider):
+        """Candidate chunks of one shard as (metadata records, vectors, BM25 scores by chunk id)"""
+        # 使用常駐記憶體的索引，不在每次查詢時讀取磁碟
+        index, doc_embeddings, keyword_index, manifest = _shards.holder(shard).get()
+        if index.ntotal == 0:
+            return [], None, {}
+        
+        # 查詢向量必須與建立索引時使用同一個模型
+        mismatch = RAGService._embedding_mismatch(index, manifest, provider)
+        if mismatch:
+            logger.error(f"Refusing to search shard {shard}: {mismatch}")
+            return [], None, {}
+        
+        # 有刪除殘留的向量時多取一些候選，過濾後仍能湊滿 top_k
+        shard_k = fetch_k * 2 if index.ntotal > len(doc_embeddings) else fetch_k
+        distances, indices = index.search(query_np, min(shard_k, index.ntotal))
+        
+        # FAISS returns DocumentChunk.id values (-1 for empty slots)
+        ranked_ids = [int(chunk_id) for chunk_id in indices[0] if chunk_id in doc_embeddings]
+        
+        keyword_scores = {}
+        if settings["hybrid"]:
+            keyword_scores = {chunk_id: score for chunk_id, score in keyword_index.search(query, shard_k)
+                              if chunk_id in doc_embeddings}
+            ranked_ids = reciprocal_rank_fusion([ranked_ids, list(keyword_scores)], k=settings["rrf_k"])
+        ranked_ids = ranked_ids[:fetch_k]
+        if not ranked_ids:
+            return [], None, {}
+        
+        return ([doc_embeddings[chunk_id] for chunk_id in ranked_ids],
+                VectorIndexFactory.reconstruct(index, ranked_ids), keyword_scores)
+    
+    @staticmethod
+    def search(query, top_k=3, collections=None):
+        """Search the knowledge base for the most relevant document chunks
+
+        Only the shards of ``collections`` are searched (every shard when
+        it is empty). Within each shard, with hybrid search enabled, the
+        vector and BM25 keyword candidates are merged with reciprocal rank
+        fusion, so exact product names and codes are found even when their
+        embeddings are not close. The candidates of all shards are then
+        scored by cosine similarity and cut at RAG_MIN_SIMILARITY and at the
+        first large score gap; the best RAG_KEYWORD_EXEMPT_RANK keyword hits
+        are kept regardless of cosine. The survivors are ranked by the fused
+        cosine and keyword order and re-selected with MMR so near-duplicate
+        chunks are not returned together. Returns at most top_k chunks, or
+        None when nothing is relevant enough.
+        """
         if not is_rag_enabled():
             logger.info("RAG is disabled, skipping search")
             return None
             
-        client = LLMService.get_client()
-        if not client:
-            logger.error("Cannot search: OpenAI client initialization failed")
-            return None
-            
         try:
-            # Get embedding for query
-            query_embedding = RAGService.get_embedding(query, client)
-            if not query_embedding:
+            # 重複的查詢直接使用快取向量，省去一次 API 往返
+            query_np = RAGService.get_query_embedding(query)
+            if query_np is None:
                 return None
-                
-            query_np = np.array(query_embedding).astype('float32').reshape(1, -1)
             
-            # Load index
-            index, doc_embeddings = RAGService.initialize_index()
+            provider = RAGService.get_embedding_provider()
+            settings = get_retrieval_settings()
+            fetch_k = max(top_k, settings["candidates"])
             
-            # If index is empty, no results
-            if index.ntotal == 0:
+            shard_names = _shards.names()
+            if collections:
+                shard_names = [shard for shard in parse_collections(collections) if shard in shard_names]
+            
+            records, vector_blocks, keyword_scores, seen = [], [], [], set()
+            for shard in shard_names:
+                shard_records, shard_vectors, shard_keywords = RAGService._shard_candidates(
+                    shard, query, query_np, fetch_k, settings, provider
+                )
+                # 同時屬於多個集合的段落只保留一份
+                for record, vector in zip(shard_records, shard_vectors if shard_vectors is not None else ()):
+                    if record["chunk_id"] not in seen:
+                        seen.add(record["chunk_id"])
+                        records.append(record)
+                        vector_blocks.append(vector)
+                        keyword_scores.append(shard_keywords.get(record["chunk_id"], 0.0))
+            if not records:
                 return None
-                
-            # Search index
-            distances, indices = index.search(query_np, min(top_k, index.ntotal))
             
-            # Get results
-            results = []
-            for idx in indices[0]:
-                if idx in doc_embeddings:
-                    results.append(doc_embeddings[idx])
+            # 以候選段落的向量計算相似度，各分片的分數可直接比較；關鍵字排名前段者不受相似度門檻限制
+            vectors = np.vstack(vector_blocks)
+            similarities = cosine_similarities(query_np, vectors)
+            order, relevance = hybrid_cutoff(similarities, keyword_scores, settings["min_similarity"],
+                                             settings["score_gap"], settings["keyword_exempt_rank"],
+                                             settings["rrf_k"])
+            if len(order) == 0:
+                logger.info(f"No chunk reached similarity {settings['min_similarity']} "
+                            f"(best {similarities.max():.3f}), returning no context")
+                return None
+            
+            picked = mmr_select(vectors[order], relevance, top_k,
+                                settings["mmr_lambda"], settings["duplicate_similarity"])
             
+            results = []
+            for position in picked:
+                row = order[position]
+                result = records[row]
+                result["score"] = round(float(similarities[row]), 4)
+                results.append(result)
             return results
         except Exception as e:
             logger.error(f"Error searching FAISS index: {e}")
             return None
     
     @staticmethod
-    def get_context_for_query(query):
-        """Get context from knowledge base for a query"""
+    def collections_for_style(style_name=None):
+        """Collections a bot style searches, or None to search every shard
+
+        Without a style name the active style from the settings is used. A
+        style with no collections configured searches everything.
+        """
+        style_name = style_name or get_active_bot_style()
+        if not style_name:
+            return None
+        try:
+            from models import BotStyle
+            style = BotStyle.query.filter_by(name=style_name).first()
+            return parse_collections(style.collections) or None if style else None
+        except Exception as e:
+            logger.error(f"Error reading collections of style {style_name}: {e}")
+            return None
+    
+    @staticmethod
+    def get_context_for_query(query, style=None):
+        """Get context from knowledge base for a query, from the shards of the bot style"""
         if not is_rag_enabled():
             return None
             
-        results = RAGService.search(query)
+        results = RAGService.search(query, collections=RAGService.collections_for_style(style))
         if not results:
             return None
             
@@ -217,52 +644,227 @@ class RAGService:
         return context
     
     @staticmethod
-    def add_document(title, content, filename=None):
+    def add_document(title, content, filename=None, collections=None):
         """Add a document to the database and update the index"""
+        success, result = RAGService.add_documents([(title, content, filename)], collections)
+        if success and not result:
+            # 近似重複的文件在 skip 模式下不會加入
+            item = (RAGService.get_ingest_report() or {}).get("items", [{}])[0]
+            duplicate = item.get("duplicate_of", {})
+            return False, f"Skipped as a near-duplicate of \"{duplicate.get('title')}\" (similarity {item.get('similarity')})"
+        return (True, result[0]) if success else (False, result)
+            
+    @staticmethod
+    def _collect_blocks(blocks, sink):
+        """Pass text blocks through to the chunker while keeping them for the document content"""
+        for block in blocks:
+            sink.append(block)
+            yield block
+    
+    @staticmethod
+    def _load_duplicate_index(settings):
+        """Near-duplicate LSH index over all active documents, reconciled with the database
+
+        Returns (index, {document id: set of collections}).
+        """
+        Document = get_document_model()
+        dup_index = NearDuplicateIndex(MinHasher(shingle_size=settings["shingle_size"]))
+        dup_index.load(RAGService.DEDUP_SIGNATURES_PATH)
+        
+        doc_collections = {
+            row.id: set(document_collections(row))
+            for row in db.session.query(Document.id, Document.collections).filter_by(is_active=True)
+        }
+        active_ids = set(doc_collections)
+        for key in [key for key in dup_index.keys() if key not in active_ids]:
+            dup_index.remove(key)
+        
+        missing = active_ids.difference(dup_index.keys())
+        if missing:
+            logger.info(f"Computing near-duplicate signatures for {len(missing)} document(s)")
+            for doc in Document.query.filter(Document.id.in_(missing)).yield_per(100):
+                dup_index.add(doc.id, dup_index.hasher.signature(doc.content))
+        return dup_index, doc_collections
+    
+    @staticmethod
+    def _save_ingest_report(dup_index, report):
+        """Persist the signatures (when dedup ran) and the batch report; the documents are already committed"""
         try:
-            # Get Document model and add to database
-            Document = get_document_model()
-            doc = Document(
-                title=title,
-                content=content,
-                filename=filename,
-                is_active=True
-            )
+            os.makedirs(RAGService.KNOWLEDGE_BASE_DIR, exist_ok=True)
+            if dup_index is not None:
+                dup_index.save(RAGService.DEDUP_SIGNATURES_PATH)
+            tmp_path = f"{RAGService.INGEST_REPORT_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False)
+            os.replace(tmp_path, RAGService.INGEST_REPORT_PATH)
+        except Exception as e:
+            # 簽章會在下次載入時依資料庫補齊
+            logger.error(f"Error saving near-duplicate report: {e}")
+    
+    @staticmethod
+    def get_ingest_report():
+        """Near-duplicate report of the latest upload batch, or None"""
+        try:
+            with open(RAGService.INGEST_REPORT_PATH, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def add_documents(documents, collections=None):
+        """Add many (title, content, filename) documents in one transaction
 
-            db.session.add(doc)
-            db.session.commit()
+        ``content`` may be a string or an iterable of text blocks, such as
+        an upload decoded from disk; blocks are chunked as they arrive and
+        the chunks stored with the document. Exactly one incremental index
+        update is queued for all of the new documents. Returns
+        (True, [document ids]) or (False, error message). ``collections``
+        tags every document of the batch; untagged documents belong to the
+        default collection.
+
+        Each document is checked for near-duplicates among the existing
+        documents sharing one of its collections and earlier ones in the
+        batch (MinHash over character shingles, DEDUP_MODE): ``flag`` adds
+        it and reports the match, ``skip`` leaves it out, and ``merge``
+        replaces the matched document's content with it and adds the
+        batch's collections to it, so only one copy is embedded. The batch
+        report is kept for the knowledge-base page.
+        """
+        dedup = get_dedup_settings()
+        dedup_enabled = dedup["mode"] in ("flag", "skip", "merge")
+        report_items = []
+        added = 0
+        
+        try:
+            collections = format_collections(collections)
+            Document = get_document_model()
+            DocumentChunk = get_document_chunk_model()
+            dup_index, scope = None, None
+            if dedup_enabled:
+                dup_index, doc_collections = RAGService._load_duplicate_index(dedup)
+                # 只比對同一集合中的文件，其他集合的相同內容各自保留
+                targets = parse_collections(collections) or [DEFAULT_COLLECTION]
+                scope = {doc_id for doc_id, names in doc_collections.items() if names.intersection(targets)}
+            docs = []
+            for title, content, filename in documents:
+                chunk_texts = None
+                if not isinstance(content, str):
+                    # 邊解碼邊切分，文件內容欄位仍需保存完整文字
+                    blocks = []
+                    chunk_texts = list(TextChunker.chunk_stream(RAGService._collect_blocks(content, blocks)))
+                    content = "".join(blocks)
+                
+                match = None
+                if dedup_enabled:
+                    signature = dup_index.hasher.signature(content)
+                    match = dup_index.query(signature, dedup["threshold"], keys=scope)
+                
+                if match:
+                    target = Document.query.get(match[0])
+                    report_items.append({
+                        "title": title,
+                        "filename": filename,
+                        "action": {"flag": "flagged", "skip": "skipped", "merge": "merged"}[dedup["mode"]],
+                        "duplicate_of": {"id": target.id, "title": target.title},
+                        "similarity": round(match[1], 3)
+                    })
+                    logger.info(f"Document {title!r} is a near-duplicate of document {target.id} "
+                                f"(similarity {match[1]:.2f}), mode {dedup['mode']}")
+                    if dedup["mode"] == "skip":
+                        continue
+                
+                if match and dedup["mode"] == "merge":
+                    # 以較新的上傳內容取代舊文件，舊段落在重新索引時移除
+                    doc = target
+                    doc.title, doc.content, doc.filename = title, content, filename
+                    doc.collections = format_collections(document_collections(doc) + targets)
+                    DocumentChunk.query.filter_by(document_id=doc.id).delete(synchronize_session=False)
+                else:
+                    doc = Document(title=title, content=content, filename=filename,
+                                   collections=collections, is_active=True)
+                    db.session.add(doc)
+                    added += 1
+                
+                if chunk_texts is not None or dedup_enabled:
+                    db.session.flush()
+                if chunk_texts is not None:
+                    db.session.add_all(
+                        DocumentChunk(document_id=doc.id, chunk_index=i, content=text)
+                        for i, text in enumerate(chunk_texts)
+                    )
+                if dedup_enabled:
+                    dup_index.add(doc.id, signature)
+                    scope.add(doc.id)
+                if doc not in docs:
+                    docs.append(doc)
+            
+            if docs:
+                db.session.commit()
             
-            # Update index
-            RAGService.update_index()
+            # 每批都寫入報告，未檢查重複時為空，不會顯示上一批的結果
+            RAGService._save_ingest_report(dup_index, {
+                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "mode": dedup["mode"] if dedup_enabled else "off",
+                "threshold": dedup["threshold"],
+                "added": added,
+                "items": report_items
+            })
+            if not docs:
+                return True, []
             
-            return True, doc.id
+            doc_ids = [doc.id for doc in docs]
+            RAGService.schedule_index_update(index_ids=doc_ids)
+            logger.info(f"Added {added} documents, updated {len(doc_ids) - added}, "
+                        f"queued one index update for them")
+            return True, doc_ids
         except Exception as e:
-            logger.error(f"Error adding document: {e}")
+            logger.error(f"Error adding documents: {e}")
             db.session.rollback()
             return False, str(e)
-            
+    
     @staticmethod
-    def export_knowledge_base():
-        """Export all knowledge base documents as a downloadable file"""
+    def export_knowledge_base(export_format="markdown", batch_size=100):
+        """Export all knowledge base documents as a stream of str pieces
+
+        Documents are read in batches from a server-side cursor
+        (``yield_per``), so memory stays flat regardless of corpus size.
+        ``markdown`` is the readable export; ``jsonl`` writes one JSON
+        object per document with the fields add_documents takes, for
+        re-import. Must be consumed inside an app context.
+        """
+        Document = get_document_model()
+        
         try:
-            Document = get_document_model()
-            documents = Document.query.all()
+            # 先取得第一份文件再輸出標題，查詢失敗時第一段即拋出例外，呼叫端仍可回報錯誤
+            documents = iter(Document.query.order_by(Document.id).yield_per(batch_size))
+            first = next(documents, None)
+            documents = chain([first], documents) if first is not None else documents
+            if export_format == "jsonl":
+                for doc in documents:
+                    yield json.dumps({
+                        "id": doc.id,
+                        "title": doc.title,
+                        "filename": doc.filename,
+                        "uploaded_at": doc.uploaded_at.isoformat() if doc.uploaded_at else None,
+                        "is_active": doc.is_active,
+                        "collections": parse_collections(doc.collections),
+                        "content": doc.content
+                    }, ensure_ascii=False) + "\n"
+                return
             
             # Create a formatted text file with all documents
-            export_content = "# FlyPig 知識庫匯出\n\n"
-            
+            yield "# FlyPig 知識庫匯出\n\n"
             for i, doc in enumerate(documents, 1):
-                export_content += f"## {i}. {doc.title}\n"
+                yield f"## {i}. {doc.title}\n"
                 if doc.filename:
-                    export_content += f"來源: {doc.filename}\n"
-                export_content += f"上傳時間: {doc.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-                export_content += f"{doc.content}\n\n"
-                export_content += "---\n\n"
-            
-            return export_content
+                    yield f"來源: {doc.filename}\n"
+                yield f"上傳時間: {doc.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+                yield doc.content
+                yield "\n\n---\n\n"
         except Exception as e:
+            # 回應已開始傳送，只能記錄錯誤並結束串流
             logger.error(f"Error exporting knowledge base: {e}")
-            return None
+            raise
     
     @staticmethod
     def delete_document(doc_id):
@@ -273,14 +875,27 @@ class RAGService:
             if not doc:
                 return False, "Document not found"
                 
+            # 先刪除段落，避免外鍵約束失敗
+            DocumentChunk = get_document_chunk_model()
+            DocumentChunk.query.filter_by(document_id=doc_id).delete()
             db.session.delete(doc)
             db.session.commit()
             
-            # Update index
-            RAGService.update_index()
+            # 只從索引移除此文件的向量，由背景工作處理
+            RAGService.schedule_index_update(remove_ids=[doc_id])
             
             return True, "Document deleted successfully"
         except Exception as e:
             logger.error(f"Error deleting document: {e}")
             db.session.rollback()
             return False, str(e)
+
+# 行程層級的索引副本，所有查詢共用
+_shards = ShardRegistry(RAGService.KNOWLEDGE_BASE_DIR,
+                        lambda shard: RAGService.initialize_index(read_only=True, shard=shard))
+
+# 查詢向量快取，常見問候與常見問題不必每次呼叫 API
+_query_cache = QueryEmbeddingCache(maxsize=RAGService.QUERY_CACHE_SIZE, ttl=RAGService.QUERY_CACHE_TTL)
+
+# 背景索引工作佇列，網頁請求只負責排入工作
+_index_jobs = IndexJobQueue(RAGService._run_index_job, RAGService.JOB_STATUS_PATH, RAGService.JOB_LOCK_PATH)
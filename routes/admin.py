@@ -7,6 +7,7 @@ from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from forms import LLMSettingsForm, BotStyleForm, BotSettingsForm, DocumentForm, UserForm, BulkUploadForm
 from routes.utils.config_service import ConfigManager
+from services.shards import format_style_collections
 
 # 創建藍圖但不直接導入可能導致循環引用的模塊
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -179,12 +180,19 @@ def add_bot_style():
             flash(f'A style with name "{form.name.data}" already exists.', 'danger')
             return redirect(url_for('admin.bot-styles'))
         
+        try:
+            collections = format_style_collections(form.collections.data)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.bot-styles'))
+        
         # Create new style
         style = BotStyle(
             name=form.name.data,
             prompt=form.prompt.data,
             description=form.description.data,
-            is_default=form.is_default.data
+            is_default=form.is_default.data,
+            collections=collections
         )
         
         # If this is set as default, update other styles
@@ -224,10 +232,17 @@ def edit_bot_style(style_id):
                 flash(f'A style with name "{form.name.data}" already exists.', 'danger')
                 return redirect(url_for('admin.bot-styles'))
         
+        try:
+            collections = format_style_collections(form.collections.data)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.bot-styles'))
+        
         # Update style
         style.name = form.name.data
         style.prompt = form.prompt.data
         style.description = form.description.data
+        style.collections = collections
         
         # Handle default status
         if form.is_default.data and not style.is_default:
@@ -406,43 +421,64 @@ def knowledge_base():
     from sqlalchemy import desc
     documents = db.session.query(Document).order_by(desc('uploaded_at')).all()
     form = DocumentForm()
-    return render_template('knowledge_base.html', documents=documents, form=form)
+    
+    # 最近一批上傳的近似重複檢查結果
+    ingest_report = get_rag_service().get_ingest_report()
+    return render_template('knowledge_base.html', documents=documents, form=form, ingest_report=ingest_report)
 
 @admin_bp.route('/knowledge_base/add', methods=['POST'])
 @admin_required
 def add_document():
     """Add a document to the knowledge base"""
+    from services.upload_service import UploadSpooler, UploadTooLargeError
+    from services.text_extractors import iter_text
+    
+    spooler = UploadSpooler()
+    # 超過請求大小上限時不解析內容，直接拒絕
+    if spooler.request_too_large(request):
+        flash(f'上傳內容超過 {spooler.max_request_bytes // (1024 * 1024)} MB 上限', 'danger')
+        return redirect(url_for('admin.knowledge_base'))
+    
     form = DocumentForm()
     
     if form.validate_on_submit():
-        title = form.title.data
-        content = form.content.data
-        filename = None
-        
-        # Handle file upload
-        if form.file.data:
-            # Process file content
-            file = form.file.data
-            filename = secure_filename(file.filename)
+        with spooler:
+            title = form.title.data
+            content = form.content.data
+            filename = None
             
-            # Read file content
-            file_content = file.read().decode('utf-8', errors='replace')
+            # Handle file upload
+            if form.file.data:
+                file = form.file.data
+                filename = secure_filename(file.filename)
+                
+                # 有上傳檔案時以檔案內容為準，文字欄位可能只是瀏覽器端的預覽或提示文字
+                try:
+                    path, size = spooler.spool(file)
+                except UploadTooLargeError as e:
+                    flash(f'上傳檔案過大: {e}', 'danger')
+                    return redirect(url_for('admin.knowledge_base'))
+                if size:
+                    # PDF/DOCX/MD 在行程池中轉為純文字
+                    extension = file.filename.rsplit('.', 1)[-1].lower()
+                    for _, text_path, characters, error in spooler.extract([(filename, extension, path)]):
+                        if error:
+                            flash(f'無法讀取檔案 {file.filename}: {error}', 'danger')
+                            return redirect(url_for('admin.knowledge_base'))
+                        if characters:
+                            content = iter_text(text_path)
             
-            # If no content was provided in the form, use file content
+            # Ensure we have content
             if not content:
-                content = file_content
-        
-        # Ensure we have content
-        if not content:
-            flash('文件必須包含內容，可以從文字欄位或上傳檔案獲取', 'danger')
-            return redirect(url_for('admin.knowledge_base'))
-        
-        # 取得 RAG 服務並添加文檔
-        RAGService = get_rag_service()
-        success, result = RAGService.add_document(title, content, filename)
+                flash('文件必須包含內容，可以從文字欄位或上傳檔案獲取', 'danger')
+                return redirect(url_for('admin.knowledge_base'))
+            
+            # 取得 RAG 服務並添加文檔
+            RAGService = get_rag_service()
+            success, result = RAGService.add_document(title, content, filename, form.collections.data)
         
         if success:
-            flash(f'文件 "{title}" 添加成功', 'success')
+            flash(f'文件 "{title}" 添加成功，索引將在背景更新', 'success')
         else:
             flash(f'添加文件錯誤: {result}', 'danger')
     else:
@@ -456,8 +492,18 @@ def add_document():
 @admin_required
 def bulk_upload():
     """Bulk upload multiple documents to the knowledge base"""
+    from services.upload_service import UploadSpooler, UploadTooLargeError
+    from services.text_extractors import iter_text
+    
     # 獲取 RAG 服務
     RAGService = get_rag_service()
+    
+    spooler = UploadSpooler()
+    # 超過請求大小上限時不解析內容，直接拒絕
+    if spooler.request_too_large(request):
+        flash(f'上傳內容超過 {spooler.max_request_bytes // (1024 * 1024)} MB 上限', 'danger')
+        return redirect(url_for('admin.knowledge_base'))
+    
     if 'files' not in request.files:
         flash('未選擇任何檔案', 'danger')
         return redirect(url_for('admin.knowledge_base'))
@@ -473,43 +519,70 @@ def bulk_upload():
     # Allowed file extensions
     allowed_extensions = ['txt', 'pdf', 'docx', 'md']
     
-    success_count = 0
+    spooled = []
     error_count = 0
     
-    for file in files:
-        # Check if file extension is allowed
-        if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
-            flash(f'不支援的檔案格式: {file.filename}', 'warning')
-            error_count += 1
-            continue
-            
-        try:
-            # Create a title from the filename (without extension)
-            raw_title = file.filename.rsplit('.', 1)[0]
-            # Format title: replace underscore and dash with space, capitalize words
-            formatted_title = ' '.join(word.capitalize() for word in raw_title.replace('_', ' ').replace('-', ' ').split())
-            title = f"{title_prefix}{formatted_title}" if title_prefix else formatted_title
-            
-            # Read file content
-            content = file.read().decode('utf-8', errors='replace')
-            
-            if not content.strip():
-                flash(f'檔案 {file.filename} 是空的', 'warning')
+    with spooler:
+        for file in files:
+            # Check if file extension is allowed
+            if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+                flash(f'不支援的檔案格式: {file.filename}', 'warning')
                 error_count += 1
                 continue
                 
-            # Add to database
-            success, result = RAGService.add_document(title, content, file.filename)
+            try:
+                # Create a title from the filename (without extension)
+                raw_title, extension = file.filename.rsplit('.', 1)
+                # Format title: replace underscore and dash with space, capitalize words
+                formatted_title = ' '.join(word.capitalize() for word in raw_title.replace('_', ' ').replace('-', ' ').split())
+                title = f"{title_prefix}{formatted_title}" if title_prefix else formatted_title
+                
+                # 檔案先串流寫入暫存檔，內容在寫入資料庫時才逐塊解碼
+                path, size = spooler.spool(file)
+                
+                if not size:
+                    flash(f'檔案 {file.filename} 是空的', 'warning')
+                    error_count += 1
+                    continue
+                
+                spooled.append((title, file.filename, extension.lower(), path))
             
+            except UploadTooLargeError as e:
+                flash(f'上傳檔案過大: {e}', 'danger')
+                error_count += 1
+                if e.per_request:
+                    break
+            except Exception as e:
+                flash(f'處理檔案 {file.filename} 時發生錯誤: {str(e)}', 'danger')
+                error_count += 1
+        
+        def extracted_documents():
+            """Yield documents as the process pool finishes extracting each file"""
+            nonlocal error_count
+            items = [(i, extension, path) for i, (_, _, extension, path) in enumerate(spooled)]
+            for i, text_path, characters, error in spooler.extract(items):
+                title, filename = spooled[i][0], spooled[i][1]
+                if error:
+                    flash(f'無法讀取檔案 {filename}: {error}', 'danger')
+                    error_count += 1
+                elif not characters:
+                    flash(f'檔案 {filename} 沒有可擷取的文字', 'warning')
+                    error_count += 1
+                else:
+                    yield title, iter_text(text_path), filename
+        
+        # 所有文件在同一個交易中寫入，並只排入一次索引更新
+        success_count = 0
+        if spooled:
+            success, result = RAGService.add_documents(extracted_documents(), request.form.get('collections', ''))
             if success:
-                success_count += 1
+                success_count = len(result)
+                duplicates = (RAGService.get_ingest_report() or {}).get('items', [])
+                if duplicates:
+                    flash(f'{len(duplicates)} 個文件與既有文件內容近似，詳見下方的重複檢查報告', 'info')
             else:
-                flash(f'添加文件 {file.filename} 錯誤: {result}', 'danger')
-                error_count += 1
-                
-        except Exception as e:
-            flash(f'處理檔案 {file.filename} 時發生錯誤: {str(e)}', 'danger')
-            error_count += 1
+                flash(f'添加文件錯誤: {result}', 'danger')
+                error_count += len(spooled)
     
     # Show summary
     if success_count > 0:
@@ -518,10 +591,6 @@ def bulk_upload():
     if error_count > 0:
         flash(f'{error_count} 個文件處理失敗', 'warning')
     
-    # Rebuild index if any document was added successfully
-    if success_count > 0:
-        RAGService.update_index()
-        
     return redirect(url_for('admin.knowledge_base'))
 
 @admin_bp.route('/knowledge_base/delete/<int:doc_id>', methods=['POST'])
@@ -558,62 +627,100 @@ def view_document(doc_id):
 @admin_bp.route('/knowledge_base/download/<int:doc_id>')
 @admin_required
 def download_document(doc_id):
-    """Download a document's content as a text file"""
-    from flask import Response
+    """Download a document's content as a text file, streamed in blocks"""
+    from flask import Response, stream_with_context
+    from sqlalchemy.orm import defer
+    from services.export_stream import encode_stream, gzip_stream, column_blocks
     
     # 獲取數據庫會話和模型
     db = get_db()
     _, _, _, _, Document = get_models()
     
-    document = db.session.query(Document).get_or_404(doc_id)
+    # 內容欄位延後載入，傳送時以單一串流查詢讀取
+    document = db.session.query(Document).options(defer(Document.content)).get_or_404(doc_id)
+    compress = request.args.get('gzip') == '1'
     
-    # Create a response with the document content
-    response = Response(document.content)
+    # 分段編碼傳送，不在記憶體中另建整份位元組副本
+    content = column_blocks(db.session.query(Document).filter(Document.id == doc_id), Document.content)
+    body = encode_stream(content)
+    if compress:
+        body = gzip_stream(body)
+    response = Response(stream_with_context(body), mimetype='application/gzip' if compress else 'text/plain')
     
     # Set the appropriate headers for file download
-    response.headers['Content-Type'] = 'text/plain'
-    response.headers['Content-Disposition'] = f'attachment; filename="{document.title}.txt"'
+    filename = f"{document.title}.txt.gz" if compress else f"{document.title}.txt"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
     
     return response
 
 @admin_bp.route('/knowledge_base/rebuild_index', methods=['POST'])
 @admin_required
 def rebuild_index():
-    """Rebuild the FAISS index"""
+    """Queue a rebuild of the FAISS index on the background worker"""
     # 獲取 RAG 服務
     RAGService = get_rag_service()
     
-    success = RAGService.update_index()
+    status = RAGService.schedule_index_update(rebuild=True)
     
-    if success:
-        flash('Knowledge base index rebuilt successfully.', 'success')
+    if status.get('state') == 'running':
+        flash('Another index job is running, the rebuild will start when it finishes.', 'info')
     else:
-        flash('Error rebuilding knowledge base index.', 'danger')
+        flash('Knowledge base index rebuild queued.', 'success')
     
     return redirect(url_for('admin.knowledge_base'))
 
+@admin_bp.route('/knowledge_base/index_status')
+@admin_required
+def index_status():
+    """Status and progress of the background index job as JSON"""
+    RAGService = get_rag_service()
+    return jsonify(RAGService.get_index_job_status())
+
 @admin_bp.route('/knowledge_base/export')
 @admin_required
 def export_knowledge_base():
-    """Export all knowledge base documents as a downloadable file"""
-    from flask import Response
+    """Export all knowledge base documents as a streamed Markdown or JSONL file
+
+    Query parameters: ``format`` (markdown or jsonl) and ``gzip=1`` to
+    compress the download.
+    """
+    from itertools import chain
+    from flask import Response, stream_with_context
+    from services.export_stream import encode_stream, gzip_stream
     
     # 獲取 RAG 服務
     RAGService = get_rag_service()
     
-    # Get exported content
-    content = RAGService.export_knowledge_base()
+    export_format = request.args.get('format', 'markdown').lower()
+    if export_format not in ('markdown', 'jsonl'):
+        flash(f'Unsupported export format: {export_format}', 'danger')
+        return redirect(url_for('admin.knowledge_base'))
+    compress = request.args.get('gzip') == '1'
     
-    if not content:
+    # 先取得第一段內容，查詢失敗時仍可回到頁面顯示錯誤
+    pieces = RAGService.export_knowledge_base(export_format)
+    try:
+        first = next(pieces, "")
+    except Exception:
         flash('Error exporting knowledge base.', 'danger')
         return redirect(url_for('admin.knowledge_base'))
     
-    # Create a response with the document content
-    response = Response(content)
+    body = encode_stream(chain([first], pieces))
+    if compress:
+        body = gzip_stream(body)
+    
+    if export_format == 'jsonl':
+        filename, mimetype = "flypig_knowledge_base_export.jsonl", 'application/x-ndjson'
+    else:
+        filename, mimetype = "flypig_knowledge_base_export.md", 'text/markdown'
+    if compress:
+        filename, mimetype = filename + ".gz", 'application/gzip'
+    
+    # 以串流回應逐批傳送，記憶體用量不隨知識庫大小增長
+    response = Response(stream_with_context(body), mimetype=mimetype)
     
     # Set the appropriate headers for file download
-    response.headers['Content-Type'] = 'text/markdown'
-    response.headers['Content-Disposition'] = f'attachment; filename="flypig_knowledge_base_export.md"'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
     
     return response
 
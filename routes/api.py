@@ -28,9 +28,13 @@ def stats():
         return jsonify({'error': '您沒有權限'}), 403
     
     from models import LineUser, ChatMessage, Document
+    from rag_service import RAGService
+    from services.response_cache import ResponseCacheService
     
     return jsonify({
         'line_users': LineUser.query.count(),
         'messages': ChatMessage.query.count(),
-        'documents': Document.query.count()
+        'documents': Document.query.count(),
+        'query_embedding_cache': RAGService.get_query_cache_stats(),
+        'response_cache': ResponseCacheService.stats()
     }) 
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import time
 
 class ConfigManager:
     """Configuration manager for the application"""
@@ -6,12 +7,21 @@ class ConfigManager:
     # Cache for configuration values
     _config_cache = {}
     
+    # 資料庫中沒有的設定只記錄幾秒，避免每次讀取預設值都查詢資料庫，
+    # 又能讓其他 worker 在管理介面儲存後很快讀到新值
+    _MISSING = object()
+    MISSING_TTL = 5.0
+    
     @staticmethod
     def get(key, default=None):
         """Get a configuration value from the database or cache"""
         # Try to get the value from cache first
         if key in ConfigManager._config_cache:
-            return ConfigManager._config_cache[key]
+            value = ConfigManager._config_cache[key]
+            if not isinstance(value, tuple) or value[0] is not ConfigManager._MISSING:
+                return value
+            if time.monotonic() < value[1]:
+                return default
         
         # Check environment variables first
         env_value = os.environ.get(key)
@@ -31,6 +41,9 @@ class ConfigManager:
                 if config_entry and config_entry.value:
                     ConfigManager._config_cache[key] = config_entry.value
                     return config_entry.value
+                # 未設定的項目短暫記錄，過期後再查詢資料庫
+                ConfigManager._config_cache[key] = (ConfigManager._MISSING,
+                                                    time.monotonic() + ConfigManager.MISSING_TTL)
         except RuntimeError:
             # 如果不在應用上下文內，返回默認值
             pass
@@ -90,6 +103,11 @@ class ConfigManager:
                 
         return result
     
+    @staticmethod
+    def invalidate(key):
+        """Forget the cached value of one key, e.g. after it was written elsewhere"""
+        ConfigManager._config_cache.pop(key, None)
+    
     @staticmethod
     def clear_cache():
         """Clear the configuration cache"""
@@ -99,6 +117,19 @@ class ConfigManager:
 def get_openai_api_key():
     return ConfigManager.get("OPENAI_API_KEY", "")
 
+# Helper function to get OpenAI connection pool settings
+def get_openai_client_settings():
+    return {
+        # 留空使用 OpenAI 官方端點
+        "base_url": ConfigManager.get("OPENAI_BASE_URL", "") or None,
+        "max_connections": int(ConfigManager.get("OPENAI_MAX_CONNECTIONS", "50")),
+        "max_keepalive_connections": int(ConfigManager.get("OPENAI_MAX_KEEPALIVE", "20")),
+        "keepalive_expiry": float(ConfigManager.get("OPENAI_KEEPALIVE_EXPIRY", "60")),
+        "timeout": float(ConfigManager.get("OPENAI_TIMEOUT", "60")),
+        "connect_timeout": float(ConfigManager.get("OPENAI_CONNECT_TIMEOUT", "5")),
+        "max_retries": int(ConfigManager.get("OPENAI_MAX_RETRIES", "2"))
+    }
+
 # Helper function to get LINE channel configuration
 def get_line_config():
     return {
@@ -134,4 +165,94 @@ def is_web_search_enabled():
 
 # Helper function to get the SerpAPI key
 def get_serpapi_key():
-    return ConfigManager.get("SERPAPI_KEY", "")
\ No newline at end of file
+    return ConfigManager.get("SERPAPI_KEY", "")
+
+# Helper function to get embedding batching settings
+def get_embedding_settings():
+    return {
+        "batch_token_budget": int(ConfigManager.get("EMBEDDING_BATCH_TOKENS", "60000")),
+        "max_concurrency": int(ConfigManager.get("EMBEDDING_MAX_CONCURRENCY", "4")),
+        # openai、onnx (本機 CPU 模型) 或 hashing (測試用)
+        "backend": (ConfigManager.get("EMBEDDING_BACKEND", "openai") or "openai").lower(),
+        "model": ConfigManager.get("EMBEDDING_MODEL", "text-embedding-3-small"),
+        "onnx_model_path": ConfigManager.get("EMBEDDING_ONNX_MODEL_PATH", "knowledge_base/onnx_model"),
+        "hash_dim": int(ConfigManager.get("EMBEDDING_HASH_DIM", "384"))
+    }
+
+# Helper function to get document chunking settings
+def get_chunk_settings():
+    return {
+        "chunk_size": int(ConfigManager.get("RAG_CHUNK_SIZE", "400")),
+        "chunk_overlap": int(ConfigManager.get("RAG_CHUNK_OVERLAP", "80"))
+    }
+
+# Helper function to get vector index settings
+def get_index_settings():
+    return {
+        "index_type": ConfigManager.get("RAG_INDEX_TYPE", "auto"),
+        "ivf_nprobe": int(ConfigManager.get("RAG_IVF_NPROBE", "16")),
+        "hnsw_m": int(ConfigManager.get("RAG_HNSW_M", "32")),
+        "hnsw_ef_construction": int(ConfigManager.get("RAG_HNSW_EF_CONSTRUCTION", "80")),
+        "hnsw_ef_search": int(ConfigManager.get("RAG_HNSW_EF_SEARCH", "64")),
+        "mmap": ConfigManager.get("RAG_INDEX_MMAP", "True").lower() == "true"
+    }
+
+# Helper function to get hybrid retrieval settings
+def get_retrieval_settings():
+    return {
+        "hybrid": ConfigManager.get("RAG_HYBRID_SEARCH", "True").lower() == "true",
+        "rrf_k": int(ConfigManager.get("RAG_RRF_K", "60")),
+        "candidates": int(ConfigManager.get("RAG_SEARCH_CANDIDATES", "20")),
+        # 餘弦相似度門檻與分數落差，低於門檻時不提供任何知識庫內容
+        "min_similarity": float(ConfigManager.get("RAG_MIN_SIMILARITY", "0.3")),
+        "score_gap": float(ConfigManager.get("RAG_SCORE_GAP", "0.15")),
+        # 關鍵字 (BM25) 排名前幾名的段落即使向量相似度低也保留，例如產品代碼
+        "keyword_exempt_rank": int(ConfigManager.get("RAG_KEYWORD_EXEMPT_RANK", "3")),
+        "mmr_lambda": float(ConfigManager.get("RAG_MMR_LAMBDA", "0.7")),
+        "duplicate_similarity": float(ConfigManager.get("RAG_DUPLICATE_SIMILARITY", "0.95"))
+    }
+
+# Helper function to get knowledge-base upload size limits
+def get_upload_settings():
+    return {
+        "max_file_bytes": int(ConfigManager.get("UPLOAD_MAX_FILE_MB", "20")) * 1024 * 1024,
+        "max_request_bytes": int(ConfigManager.get("UPLOAD_MAX_REQUEST_MB", "100")) * 1024 * 1024,
+        # 0 表示使用所有 CPU 核心
+        "extract_workers": int(ConfigManager.get("UPLOAD_EXTRACT_WORKERS", "0"))
+    }
+
+# Helper function to get near-duplicate detection settings
+def get_dedup_settings():
+    return {
+        # off、flag (照常加入並標記)、skip (不加入) 或 merge (以新內容取代舊文件)
+        "mode": (ConfigManager.get("DEDUP_MODE", "flag") or "flag").lower(),
+        "threshold": float(ConfigManager.get("DEDUP_THRESHOLD", "0.85")),
+        "shingle_size": int(ConfigManager.get("DEDUP_SHINGLE_SIZE", "5"))
+    }
+
+# Helper function to get semantic response cache settings
+def get_response_cache_settings():
+    return {
+        "enabled": ConfigManager.get("RESPONSE_CACHE_ENABLED", "True").lower() == "true",
+        # 查詢向量的餘弦相似度達到門檻才視為同一個問題
+        "threshold": float(ConfigManager.get("RESPONSE_CACHE_THRESHOLD", "0.95")),
+        "max_entries": int(ConfigManager.get("RESPONSE_CACHE_SIZE", "1000")),
+        "ttl": int(ConfigManager.get("RESPONSE_CACHE_TTL", "86400"))
+    }
+
+# Helper function to get streamed LINE reply settings
+def get_streaming_settings():
+    return {
+        "enabled": ConfigManager.get("LLM_STREAMING_ENABLED", "False").lower() == "true",
+        # 第一句至少要有的字數，避免只回覆「好的！」這類過短的訊息
+        "first_min_chars": int(ConfigManager.get("LLM_STREAMING_FIRST_MIN_CHARS", "15"))
+    }
+
+# Helper function to get asyncio message pipeline settings
+def get_pipeline_settings():
+    return {
+        "enabled": ConfigManager.get("ASYNC_PIPELINE_ENABLED", "False").lower() == "true",
+        # 執行資料庫與同步函式庫呼叫的執行緒數量
+        "workers": int(ConfigManager.get("ASYNC_PIPELINE_WORKERS", "8")),
+        "timeout": float(ConfigManager.get("ASYNC_PIPELINE_TIMEOUT", "90"))
+    }
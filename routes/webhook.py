@@ -1,4 +1,5 @@
 import json
+import time
 import logging
 import os
 from flask import Blueprint, request, abort
@@ -12,7 +13,10 @@ from llm_service import LLMService
 # 避免循環導入
 # from rag_service import RAGService
 from web_search_service import WebSearchService
-from routes.utils.config_service import get_line_config
+from services.response_cache import ResponseCacheService
+from services.line_stream import LineStreamDelivery
+from services.message_pipeline import message_pipeline
+from routes.utils.config_service import get_line_config, get_streaming_settings, get_pipeline_settings
 
 # 創建藍圖
 webhook_bp = Blueprint('webhook', __name__)
@@ -77,6 +81,13 @@ def handle_text_message(event):
         user_id = event.source.user_id
         user_message = event.message.text
         logger.info(f"Received message from {user_id}: {user_message[:50]}...")
+        started = time.perf_counter()
+        
+        # 一般訊息交由非同步管線處理，各階段可同時進行；指令仍使用以下的循序流程
+        # 管線自行處理錯誤與逾時並回覆，不會進入下方的錯誤回覆
+        if not user_message.startswith('/') and get_pipeline_settings()["enabled"]:
+            message_pipeline.handle(event)
+            return
         
         # 使用重試機制處理數據庫操作
         for db_attempt in range(max_db_retries):
@@ -128,7 +139,6 @@ def handle_text_message(event):
                 
                 if db_attempt < max_db_retries - 1:
                     # 如果還有重試機會，等待後重試
-                    import time
                     time.sleep(db_retry_delay)
                     db_retry_delay *= 2  # 指數退避
                 else:
@@ -137,6 +147,7 @@ def handle_text_message(event):
         
         # 檢查風格命令
         bot_style = None
+        already_sent = False
         if user_message.startswith('/style '):
             try:
                 style_name = user_message[7:].strip()
@@ -202,21 +213,41 @@ def handle_text_message(event):
         # 常規消息處理
         else:
             try:
-                # 如果启用了 RAG，获取上下文
-                rag_context = None
-                try:
-                    # 動態導入 RAGService 避免循環導入
-                    from rag_service import RAGService
-                    rag_context = RAGService.get_context_for_query(user_message)
-                except Exception as rag_error:
-                    logger.error(f"Error getting RAG context: {rag_error}")
-                
                 # 使用用戶的首選風格（如果已設置）
                 if hasattr(line_user, 'active_style') and line_user.active_style:
                     bot_style = line_user.active_style
                 
-                # 使用 OpenAI 生成回應
-                response_text = LLMService.generate_response(user_message, bot_style, rag_context)
+                # 語意相近的問題直接使用快取的回答，省去檢索與 LLM 呼叫
+                cached_text, cache_ticket = ResponseCacheService.lookup(user_message, bot_style)
+                if cached_text:
+                    response_text = cached_text
+                else:
+                    # 如果启用了 RAG，获取上下文，只搜尋此風格對應的知識庫集合
+                    rag_context = None
+                    try:
+                        # 動態導入 RAGService 避免循環導入
+                        from rag_service import RAGService
+                        rag_context = RAGService.get_context_for_query(user_message, bot_style)
+                    except Exception as rag_error:
+                        logger.error(f"Error getting RAG context: {rag_error}")
+                    
+                    streaming = get_streaming_settings()
+                    if streaming["enabled"]:
+                        # 串流生成：第一句完成就用 reply token 回覆，其餘以推播訊息送出
+                        response_text, complete = LineStreamDelivery.deliver(
+                            get_line_bot_api(), event.reply_token, LineStreamDelivery.push_target(event.source),
+                            LLMService.stream_response(user_message, bot_style, rag_context),
+                            streaming["first_min_chars"]
+                        )
+                        already_sent = True
+                    else:
+                        # 使用 OpenAI 生成回應
+                        response_text = LLMService.generate_response(user_message, bot_style, rag_context,
+                                                                     raise_errors=True)
+                        complete = True
+                    # 只快取完整且成功的回答
+                    if complete:
+                        ResponseCacheService.store(cache_ticket, response_text)
             except Exception as llm_error:
                 logger.error(f"Error generating response: {llm_error}")
                 response_text = "很抱歉，生成回應時出現問題，請稍後再試。"
@@ -242,14 +273,15 @@ def handle_text_message(event):
             db.session.rollback()
             # 繼續發送回應，即使無法保存到數據庫
         
-        # 發送回應
+        # 發送回應（串流模式已在生成時送出）
         try:
-            line_bot_api = get_line_bot_api()
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=response_text)
-            )
-            logger.info(f"Successfully sent response to {user_id}")
+            if not already_sent:
+                # 超過單則訊息長度的回答（例如快取的長篇回答）會分段送出
+                line_bot_api = get_line_bot_api()
+                LineStreamDelivery.reply_text(line_bot_api, event.reply_token,
+                                              LineStreamDelivery.push_target(event.source), response_text)
+            logger.info(f"Successfully sent response to {user_id} "
+                        f"in {(time.perf_counter() - started) * 1000:.0f}ms")
         except Exception as reply_error:
             logger.error(f"Error sending response: {reply_error}")
             # 這裡我們無法重試，因為 LINE 的 reply token 只能使用一次
@@ -0,0 +1,215 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingProvider:
+    """Common interface of the embedding backends
+
+    ``identity`` names the backend, model and dimension together. It keys
+    the embedding caches and is recorded with the index, so vectors from
+    different models are never mixed in one index.
+    """
+
+    backend = None
+    # 可同時送出的批次數，本機模型由執行環境自行平行化
+    concurrency = 1
+    BATCH_SIZE = 64
+
+    def __init__(self, model, dim):
+        self.model = model
+        self.dim = dim
+
+    @property
+    def identity(self):
+        return f"{self.backend}:{self.model}:{self.dim}"
+
+    def connect(self):
+        """Per-call handle passed to embed_batch, or None when the backend is unavailable"""
+        return self
+
+    def make_batches(self, texts, token_budget=None):
+        """Group text positions into batches"""
+        return [list(range(i, min(i + self.BATCH_SIZE, len(texts)))) for i in range(0, len(texts), self.BATCH_SIZE)]
+
+    def embed_batch(self, texts, connection):
+        """Embed one batch as a (len(texts), dim) float32 array, or None on failure"""
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings endpoint, with token-packed batches and retries"""
+
+    backend = "openai"
+
+    # OpenAI 單次請求的上限
+    MAX_INPUTS_PER_REQUEST = 2048
+    MAX_TOKENS_PER_INPUT = 8191
+
+    DIMENSIONS = {
+        "text-embedding-3-small": 1536,
+        "text-embedding-3-large": 3072,
+        "text-embedding-ada-002": 1536
+    }
+
+    def __init__(self, model, client_factory, concurrency=4):
+        super().__init__(model, self.DIMENSIONS.get(model, 1536))
+        self._client_factory = client_factory
+        self.concurrency = concurrency
+
+    def connect(self):
+        return self._client_factory()
+
+    @staticmethod
+    def estimate_tokens(text):
+        """Cheap upper-bound token estimate without a tokenizer
+
+        ASCII text averages about four characters per token, while CJK
+        characters often take one or two tokens each, so they are counted
+        pessimistically.
+        """
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        other_chars = len(text) - ascii_chars
+        return ascii_chars // 4 + other_chars * 2 + 1
+
+    def make_batches(self, texts, token_budget=None):
+        """Group text positions into batches that fit a per-request token budget"""
+        token_budget = token_budget or 60000
+        batches = []
+        current, current_tokens = [], 0
+
+        for i, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+
+            # 超長文字單獨成批，失敗時不影響其他文字
+            if tokens >= self.MAX_TOKENS_PER_INPUT:
+                batches.append([i])
+                continue
+
+            if current and (current_tokens + tokens > token_budget
+                            or len(current) >= self.MAX_INPUTS_PER_REQUEST):
+                batches.append(current)
+                current, current_tokens = [], 0
+
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed_batch(self, texts, connection, max_retries=3):
+        """Embed one batch in a single request, retrying the whole batch with backoff"""
+        retry_delay = 1
+
+        for attempt in range(max_retries):
+            try:
+                response = connection.embeddings.create(model=self.model, input=texts)
+                # 依 index 排序，確保結果與輸入順序一致
+                data = sorted(response.data, key=lambda item: item.index)
+                return np.array([item.embedding for item in data], dtype='float32')
+            except Exception as e:
+                logger.warning(f"Embedding batch of {len(texts)} failed (attempt {attempt+1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(retry_delay)
+                    retry_delay *= 2
+
+        return None
+
+
+class OnnxEmbeddingProvider(EmbeddingProvider):
+    """Local CPU sentence-embedding model exported to ONNX
+
+    ``model_path`` is a directory holding ``model.onnx`` and the Hugging
+    Face ``tokenizer.json`` of a sentence-transformers model, for example
+    paraphrase-multilingual-MiniLM-L12-v2, which handles Traditional
+    Chinese. Token embeddings are mean-pooled and L2-normalized. Needs the
+    optional onnxruntime and tokenizers packages.
+    """
+
+    backend = "onnx"
+    MAX_LENGTH = 256
+
+    def __init__(self, model_path, threads=0):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError("The onnx embedding backend requires the onnxruntime and tokenizers packages")
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_path, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=self.MAX_LENGTH)
+        self._tokenizer.enable_padding()
+        self._input_names = {item.name for item in self._session.get_inputs()}
+        # 推論階段共用同一個工作階段，以鎖保護分詞器的設定狀態
+        self._lock = threading.Lock()
+
+        super().__init__(os.path.basename(os.path.normpath(model_path)), 0)
+        self.dim = int(self._run(["dimension probe"]).shape[1])
+
+    def _run(self, texts):
+        with self._lock:
+            encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        output = self._session.run(None, feeds)[0]
+        if output.ndim == 3:
+            # 依注意力遮罩平均各詞向量
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+        return (output / norms).astype('float32')
+
+    def embed_batch(self, texts, connection):
+        try:
+            return self._run(texts)
+        except Exception as e:
+            logger.error(f"Local embedding batch of {len(texts)} failed: {e}")
+            return None
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Deterministic feature-hashing embeddings, for tests and benchmarks
+
+    Texts are tokenized like the keyword index (CJK bigrams, whole
+    alphanumeric words) and each token adds a signed, log-scaled count to
+    one of ``dim`` buckets. No network or model is involved, and texts
+    that share words get similar vectors.
+    """
+
+    backend = "hashing"
+    BATCH_SIZE = 256
+
+    def __init__(self, dim=384):
+        super().__init__("feature-hash-v1", dim)
+
+    def _vector(self, text):
+        from services.keyword_index import KeywordIndex
+
+        counts = {}
+        for token in KeywordIndex.tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        vector = np.zeros(self.dim, dtype='float32')
+        for token, count in counts.items():
+            digest = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            sign = 1.0 if digest & 1 else -1.0
+            vector[(digest >> 1) % self.dim] += sign * (1.0 + np.log(count))
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def embed_batch(self, texts, connection):
+        return np.vstack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype='float32')
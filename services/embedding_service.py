@@ -0,0 +1,253 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from routes.utils.config_service import get_embedding_settings
+from services.embedding_providers import OpenAIEmbeddingProvider, OnnxEmbeddingProvider, HashingEmbeddingProvider
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Persistent embedding store keyed by a hash of (embedding model, text)"""
+
+    PATH = "knowledge_base/embedding_cache.sqlite3"
+
+    # SQLite 單一查詢可綁定的參數數量有限
+    QUERY_CHUNK = 500
+
+    @staticmethod
+    def make_key(text, model):
+        """Hash the model name and text into a cache key"""
+        return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _connect():
+        os.makedirs(os.path.dirname(EmbeddingCache.PATH), exist_ok=True)
+        conn = sqlite3.connect(EmbeddingCache.PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        return conn
+
+    @staticmethod
+    def get_many(keys):
+        """Return a {key: float32 vector} dict for the keys present in the cache"""
+        found = {}
+        keys = list(set(keys))
+        try:
+            with closing(EmbeddingCache._connect()) as conn:
+                for i in range(0, len(keys), EmbeddingCache.QUERY_CHUNK):
+                    chunk = keys[i:i+EmbeddingCache.QUERY_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embedding WHERE key IN ({placeholders})", chunk
+                    )
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype='float32')
+        except sqlite3.Error as e:
+            logger.error(f"Error reading embedding cache: {e}")
+        return found
+
+    @staticmethod
+    def put_many(items):
+        """Store (key, vector) pairs in the cache"""
+        try:
+            with closing(EmbeddingCache._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embedding (key, vector) VALUES (?, ?)",
+                    [(key, np.asarray(vector, dtype='float32').tobytes()) for key, vector in items]
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error writing embedding cache: {e}")
+
+    @staticmethod
+    def prune(keep_keys):
+        """Drop every cached vector whose key is not in keep_keys"""
+        try:
+            with closing(EmbeddingCache._connect()) as conn, conn:
+                conn.execute("CREATE TEMP TABLE keep (key TEXT PRIMARY KEY)")
+                conn.executemany("INSERT OR IGNORE INTO keep (key) VALUES (?)", [(key,) for key in keep_keys])
+                removed = conn.execute("DELETE FROM embedding WHERE key NOT IN (SELECT key FROM keep)").rowcount
+            if removed:
+                logger.info(f"Pruned {removed} stale embedding(s) from cache")
+        except sqlite3.Error as e:
+            logger.error(f"Error pruning embedding cache: {e}")
+
+
+class QueryEmbeddingCache:
+    """Bounded, thread-safe LRU cache with TTL for query embeddings"""
+
+    def __init__(self, maxsize=2048, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query):
+        """Normalize full-width forms, case and whitespace so trivial variants share an entry"""
+        query = unicodedata.normalize('NFKC', query)
+        return " ".join(query.split()).lower()
+
+    def _key(self, query, model):
+        return (model, QueryEmbeddingCache.normalize(query))
+
+    def get(self, query, model):
+        """Return the cached vector for a query, or None on a miss"""
+        key = self._key(query, model)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, query, model, vector):
+        """Store a query vector, evicting the least recently used entry when full"""
+        key = self._key(query, model)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class EmbeddingService:
+    """Batched, cached embedding of texts through the configured provider"""
+
+    _providers = {}
+    _providers_lock = threading.Lock()
+
+    @staticmethod
+    def get_provider(client_factory):
+        """The embedding provider selected by EMBEDDING_BACKEND, built once per configuration
+
+        ``client_factory`` returns an OpenAI client (or None) and is only
+        used by the openai backend.
+        """
+        settings = get_embedding_settings()
+        backend = settings["backend"]
+        if backend == "onnx":
+            key = (backend, settings["onnx_model_path"])
+        elif backend == "hashing":
+            key = (backend, settings["hash_dim"])
+        else:
+            key = ("openai", settings["model"], settings["max_concurrency"])
+
+        provider = EmbeddingService._providers.get(key)
+        if provider is None:
+            with EmbeddingService._providers_lock:
+                provider = EmbeddingService._providers.get(key)
+                if provider is None:
+                    if backend == "onnx":
+                        provider = OnnxEmbeddingProvider(settings["onnx_model_path"])
+                    elif backend == "hashing":
+                        provider = HashingEmbeddingProvider(settings["hash_dim"])
+                    else:
+                        provider = OpenAIEmbeddingProvider(
+                            settings["model"], client_factory, settings["max_concurrency"]
+                        )
+                    logger.info(f"Using embedding provider {provider.identity}")
+                    EmbeddingService._providers[key] = provider
+        return provider
+
+    @staticmethod
+    def embed_texts(texts, provider, token_budget=None, max_concurrency=None, use_cache=True, progress=None):
+        """Embed many texts with packed, concurrent batches
+
+        Vectors already in the EmbeddingCache are reused and only the
+        remaining texts are embedded by the provider. Returns a list aligned with
+        ``texts`` holding a float32 vector for each text, or None where its
+        batch failed after all retries. ``progress(done, total)`` is called
+        as batches complete.
+        """
+        settings = get_embedding_settings()
+        token_budget = token_budget or settings["batch_token_budget"]
+        max_concurrency = max_concurrency or provider.concurrency
+
+        results = [None] * len(texts)
+        keys = [EmbeddingCache.make_key(text, provider.identity) for text in texts]
+
+        # 先從快取取得向量，只有新增或修改過的文字才需要呼叫 API
+        if use_cache:
+            cached = EmbeddingCache.get_many(keys)
+            for position, key in enumerate(keys):
+                results[position] = cached.get(key)
+
+        missing = [position for position, vector in enumerate(results) if vector is None]
+        done = len(texts) - len(missing)
+        if progress:
+            progress(done, len(texts))
+        if not missing:
+            if texts:
+                logger.info(f"All {len(texts)} embeddings served from cache")
+            return results
+
+        connection = provider.connect()
+        if connection is None:
+            logger.error(f"Cannot embed {len(missing)} uncached text(s): {provider.backend} backend unavailable")
+            return results
+
+        missing_texts = [texts[position] for position in missing]
+        batches = provider.make_batches(missing_texts, token_budget)
+
+        workers = max(1, min(max_concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(provider.embed_batch, [missing_texts[i] for i in batch], connection): batch
+                for batch in batches
+            }
+            new_items = []
+            for future in as_completed(futures):
+                batch = futures[future]
+                vectors = future.result()
+                done += len(batch)
+                if progress:
+                    progress(done, len(texts))
+                if vectors is None:
+                    continue
+                for i, vector in zip(batch, vectors):
+                    position = missing[i]
+                    results[position] = vector
+                    new_items.append((keys[position], vector))
+
+        if use_cache and new_items:
+            EmbeddingCache.put_many(new_items)
+
+        logger.info(
+            f"Embedded {len(new_items)}/{len(missing)} uncached texts with {provider.identity} "
+            f"in {len(batches)} batch(es), "
+            f"{len(texts) - len(missing)} served from cache"
+        )
+        return results
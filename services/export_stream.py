@@ -0,0 +1,56 @@
+import zlib
+
+def encode_stream(pieces, block_size=64 * 1024):
+    """UTF-8 encode an iterable of str pieces into byte blocks of about block_size
+
+    Many small pieces (headers, separators) are joined into one block, so a
+    streamed response does not issue a write per line.
+    """
+    buffer = []
+    size = 0
+    for piece in pieces:
+        if not piece:
+            continue
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= block_size:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_stream(blocks, level=6):
+    """Compress an iterable of byte blocks into a gzip stream incrementally
+
+    wbits=31 makes zlib write the gzip header and trailer, so the output
+    is a regular .gz file. If the source fails part-way the trailer is
+    never written, and clients see a truncated archive instead of a
+    silently incomplete export.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def text_blocks(text, block_size=64 * 1024):
+    """Slice one large str into blocks without copying it as a whole"""
+    for start in range(0, len(text), block_size):
+        yield text[start:start + block_size]
+
+
+def column_blocks(query, column, block_size=64 * 1024):
+    """Read a large text column of one row with a single streamed query, yielded in blocks
+
+    ``query`` selects the row. The value is fetched once through a
+    server-side cursor where the driver supports it and sliced into
+    blocks as it is encoded, so the database reads it only once (a
+    SUBSTR per block would make Postgres de-TOAST the whole value for
+    every block).
+    """
+    value = query.with_entities(column).execution_options(stream_results=True, yield_per=1).scalar()
+    yield from text_blocks(value or "", block_size)
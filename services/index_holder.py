@@ -0,0 +1,71 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class IndexHolder:
+    """Process-wide, in-memory copy of the persisted knowledge-base index
+
+    The index is loaded once and every search is served from memory.
+    Writers publish a new snapshot by replacing a small pointer file;
+    every process notices the new stamp with a throttled ``os.stat`` and
+    reloads. The loaded state is replaced with a single reference
+    assignment, so readers never see a half-swapped index and never lock.
+    """
+
+    def __init__(self, loader, version_path, check_interval=1.0):
+        self._loader = loader
+        self._version_path = version_path
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        # (version, loaded)，整體替換以保證原子性
+        self._state = None
+        # (下次檢查時間, 版本戳記)
+        self._checked = None
+
+    def _disk_version(self):
+        """Cheap on-disk version stamp, None when no index has been published"""
+        try:
+            stat = os.stat(self._version_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def disk_version(self):
+        """On-disk version stamp, stat'ed at most once per check interval"""
+        checked = self._checked
+        now = time.monotonic()
+        if checked is not None and now < checked[0]:
+            return checked[1]
+        version = self._disk_version()
+        self._checked = (now + self._check_interval, version)
+        return version
+
+    def get(self):
+        """Return what the loader produced, reloading if a newer version exists"""
+        state = self._state
+        version = self.disk_version()
+        if state is not None and state[0] == version:
+            return state[1]
+
+        with self._lock:
+            # 其他執行緒可能已完成載入
+            state = self._state
+            if state is None or state[0] != version:
+                state = (version, self._loader())
+                self._state = state
+                logger.info(f"Loaded knowledge-base index version {version} into memory")
+        return state[1]
+
+    def invalidate(self):
+        """Drop the in-memory copy so the next get() reloads from disk
+
+        Writers call this after publishing; the next get() loads the new
+        files, memory-mapped where enabled, instead of keeping the writer's
+        private copy alive.
+        """
+        with self._lock:
+            self._state = None
+            self._checked = None
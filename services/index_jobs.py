@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class IndexJobQueue:
+    """Run knowledge-base index updates in a background thread
+
+    Requests are merged while they wait: any number of rebuild requests
+    become one rebuild, a pending rebuild absorbs pending per-document
+    updates, and repeated updates of the same document run once. Web
+    workers only enqueue and return, so they stay free for LINE webhooks.
+
+    Builds in different processes are serialized with an exclusive file
+    lock, and the status of the latest job is persisted as JSON so every
+    worker process reports the same progress.
+    """
+
+    # 進度寫入檔案的最短間隔，避免每個批次都寫磁碟
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, runner, status_path, lock_path):
+        self._runner = runner
+        self._status_path = status_path
+        self._lock_path = lock_path
+        self._condition = threading.Condition()
+        self._pending = None
+        self._thread = None
+        self._app = None
+        self._last_write = 0.0
+
+    @staticmethod
+    def _empty_job():
+        return {"rebuild": False, "index": set(), "remove": set(), "requests": 0, "requested_at": None}
+
+    def submit(self, app, rebuild=False, index_ids=(), remove_ids=()):
+        """Queue a rebuild and/or per-document updates, returning the current status"""
+        os.makedirs(os.path.dirname(self._status_path) or ".", exist_ok=True)
+        with self._condition:
+            job = self._pending or self._empty_job()
+            job["requests"] += 1
+            job["requested_at"] = job["requested_at"] or time.time()
+            job["rebuild"] = job["rebuild"] or rebuild
+            if job["rebuild"]:
+                # 完整重建已包含所有文件的變更
+                job["index"].clear()
+                job["remove"].clear()
+            else:
+                for doc_id in remove_ids:
+                    job["index"].discard(doc_id)
+                    job["remove"].add(doc_id)
+                for doc_id in index_ids:
+                    job["remove"].discard(doc_id)
+                    job["index"].add(doc_id)
+            self._pending = job
+            self._app = app
+
+            status = self._write_status({
+                "state": "queued",
+                "kind": self._kind(job),
+                "requests": job["requests"],
+                "requested_at": job["requested_at"]
+            }, keep_running=True)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name="index-job-worker", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return status
+
+    @staticmethod
+    def _kind(job):
+        return "rebuild" if job["rebuild"] else "documents"
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                job, self._pending = self._pending, None
+                app = self._app
+            try:
+                self._run(app, job)
+            except Exception as e:
+                logger.error(f"Index job worker error: {e}")
+
+    def _run(self, app, job):
+        # 同一時間只有一個行程能寫入索引
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # 其他行程在此請求之後才開始的重建已包含這些變更，不必再做一次
+                if job["rebuild"] and self.status().get("rebuilt_at", 0) >= job["requested_at"]:
+                    logger.info("Skipping index rebuild, another worker already rebuilt after this request")
+                    return
+
+                job_id = uuid.uuid4().hex[:12]
+                started_at = time.time()
+                base = {
+                    "job_id": job_id,
+                    "kind": self._kind(job),
+                    "requests": job["requests"],
+                    "requested_at": job["requested_at"],
+                    "started_at": started_at
+                }
+                self._write_status(dict(base, state="running", stage="starting", done=0, total=0))
+
+                def progress(stage, done=0, total=0):
+                    self._write_status(dict(base, state="running", stage=stage, done=done, total=total),
+                                       throttle=True)
+
+                success = False
+                try:
+                    with app.app_context():
+                        success = self._runner(job["rebuild"], sorted(job["index"]), sorted(job["remove"]), progress)
+                    state, message = ("succeeded", None) if success else ("failed", "Index update reported errors")
+                except Exception as e:
+                    logger.error(f"Index job {job_id} failed: {e}")
+                    state, message = "failed", str(e)
+
+                final = dict(base, state=state, message=message, finished_at=time.time())
+                if job["rebuild"] and success:
+                    final["rebuilt_at"] = started_at
+                self._write_status(final)
+                logger.info(f"Index job {job_id} ({base['kind']}, {job['requests']} request(s)) {state} "
+                            f"in {time.time() - started_at:.1f}s")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_status(self, status, throttle=False, keep_running=False):
+        """Persist the job status atomically, returning what was written"""
+        now = time.time()
+        if throttle and now - self._last_write < self.PROGRESS_INTERVAL:
+            return status
+        current = self.status()
+        if keep_running and current.get("state") == "running":
+            # 另一個工作執行中時保留其進度，只標記有新的請求在排隊
+            status = dict(current, queued=status)
+        self._last_write = now
+        # 最近一次成功重建的開始時間需跨工作保留，供其他行程判斷是否可略過
+        status = dict(status, updated_at=now, pid=os.getpid())
+        status.setdefault("rebuilt_at", current.get("rebuilt_at", 0))
+        tmp_path = f"{self._status_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False)
+            os.replace(tmp_path, self._status_path)
+        except OSError as e:
+            logger.error(f"Error writing index job status: {e}")
+        return status
+
+    def _lock_held(self):
+        """True when some process is currently running a job"""
+        try:
+            with open(self._lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def status(self):
+        """Latest persisted job status, {"state": "idle"} before the first job"""
+        try:
+            with open(self._status_path, encoding='utf-8') as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return {"state": "idle"}
+        # 執行中的行程已結束卻沒有寫入結果，視為中斷
+        if status.get("state") == "running" and not self._lock_held():
+            status["state"] = "interrupted"
+        return status
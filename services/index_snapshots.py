@@ -0,0 +1,117 @@
+import os
+import time
+import shutil
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SnapshotStore:
+    """Versioned, immutable index snapshot directories behind a CURRENT pointer
+
+    Every save writes all index files into a fresh staging directory,
+    renames it to ``snapshots/<version>`` and then atomically replaces the
+    ``CURRENT`` file with the new version name. Readers resolve CURRENT
+    once per load and read every file from that one directory, so they
+    never see a half-written index or files from different generations.
+    Snapshots are never modified after they are published.
+    """
+
+    POINTER_NAME = "CURRENT"
+    STAGING_SUFFIX = ".staging"
+
+    def __init__(self, root, keep=3, grace_seconds=300):
+        self.root = root
+        self.snapshots_dir = os.path.join(root, "snapshots")
+        self.pointer_path = os.path.join(root, self.POINTER_NAME)
+        # 保留最近幾個版本，並給仍在載入舊版本的其他行程一段寬限時間
+        self.keep = keep
+        self.grace_seconds = grace_seconds
+
+    def version(self):
+        """Name of the published snapshot as recorded in CURRENT, or None"""
+        try:
+            with open(self.pointer_path, encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def current(self):
+        """Directory of the published snapshot, or None if nothing has been published"""
+        name = self.version()
+        if name is None:
+            return None
+        path = os.path.join(self.snapshots_dir, name)
+        if not os.path.isdir(path):
+            logger.error(f"{self.pointer_path} points to missing snapshot {name!r}")
+            return None
+        return path
+
+    def stage(self):
+        """Create an empty staging directory for a new snapshot"""
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        path = os.path.join(self.snapshots_dir, name + self.STAGING_SUFFIX)
+        os.makedirs(path)
+        return path
+
+    def publish(self, staging_path):
+        """Turn a filled staging directory into the current snapshot
+
+        The directory rename and the pointer replacement are each atomic;
+        a crash between them leaves the previous snapshot current and the
+        orphaned directory is collected later.
+        """
+        final_path = staging_path[:-len(self.STAGING_SUFFIX)]
+        os.rename(staging_path, final_path)
+
+        tmp_path = f"{self.pointer_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(os.path.basename(final_path) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+        logger.info(f"Published index snapshot {os.path.basename(final_path)}")
+
+        self.collect_garbage()
+        return final_path
+
+    def discard(self, staging_path):
+        """Remove a staging directory whose save failed"""
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+    def collect_garbage(self):
+        """Delete old snapshots and abandoned staging directories
+
+        The current snapshot and the ``keep`` newest are always kept, and
+        nothing younger than the grace period is touched, so a process
+        still loading an older snapshot is not cut off. Processes that
+        already loaded a snapshot are unaffected: memory-mapped files stay
+        readable after they are unlinked.
+        """
+        try:
+            names = sorted(os.listdir(self.snapshots_dir))
+        except OSError:
+            return 0
+
+        current = self.current()
+        current_name = os.path.basename(current) if current else None
+        published = [name for name in names if not name.endswith(self.STAGING_SUFFIX)]
+        protected = set(published[-self.keep:]) | {current_name}
+        cutoff = time.time() - self.grace_seconds
+
+        removed = 0
+        for name in names:
+            if name in protected:
+                continue
+            path = os.path.join(self.snapshots_dir, name)
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+
+        if removed:
+            logger.info(f"Removed {removed} old index snapshot(s)")
+        return removed
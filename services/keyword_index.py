@@ -0,0 +1,184 @@
+import os
+import re
+import math
+import logging
+import unicodedata
+from collections import Counter
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class KeywordIndex:
+    """In-process BM25 inverted index over document chunks
+
+    Traditional Chinese has no word boundaries, so CJK runs are indexed as
+    overlapping character bigrams (a lone character is kept as a unigram),
+    while Latin letters and digits form whole tokens. Product codes such as
+    ``AB-123`` are indexed both whole and by their parts, so exact codes
+    and names match even when the embedding model blurs them.
+
+    Postings are kept as flat NumPy arrays sorted by term, so a query only
+    slices the postings of its own terms and scores them vectorized.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]+')
+    WORD_PATTERN = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+
+    def __init__(self, vocab=None, post_term=None, post_chunk=None, post_tf=None,
+                 chunk_ids=None, chunk_lens=None):
+        self.vocab = vocab if vocab is not None else {}
+        self._post_term = post_term if post_term is not None else np.zeros(0, dtype=np.int32)
+        self._post_chunk = post_chunk if post_chunk is not None else np.zeros(0, dtype=np.int64)
+        self._post_tf = post_tf if post_tf is not None else np.zeros(0, dtype=np.float32)
+        self._chunk_ids = chunk_ids if chunk_ids is not None else np.zeros(0, dtype=np.int64)
+        self._chunk_lens = chunk_lens if chunk_lens is not None else np.zeros(0, dtype=np.float32)
+        self._reindex()
+
+    @staticmethod
+    def tokenize(text):
+        """Split text into CJK bigrams and lowercase alphanumeric tokens"""
+        text = unicodedata.normalize('NFKC', text).lower()
+        tokens = []
+        for run in KeywordIndex.CJK_PATTERN.findall(text):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i+2] for i in range(len(run) - 1))
+        for word in KeywordIndex.WORD_PATTERN.findall(text):
+            tokens.append(word)
+            parts = re.split(r'[-_./]', word)
+            if len(parts) > 1:
+                tokens.extend(part for part in parts if part)
+        return tokens
+
+    def _reindex(self):
+        """Recompute per-posting lengths, term offsets and corpus statistics"""
+        self._offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        if len(self._post_term):
+            counts = np.bincount(self._post_term, minlength=len(self.vocab))
+            np.cumsum(counts, out=self._offsets[1:])
+        order = np.argsort(self._chunk_ids)
+        self._chunk_ids = self._chunk_ids[order]
+        self._chunk_lens = self._chunk_lens[order]
+        # 每筆 posting 對應的段落列號，查詢時用來累加分數
+        self._post_row = np.searchsorted(self._chunk_ids, self._post_chunk)
+        self._post_len = self._chunk_lens[self._post_row] if len(self._post_row) else np.zeros(0, dtype=np.float32)
+        self._avgdl = float(self._chunk_lens.mean()) if len(self._chunk_lens) else 0.0
+
+    def __len__(self):
+        return len(self._chunk_ids)
+
+    def add(self, records):
+        """Index (chunk_id, text) pairs; chunk ids already present are replaced"""
+        records = list(records)
+        if not records:
+            return
+        self.remove([chunk_id for chunk_id, _ in records])
+
+        terms, chunks, tfs, ids, lens = [], [], [], [], []
+        for chunk_id, text in records:
+            counts = Counter(self.tokenize(text))
+            ids.append(chunk_id)
+            lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                terms.append(term_id)
+                chunks.append(chunk_id)
+                tfs.append(tf)
+
+        post_term = np.concatenate([self._post_term, np.array(terms, dtype=np.int32)])
+        order = np.argsort(post_term, kind='stable')
+        self._post_term = post_term[order]
+        self._post_chunk = np.concatenate([self._post_chunk, np.array(chunks, dtype=np.int64)])[order]
+        self._post_tf = np.concatenate([self._post_tf, np.array(tfs, dtype=np.float32)])[order]
+        self._chunk_ids = np.concatenate([self._chunk_ids, np.array(ids, dtype=np.int64)])
+        self._chunk_lens = np.concatenate([self._chunk_lens, np.array(lens, dtype=np.float32)])
+        self._reindex()
+
+    def remove(self, chunk_ids):
+        """Drop every posting of the given chunk ids"""
+        if not len(chunk_ids) or not len(self._chunk_ids):
+            return
+        chunk_ids = np.asarray(list(chunk_ids), dtype=np.int64)
+        keep = ~np.isin(self._post_chunk, chunk_ids)
+        self._post_term = self._post_term[keep]
+        self._post_chunk = self._post_chunk[keep]
+        self._post_tf = self._post_tf[keep]
+        keep_chunks = ~np.isin(self._chunk_ids, chunk_ids)
+        self._chunk_ids = self._chunk_ids[keep_chunks]
+        self._chunk_lens = self._chunk_lens[keep_chunks]
+        self._reindex()
+
+    def search(self, query, k=20):
+        """Return up to k (chunk_id, bm25_score) pairs, best first"""
+        n_chunks = len(self._chunk_ids)
+        term_ids = {self.vocab[t] for t in self.tokenize(query) if t in self.vocab}
+        if not n_chunks or not term_ids:
+            return []
+
+        rows, scores = [], []
+        for term_id in term_ids:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            df = end - start
+            if df == 0:
+                continue
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            tf = self._post_tf[start:end]
+            norm = self.K1 * (1 - self.B + self.B * self._post_len[start:end] / self._avgdl)
+            rows.append(self._post_row[start:end])
+            scores.append(idf * tf * (self.K1 + 1) / (tf + norm))
+        if not rows:
+            return []
+
+        # 同一段落在多個詞彙中命中時分數相加
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+        if len(rows) * 8 < n_chunks:
+            # 命中很少時只處理命中的列，不必配置整個語料大小的陣列
+            hit_rows, inverse = np.unique(rows, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores)
+        else:
+            totals = np.bincount(rows, weights=scores)
+            hit_rows = np.flatnonzero(totals)
+            totals = totals[hit_rows]
+
+        if len(totals) > k:
+            top = np.argpartition(-totals, k)[:k]
+            top = top[np.argsort(-totals[top])]
+        else:
+            top = np.argsort(-totals)
+        return [(int(self._chunk_ids[hit_rows[i]]), float(totals[i])) for i in top]
+
+    def save(self, path):
+        """Write the index to a single .npz file atomically (no pickled objects)"""
+        terms = sorted(self.vocab, key=self.vocab.get)
+        vocab_blob = np.frombuffer("\n".join(terms).encode('utf-8'), dtype=np.uint8)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path, vocab=vocab_blob, post_term=self._post_term, post_chunk=self._post_chunk,
+            post_tf=self._post_tf, chunk_ids=self._chunk_ids, chunk_lens=self._chunk_lens
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            blob = data["vocab"].tobytes().decode('utf-8')
+            terms = blob.split("\n") if blob else []
+            return cls(
+                vocab={term: i for i, term in enumerate(terms)},
+                post_term=data["post_term"], post_chunk=data["post_chunk"], post_tf=data["post_tf"],
+                chunk_ids=data["chunk_ids"], chunk_lens=data["chunk_lens"]
+            )
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked id lists; each id scores the sum of 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,114 @@
+import re
+import time
+import logging
+from linebot.models import TextSendMessage
+
+logger = logging.getLogger(__name__)
+
+class LineStreamDelivery:
+    """Deliver a streamed LLM answer to LINE in two steps
+
+    The first complete sentence (or paragraph) is sent with the reply
+    token as soon as the model has produced it, so the user sees an answer
+    after about a second instead of after the whole completion. The rest
+    is delivered with push messages once the stream ends, split to fit
+    LINE's limits of 5,000 characters per text message and 5 messages per
+    request.
+    """
+
+    MAX_TEXT_LENGTH = 5000
+    MAX_MESSAGES = 5
+    # 句尾標點（含其後的右引號、括號）或換行視為一個完整段落的結尾
+    BOUNDARY_PATTERN = re.compile(r'[。！？!?…]+[」』”’）)]*|\n+|\.(?=\s)')
+    INTERRUPTED_NOTICE = "（回應中斷，請稍後再試。）"
+
+    @staticmethod
+    def first_segment_end(text, min_chars):
+        """End offset of the first complete sentence at least min_chars long, or None"""
+        for match in LineStreamDelivery.BOUNDARY_PATTERN.finditer(text):
+            if match.end() >= min_chars and text[:match.start()].strip():
+                return match.end()
+        return None
+
+    @staticmethod
+    def split_text(text, limit=MAX_TEXT_LENGTH):
+        """Split text into pieces of at most limit characters, preferring sentence ends"""
+        pieces = []
+        text = text.strip()
+        while len(text) > limit:
+            cut = None
+            for match in LineStreamDelivery.BOUNDARY_PATTERN.finditer(text, 0, limit):
+                cut = match.end()
+            cut = cut or limit
+            pieces.append(text[:cut].strip())
+            text = text[cut:].strip()
+        if text:
+            pieces.append(text)
+        return pieces
+
+    @staticmethod
+    def push_text(line_bot_api, target, text):
+        """Push text to a chat, at most 5 messages per request"""
+        messages = [TextSendMessage(text=piece) for piece in LineStreamDelivery.split_text(text)]
+        for start in range(0, len(messages), LineStreamDelivery.MAX_MESSAGES):
+            line_bot_api.push_message(target, messages[start:start + LineStreamDelivery.MAX_MESSAGES])
+
+    @staticmethod
+    def reply_text(line_bot_api, reply_token, target, text):
+        """Reply with text; pieces beyond one reply request and an expired token fall back to push"""
+        messages = [TextSendMessage(text=piece) for piece in LineStreamDelivery.split_text(text)]
+        if not messages:
+            return
+        try:
+            line_bot_api.reply_message(reply_token, messages[:LineStreamDelivery.MAX_MESSAGES])
+        except Exception as e:
+            # reply token 已過期或已使用時改用推播
+            logger.warning(f"Reply failed ({e}), pushing the message instead")
+            LineStreamDelivery.push_text(line_bot_api, target, text)
+            return
+        rest = messages[LineStreamDelivery.MAX_MESSAGES:]
+        for start in range(0, len(rest), LineStreamDelivery.MAX_MESSAGES):
+            line_bot_api.push_message(target, rest[start:start + LineStreamDelivery.MAX_MESSAGES])
+
+    @staticmethod
+    def deliver(line_bot_api, reply_token, target, pieces, first_min_chars=15):
+        """Send a stream of text pieces to a LINE chat, returning (text, complete)
+
+        ``target`` is the user, group or room ID used for push messages.
+        An error before anything was sent is raised so the caller can
+        reply with its own message; after the first reply, the text
+        received so far is pushed with a short notice and returned with
+        complete set to False.
+        """
+        started = time.perf_counter()
+        text, sent = "", 0
+        try:
+            for piece in pieces:
+                text += piece
+                if sent == 0:
+                    end = LineStreamDelivery.first_segment_end(text, first_min_chars)
+                    if end is not None:
+                        LineStreamDelivery.reply_text(line_bot_api, reply_token, target, text[:end])
+                        sent = end
+                        logger.info(f"First reply segment sent after {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            if sent == 0:
+                raise
+            logger.error(f"Response stream interrupted after first reply: {e}")
+            LineStreamDelivery.push_text(line_bot_api, target, text[sent:] + LineStreamDelivery.INTERRUPTED_NOTICE)
+            return text, False
+
+        if sent == 0:
+            if not text.strip():
+                raise ValueError("The model returned an empty response")
+            # 回答很短，整段用 reply token 送出
+            LineStreamDelivery.reply_text(line_bot_api, reply_token, target, text)
+        elif text[sent:].strip():
+            LineStreamDelivery.push_text(line_bot_api, target, text[sent:])
+        logger.info(f"Streamed response of {len(text)} characters delivered in {time.perf_counter() - started:.2f}s")
+        return text, True
+
+    @staticmethod
+    def push_target(source):
+        """Chat to push to: the group or room the message came from, else the user"""
+        return getattr(source, 'group_id', None) or getattr(source, 'room_id', None) or source.user_id
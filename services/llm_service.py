@@ -2,6 +2,7 @@ import os
 import json
 import logging
 from openai import OpenAI
+from services.openai_clients import openai_clients
 from datetime import datetime, timezone, timedelta
 from routes.utils.config_service import ConfigManager, get_openai_api_key, get_llm_settings
 
@@ -18,7 +19,8 @@ class LLMService:
             logger.error("OpenAI API key not configured")
             return None
         
-        return OpenAI(api_key=api_key)
+        # 共用同一金鑰的連線池，避免每次請求重新建立 TLS 連線
+        return openai_clients.get(api_key)
     
     @staticmethod
     def get_bot_style(style_name=None):
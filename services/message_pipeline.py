@@ -0,0 +1,349 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+class _ReplyClaim:
+    """Ownership of a message's reply: whoever claims it first answers, the other side stays silent"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner = None
+
+    def claim(self, owner):
+        with self._lock:
+            if self._owner is None:
+                self._owner = owner
+            return self._owner == owner
+
+
+class MessagePipeline:
+    """Asyncio pipeline for regular LINE text messages
+
+    The sequential webhook handler waits for every step in turn. Here the
+    steps that do not depend on each other run concurrently on one
+    background event loop:
+
+    * the LineUser lookup (and profile fetch for new users) runs while
+      the query is embedded;
+    * the user message is saved while the answer is retrieved and
+      generated;
+    * the bot message is saved while the reply is sent.
+
+    Database and other blocking library calls run in a thread pool, each
+    inside its own application context. The loop lives for the whole
+    process, so the AsyncOpenAI client and the httpx client for the LINE
+    API keep their connections between messages. Each message logs how
+    long every stage took.
+
+    Errors and timeouts are handled here rather than by the webhook: the
+    reply is claimed once, either by the pipeline or by the timeout
+    handler, so a message is never answered twice.
+    """
+
+    LINE_PROFILE_URL = "https://api.line.me/v2/bot/profile/{user_id}"
+    RETIRE_AFTER = 60
+    ERROR_MESSAGE = "很抱歉，生成回應時出現問題，請稍後再試。"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._executor = None
+        self._http = None
+        self._openai = None
+        self._openai_key = None
+
+    def _ensure_loop(self, workers):
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                # fork 後的子行程沒有父行程的事件迴圈執行緒，重新建立
+                self._loop = asyncio.new_event_loop()
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+                self._http = None
+                self._openai = None
+                self._openai_key = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._loop.run_forever, name="message-pipeline", daemon=True).start()
+        return self._loop
+
+    def handle(self, event):
+        """Process a text message event, blocking the calling request thread; never raises
+
+        Returns the stage timings, or None when the pipeline failed or
+        timed out. On a timeout the user gets the error message only if
+        the pipeline has not started replying; otherwise the pipeline
+        finishes the reply in the background.
+        """
+        from flask import current_app
+        from services.line_stream import LineStreamDelivery
+        from routes.utils.config_service import get_pipeline_settings
+        claim = _ReplyClaim()
+        future = None
+        try:
+            settings = get_pipeline_settings()
+            app = current_app._get_current_object()
+            loop = self._ensure_loop(settings["workers"])
+            future = asyncio.run_coroutine_threadsafe(self._process(app, event, claim), loop)
+            return future.result(settings["timeout"])
+        except FutureTimeoutError:
+            logger.error(f"Message pipeline timed out after {settings['timeout']}s")
+        except Exception as e:
+            logger.error(f"Message pipeline error: {e}")
+
+        if claim.claim("handler"):
+            # 執行緒池中的工作無法中斷，取消後其結果不再使用
+            if future is not None:
+                future.cancel()
+            self._reply(event.reply_token, LineStreamDelivery.push_target(event.source), self.ERROR_MESSAGE)
+        else:
+            logger.warning("Message pipeline already replied, letting it finish in the background")
+        return None
+
+    async def _in_app(self, app, func, *args, **kwargs):
+        """Run a blocking call in the thread pool inside an application context"""
+        def call():
+            with app.app_context():
+                return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    @staticmethod
+    async def _timed(timings, stage, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = (time.perf_counter() - started) * 1000
+
+    async def _process(self, app, event, claim):
+        from services.line_stream import LineStreamDelivery
+        from services.response_cache import ResponseCacheService
+
+        user_id = event.source.user_id
+        user_message = event.message.text
+        target = LineStreamDelivery.push_target(event.source)
+        timings = {}
+        started = time.perf_counter()
+        bot_style = None
+        already_sent = False
+        save_task = None
+
+        try:
+            # 使用者記錄與查詢向量互不相依，同時進行
+            user_task = asyncio.ensure_future(self._timed(timings, "user", self._ensure_user(app, user_id)))
+            embed_task = asyncio.ensure_future(self._timed(timings, "embedding", self._embed_query(app, user_message)))
+            bot_style = await user_task
+            await embed_task
+
+            # 儲存使用者訊息與檢索、生成同時進行
+            save_task = asyncio.ensure_future(self._timed(
+                timings, "save_message", self._in_app(app, self._save_message, user_id, True, user_message)
+            ))
+
+            cached_text, cache_ticket = await self._timed(
+                timings, "cache_lookup", self._in_app(app, ResponseCacheService.lookup, user_message, bot_style)
+            )
+            if cached_text:
+                response_text = cached_text
+            else:
+                rag_context = await self._timed(
+                    timings, "retrieval", self._in_app(app, self._get_context, user_message, bot_style)
+                )
+                response_text, complete, already_sent = await self._timed(
+                    timings, "generation",
+                    self._generate(app, event, target, user_message, bot_style, rag_context, claim)
+                )
+                # 只快取完整且成功的回答
+                if complete:
+                    ResponseCacheService.store(cache_ticket, response_text)
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            response_text = self.ERROR_MESSAGE
+
+        # 回覆與儲存機器人訊息同時進行
+        stages = [self._timed(timings, "save_reply",
+                              self._in_app(app, self._save_message, user_id, False, response_text, bot_style))]
+        if not already_sent:
+            if claim.claim("pipeline"):
+                stages.append(self._timed(timings, "reply", self._in_app(
+                    app, self._reply, event.reply_token, target, response_text
+                )))
+            else:
+                logger.info(f"Reply to {user_id} skipped, the error message was sent after a timeout")
+        if save_task is not None:
+            stages.append(save_task)
+        await asyncio.gather(*stages, return_exceptions=True)
+
+        timings["total"] = (time.perf_counter() - started) * 1000
+        breakdown = ", ".join(f"{stage}={ms:.0f}ms" for stage, ms in timings.items())
+        logger.info(f"Message pipeline for {user_id}: {breakdown}")
+        return timings
+
+    async def _ensure_user(self, app, user_id):
+        """Create the LineUser on first contact and return the user's preferred style"""
+        try:
+            exists, active_style = await self._in_app(app, self._load_user, user_id)
+            if exists:
+                return active_style
+            profile = await self._fetch_profile(app, user_id)
+            await self._in_app(app, self._create_user, user_id, profile)
+        except Exception as e:
+            # 與循序流程相同，使用者記錄失敗時仍繼續回覆
+            logger.error(f"Database error while loading LINE user {user_id}: {e}")
+        return None
+
+    @staticmethod
+    def _load_user(user_id):
+        from models import LineUser
+        line_user = LineUser.query.filter_by(line_user_id=user_id).first()
+        return (line_user is not None, line_user.active_style if line_user else None)
+
+    @staticmethod
+    def _create_user(user_id, profile):
+        from app import db
+        from models import LineUser
+        try:
+            db.session.add(LineUser(
+                line_user_id=user_id,
+                display_name=profile.get("displayName"),
+                picture_url=profile.get("pictureUrl"),
+                status_message=profile.get("statusMessage")
+            ))
+            db.session.commit()
+        except Exception:
+            # 同一使用者的兩則訊息可能同時建立記錄
+            db.session.rollback()
+            raise
+
+    async def _fetch_profile(self, app, user_id):
+        """LINE profile of a user as a dict, empty when it cannot be fetched"""
+        import httpx
+        from routes.utils.config_service import get_line_config
+        config = await self._in_app(app, get_line_config)
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0))
+        try:
+            response = await self._http.get(
+                self.LINE_PROFILE_URL.format(user_id=user_id),
+                headers={"Authorization": f"Bearer {config['channel_access_token']}"}
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.error(f"Error getting user profile: {e}")
+            return {}
+
+    async def _embed_query(self, app, query):
+        """Warm the query-embedding cache; retrieval and the response cache reuse the vector"""
+        from rag_service import RAGService
+        try:
+            return await self._in_app(app, RAGService.get_query_embedding, query)
+        except Exception as e:
+            logger.error(f"Error embedding query: {e}")
+            return None
+
+    @staticmethod
+    def _get_context(query, style):
+        from rag_service import RAGService
+        try:
+            return RAGService.get_context_for_query(query, style)
+        except Exception as e:
+            logger.error(f"Error getting RAG context: {e}")
+            return None
+
+    @staticmethod
+    def _save_message(user_id, is_user_message, text, bot_style=None):
+        from app import db
+        from models import ChatMessage
+        try:
+            db.session.add(ChatMessage(
+                line_user_id=user_id,
+                is_user_message=is_user_message,
+                message_text=text,
+                bot_style=None if is_user_message else bot_style
+            ))
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error saving chat message to database: {e}")
+            db.session.rollback()
+
+    @staticmethod
+    def _reply(reply_token, target, text):
+        from routes.webhook import get_line_bot_api
+        from services.line_stream import LineStreamDelivery
+        try:
+            LineStreamDelivery.reply_text(get_line_bot_api(), reply_token, target, text)
+        except Exception as e:
+            logger.error(f"Error sending response: {e}")
+
+    @staticmethod
+    def _prepare_completion(user_message, style_name, rag_context):
+        from llm_service import LLMService
+        from routes.utils.config_service import get_openai_api_key, get_llm_settings, get_streaming_settings
+        api_key = get_openai_api_key()
+        if not api_key:
+            raise RuntimeError("OpenAI API key not configured")
+        messages = LLMService._build_messages(user_message, style_name, rag_context)
+        return api_key, messages, get_llm_settings(), get_streaming_settings()
+
+    @staticmethod
+    def _stream_to_line(event, target, user_message, style_name, rag_context, first_min_chars):
+        from llm_service import LLMService
+        from routes.webhook import get_line_bot_api
+        from services.line_stream import LineStreamDelivery
+        return LineStreamDelivery.deliver(
+            get_line_bot_api(), event.reply_token, target,
+            LLMService.stream_response(user_message, style_name, rag_context), first_min_chars
+        )
+
+    def _async_openai(self, api_key):
+        """AsyncOpenAI client bound to the pipeline loop, rebuilt when the API key changes"""
+        if self._openai is None or self._openai_key != api_key:
+            from openai import AsyncOpenAI
+            from routes.utils.config_service import get_openai_client_settings
+            if self._openai is not None:
+                # 延後關閉舊客戶端，讓仍在進行的請求完成
+                old = self._openai
+                asyncio.get_running_loop().call_later(
+                    self.RETIRE_AFTER, lambda: asyncio.ensure_future(old.close())
+                )
+            settings = get_openai_client_settings()
+            self._openai = AsyncOpenAI(api_key=api_key, base_url=settings["base_url"],
+                                       max_retries=settings["max_retries"], timeout=settings["timeout"])
+            self._openai_key = api_key
+        return self._openai
+
+    async def _generate(self, app, event, target, user_message, style_name, rag_context, claim):
+        """Return (text, complete, already_sent)"""
+        api_key, messages, settings, streaming = await self._in_app(
+            app, self._prepare_completion, user_message, style_name, rag_context
+        )
+        if streaming["enabled"]:
+            if not claim.claim("pipeline"):
+                raise RuntimeError("The message was already answered after a timeout")
+            # 串流模式由同步客戶端逐句送出，整段在執行緒中進行
+            text, complete = await self._in_app(
+                app, self._stream_to_line, event, target, user_message, style_name, rag_context,
+                streaming["first_min_chars"]
+            )
+            return text, complete, True
+
+        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+        # do not change this unless explicitly requested by the user
+        response = await self._async_openai(api_key).chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=settings["temperature"],
+            max_tokens=settings["max_tokens"]
+        )
+        return response.choices[0].message.content, True, False
+
+
+# 行程層級的訊息處理管線，事件迴圈在第一則訊息時啟動
+message_pipeline = MessagePipeline()
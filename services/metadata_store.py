@@ -0,0 +1,130 @@
+import os
+import struct
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ChunkMetadataStore:
+    """Columnar, memory-mapped store for the search metadata of indexed chunks
+
+    Replaces the pickled ``{chunk_id: {...}}`` dict. Everything lives in one
+    file so it can be swapped in with a single rename:
+
+        header     magic, row count, arena size
+        ids        int64[n], sorted DocumentChunk.id values
+        doc_ids    int64[n], owning Document.id
+        chunk_idx  int64[n], DocumentChunk.chunk_index
+        offsets    int64[2n+1], title/content spans into the arena
+        arena      UTF-8 bytes of every title and content
+
+    Opening the file maps it read-only without parsing anything. A lookup
+    is a binary search over ``ids`` and decodes only the rows a search
+    actually returns, and loading untrusted files runs no code, unlike
+    unpickling.
+    """
+
+    MAGIC = b"KBMETA01"
+    HEADER = struct.Struct("<8sQQ")
+
+    def __init__(self, ids, doc_ids, chunk_idx, offsets, arena):
+        self._ids = ids
+        self._doc_ids = doc_ids
+        self._chunk_idx = chunk_idx
+        self._offsets = offsets
+        self._arena = arena
+
+    @classmethod
+    def empty(cls):
+        zeros = np.zeros(0, dtype='<i8')
+        return cls(zeros, zeros, zeros, np.zeros(1, dtype='<i8'), b"")
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a metadata file written by write()"""
+        mm = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, n, arena_size = cls.HEADER.unpack(mm[:cls.HEADER.size].tobytes())
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a chunk metadata file")
+
+        offset = cls.HEADER.size
+        columns = []
+        for count in (n, n, n, 2 * n + 1):
+            columns.append(np.frombuffer(mm, dtype='<i8', count=count, offset=offset))
+            offset += count * 8
+        arena = np.frombuffer(mm, dtype=np.uint8, count=arena_size, offset=offset)
+        return cls(*columns, arena)
+
+    @staticmethod
+    def write(path, records):
+        """Write {chunk_id: {"id", "chunk_id", "chunk_index", "title", "content"}} to path atomically"""
+        chunk_ids = sorted(records)
+        n = len(chunk_ids)
+        ids = np.array(chunk_ids, dtype='<i8')
+        doc_ids = np.array([records[key]["id"] for key in chunk_ids], dtype='<i8')
+        chunk_idx = np.array([records[key].get("chunk_index", 0) for key in chunk_ids], dtype='<i8')
+        offsets = np.zeros(2 * n + 1, dtype='<i8')
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        arena_path = f"{tmp_path}.arena"
+        position = 0
+        # 字串先寫入暫存檔，避免整個 arena 同時存在記憶體中
+        with open(arena_path, 'wb') as arena_file:
+            for i, key in enumerate(chunk_ids):
+                for j, field in enumerate(("title", "content")):
+                    data = (records[key].get(field) or "").encode('utf-8')
+                    arena_file.write(data)
+                    position += len(data)
+                    offsets[2 * i + j + 1] = position
+
+        with open(tmp_path, 'wb') as f:
+            f.write(ChunkMetadataStore.HEADER.pack(ChunkMetadataStore.MAGIC, n, position))
+            for column in (ids, doc_ids, chunk_idx, offsets):
+                f.write(column.tobytes())
+            with open(arena_path, 'rb') as arena_file:
+                while True:
+                    block = arena_file.read(1 << 20)
+                    if not block:
+                        break
+                    f.write(block)
+        os.remove(arena_path)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _row(self, chunk_id):
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row < len(self._ids) and self._ids[row] == chunk_id:
+            return row
+        return None
+
+    def __contains__(self, chunk_id):
+        return self._row(chunk_id) is not None
+
+    def _text(self, slot):
+        start, end = int(self._offsets[slot]), int(self._offsets[slot + 1])
+        return bytes(self._arena[start:end]).decode('utf-8')
+
+    def _record(self, row):
+        return {
+            "id": int(self._doc_ids[row]),
+            "chunk_id": int(self._ids[row]),
+            "chunk_index": int(self._chunk_idx[row]),
+            "title": self._text(2 * row),
+            "content": self._text(2 * row + 1)
+        }
+
+    def get(self, chunk_id, default=None):
+        row = self._row(chunk_id)
+        return default if row is None else self._record(row)
+
+    def __getitem__(self, chunk_id):
+        row = self._row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self._record(row)
+
+    def to_dict(self):
+        """Materialize every row as a {chunk_id: record} dict for writers"""
+        return {int(self._ids[row]): self._record(row) for row in range(len(self._ids))}
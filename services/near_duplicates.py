@@ -0,0 +1,153 @@
+import os
+import re
+import zlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class MinHasher:
+    """MinHash signatures over character shingles
+
+    Chinese has no spaces between words, so documents are compared as sets
+    of overlapping character k-grams ("shingles") after whitespace and
+    punctuation are removed. Two signatures agree in each position with
+    probability equal to the Jaccard similarity of the shingle sets, so
+    small edits to a long FAQ barely change the estimate.
+    """
+
+    # 2^61 - 1，通用雜湊的模數
+    PRIME = (1 << 61) - 1
+    MAX_HASH = (1 << 32) - 1
+    NOISE_PATTERN = re.compile(r'[\W_]+', re.UNICODE)
+    BLOCK = 4096
+
+    def __init__(self, num_perm=128, shingle_size=5, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, self.PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, self.PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text):
+        """Hashed character shingles of the normalized text as a uint64 array"""
+        text = self.NOISE_PATTERN.sub('', text.lower())
+        k = self.shingle_size
+        if len(text) <= k:
+            grams = {text} if text else set()
+        else:
+            grams = {text[i:i + k] for i in range(len(text) - k + 1)}
+        # crc32 在各行程間結果一致，Python 內建 hash 則每次啟動不同
+        return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text):
+        """MinHash signature (uint32[num_perm]); an empty text gets an all-max signature"""
+        hashes = self.shingles(text)
+        signature = np.full(self.num_perm, self.MAX_HASH, dtype=np.uint64)
+        # 分段計算，長文件不會產生 num_perm x 段落數 的大型矩陣
+        for start in range(0, len(hashes), self.BLOCK):
+            block = hashes[start:start + self.BLOCK]
+            permuted = (np.outer(self._a, block) + self._b[:, None]) % self.PRIME & self.MAX_HASH
+            np.minimum(signature, permuted.min(axis=1), out=signature)
+        return signature.astype(np.uint32)
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.mean(sig_a == sig_b))
+
+
+class NearDuplicateIndex:
+    """Locality-sensitive hashing index over MinHash signatures of documents
+
+    Signatures are split into ``bands`` bands; documents sharing any band
+    are candidates and are then scored by their full signatures, so a
+    lookup touches a handful of documents instead of the whole corpus.
+    With 16 bands of 8 rows, pairs above about 0.7 similarity are almost
+    always candidates.
+
+    Signatures are kept in one .npz file keyed by Document.id and
+    reconciled with the database on load, so documents edited or deleted
+    elsewhere never leave stale entries behind.
+    """
+
+    def __init__(self, hasher, bands=16):
+        if hasher.num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.hasher = hasher
+        self.bands = bands
+        self.rows = hasher.num_perm // bands
+        self._signatures = {}
+        self._buckets = [{} for _ in range(bands)]
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def __contains__(self, key):
+        return key in self._signatures
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def keys(self):
+        return self._signatures.keys()
+
+    def add(self, key, signature):
+        self.remove(key)
+        self._signatures[key] = signature
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(band_key, set()).add(key)
+
+    def remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            members = band.get(band_key)
+            if members:
+                members.discard(key)
+                if not members:
+                    del band[band_key]
+
+    def query(self, signature, threshold, keys=None):
+        """Best (key, similarity) at or above threshold, or None; only ``keys`` are considered when given"""
+        candidates = set()
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(band.get(band_key, ()))
+        if keys is not None:
+            candidates.intersection_update(keys)
+
+        best = None
+        for key in candidates:
+            score = MinHasher.similarity(signature, self._signatures[key])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+    def _params(self):
+        return np.array([self.hasher.num_perm, self.hasher.shingle_size, self.hasher.seed, self.bands], dtype=np.int64)
+
+    def save(self, path):
+        """Write all signatures to a single .npz file atomically (no pickled objects)"""
+        keys = np.fromiter(self._signatures.keys(), dtype=np.int64, count=len(self._signatures))
+        signatures = (np.vstack(list(self._signatures.values())) if len(keys)
+                      else np.zeros((0, self.hasher.num_perm), dtype=np.uint32))
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, params=self._params(), keys=keys, signatures=signatures)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Load saved signatures; files written with other parameters are ignored"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if not np.array_equal(data["params"], self._params()):
+                    logger.info("Near-duplicate signature parameters changed, recomputing signatures")
+                    return self
+                for key, signature in zip(data["keys"].tolist(), data["signatures"]):
+                    self.add(key, signature)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error loading near-duplicate signatures: {e}")
+        return self
@@ -0,0 +1,79 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class OpenAIClientRegistry:
+    """Process-wide OpenAI clients keyed by (API key, base URL)
+
+    Constructing an OpenAI client creates a fresh HTTP connection pool, so
+    every call that built its own client paid for a new TCP connection and
+    TLS handshake. Clients are created once per key and base URL with a
+    keep-alive pool and shared by all threads (OpenAI clients are thread
+    safe). When the configured key changes, the client of the old key is
+    retired and closed after a grace period, so requests still running on
+    it can finish.
+    """
+
+    def __init__(self, retire_after=60):
+        self.retire_after = retire_after
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _build(api_key, base_url, settings):
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive_connections"],
+                keepalive_expiry=settings["keepalive_expiry"]
+            ),
+            timeout=httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"])
+        )
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                      max_retries=settings["max_retries"])
+
+    def _retire(self, client):
+        # 延後關閉，讓其他執行緒上仍在進行的請求完成
+        timer = threading.Timer(self.retire_after, client.close)
+        timer.daemon = True
+        timer.start()
+
+    def get(self, api_key, base_url=None):
+        """Shared client for the key and base URL (the configured one by default), built on first use"""
+        from routes.utils.config_service import get_openai_client_settings
+        settings = get_openai_client_settings()
+        key = (api_key, base_url or settings["base_url"])
+        client = self._clients.get(key)
+        if client is not None and self._pid == os.getpid():
+            return client
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 後的子行程不能沿用父行程的連線，直接捨棄而不關閉
+                self._clients = {}
+                self._pid = os.getpid()
+            client = self._clients.get(key)
+            if client is None:
+                # 同一個服務端點的金鑰已更換，舊客戶端不再使用
+                for old_key in [k for k in self._clients if k[1] == key[1]]:
+                    self._retire(self._clients.pop(old_key))
+                    logger.info("OpenAI API key changed, retiring the previous client")
+                client = self._build(api_key, key[1], settings)
+                self._clients[key] = client
+        return client
+
+    def close_all(self):
+        """Close every client, e.g. at shutdown"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+
+# 行程層級的 OpenAI 客戶端，所有執行緒共用連線池
+openai_clients = OpenAIClientRegistry()
@@ -0,0 +1,98 @@
+import numpy as np
+
+def cosine_similarities(query_vector, vectors):
+    """Cosine similarity of one query vector against each row of vectors
+
+    OpenAI embeddings are unit length, where this equals 1 - d² / 2 for
+    the squared L2 distances FAISS returns; normalizing here keeps the
+    scores right for keyword-only candidates and other embedding models.
+    """
+    query = np.asarray(query_vector, dtype='float32').ravel()
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    norms = np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return (vectors / norms) @ query
+
+
+def adaptive_cutoff(scores, min_score, max_gap):
+    """Number of leading scores to keep from a descending score list
+
+    Stops at the first score below ``min_score`` and at the first drop
+    between neighbours larger than ``max_gap``: a clear gap separates the
+    chunks that answer the query from those that merely share a topic.
+    """
+    scores = np.asarray(scores)
+    keep = int(np.searchsorted(-scores, -min_score, side='right'))
+    if keep > 1 and max_gap > 0:
+        gaps = np.flatnonzero(scores[:keep - 1] - scores[1:keep] > max_gap)
+        if len(gaps):
+            keep = int(gaps[0]) + 1
+    return keep
+
+
+def hybrid_cutoff(similarities, keyword_scores, min_score, max_gap, exempt_rank=3, rrf_k=60):
+    """Rows of the candidates to keep in fused order, with their relevance in [0, 1]
+
+    Vector candidates are cut with adaptive_cutoff on cosine similarity as
+    before, but the ``exempt_rank`` best BM25 hits are kept whatever their
+    cosine: exact product names and codes are exactly the matches whose
+    embeddings are not close. The kept rows are ordered by reciprocal
+    rank fusion of the cosine and BM25 rankings, and the fused score
+    (min-max scaled over all candidates) is the relevance MMR should use.
+    Without keyword scores this is the plain cosine cut and order.
+    """
+    similarities = np.asarray(similarities, dtype='float32')
+    keyword_scores = np.asarray(keyword_scores, dtype='float32')
+    by_cosine = np.argsort(-similarities, kind='stable')
+    keep = adaptive_cutoff(similarities[by_cosine], min_score, max_gap)
+    if not (keyword_scores > 0).any():
+        rows = by_cosine[:keep]
+        return rows, similarities[rows]
+
+    by_keyword = [row for row in np.argsort(-keyword_scores, kind='stable') if keyword_scores[row] > 0]
+    eligible = np.zeros(len(similarities), dtype=bool)
+    eligible[by_cosine[:keep]] = True
+    eligible[by_keyword[:exempt_rank]] = True
+
+    fused = np.zeros(len(similarities))
+    for ranking in (by_cosine, by_keyword):
+        for rank, row in enumerate(ranking):
+            fused[row] += 1.0 / (rrf_k + rank + 1)
+    spread = fused.max() - fused.min()
+    relevance = (fused - fused.min()) / spread if spread > 0 else np.ones_like(fused)
+
+    rows = np.flatnonzero(eligible)
+    rows = rows[np.argsort(-fused[rows], kind='stable')]
+    return rows, relevance[rows].astype('float32')
+
+
+def mmr_select(vectors, relevance, k, lambda_mult=0.7, duplicate_similarity=0.95):
+    """Pick up to k row indices by maximal marginal relevance
+
+    Each step takes the candidate with the best
+    ``lambda * relevance - (1 - lambda) * max similarity to those already
+    picked``; candidates nearly identical to a picked one (overlapping
+    chunks, duplicated documents) are dropped outright. The pairwise
+    similarity matrix is computed once, so every step is a vector update.
+    """
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    relevance = np.asarray(relevance, dtype='float32')
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    pairwise = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    available &= redundancy < duplicate_similarity
+
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+        available &= redundancy < duplicate_similarity
+    return selected
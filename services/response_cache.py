@@ -0,0 +1,186 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticResponseCache:
+    """Bounded, thread-safe cache of bot answers keyed by query-embedding similarity
+
+    Entries are grouped per bot style. Each group remembers the version it
+    was filled under (the style prompt, LLM settings and knowledge-base
+    snapshot); a lookup under a different version drops the whole group,
+    so answers never outlive the documents or prompt they were built from.
+    Within a group the best answer whose query vector is within the cosine
+    threshold is returned, for example 營業時間? and 營業時間是幾點? share one
+    answer.
+    """
+
+    def __init__(self, maxsize=1000, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._groups = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _group(self, style, version):
+        """Entries of a style, emptied when its version changed; caller holds the lock"""
+        group = self._groups.get(style)
+        if group is None or group["version"] != version:
+            if group is not None and group["entries"]:
+                self.invalidations += len(group["entries"])
+                logger.info(f"Response cache for style {style} invalidated ({len(group['entries'])} entries)")
+            group = {"version": version, "entries": OrderedDict(), "matrix": None, "keys": None}
+            self._groups[style] = group
+        return group
+
+    def _expire(self, group, now):
+        stale = [key for key, entry in group["entries"].items() if now - entry["created"] >= self.ttl]
+        for key in stale:
+            del group["entries"][key]
+        if stale:
+            group["matrix"] = None
+
+    def get(self, vector, style, version, threshold):
+        """(answer, similarity) of the closest cached query at or above threshold, or None"""
+        unit = self._unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            group = self._group(style, version)
+            self._expire(group, now)
+            entries = group["entries"]
+            if entries:
+                # 每組的向量矩陣只在內容改變時重建
+                if group["matrix"] is None:
+                    group["keys"] = list(entries.keys())
+                    group["matrix"] = np.vstack([entries[key]["vector"] for key in group["keys"]])
+                similarities = group["matrix"] @ unit
+                best = int(np.argmax(similarities))
+                if similarities[best] >= threshold:
+                    key = group["keys"][best]
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    return entries[key]["answer"], float(similarities[best])
+            self.misses += 1
+            return None
+
+    def put(self, vector, style, version, query, answer):
+        """Store an answer, evicting the least recently used entry of the style when full
+
+        An answer generated under an older version than the group's is
+        dropped instead of resetting the group.
+        """
+        with self._lock:
+            group = self._groups.get(style)
+            if group is not None and group["version"] != version:
+                # 生成期間知識庫或設定已更新，舊版本的回答不再有效
+                logger.info(f"Dropping response generated under a previous version for style {style}")
+                return
+            group = self._group(style, version)
+            entries = group["entries"]
+            entries[query] = {"vector": self._unit(vector), "answer": answer, "created": time.monotonic()}
+            entries.move_to_end(query)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+            group["matrix"] = None
+            self.stores += 1
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring; every hit is one LLM call saved"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": sum(len(group["entries"]) for group in self._groups.values()),
+                "maxsize_per_style": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidated": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class ResponseCacheService:
+    """Semantic answer cache for the LINE webhook"""
+
+    @staticmethod
+    def _version(style):
+        """Everything a cached answer of this style depends on besides the question"""
+        from config import get_llm_settings, is_rag_enabled
+        from rag_service import RAGService
+        settings = get_llm_settings()
+        knowledge_base = RAGService.get_knowledge_base_version() if is_rag_enabled() else "rag-disabled"
+        prompt_digest = hashlib.sha256(style.prompt.encode('utf-8')).hexdigest()[:16]
+        return (prompt_digest, settings["temperature"], settings["max_tokens"],
+                RAGService.get_embedding_provider().identity, knowledge_base)
+
+    @staticmethod
+    def lookup(query, style_name=None):
+        """Return (cached answer or None, ticket)
+
+        Pass the ticket to store() together with the freshly generated
+        answer on a miss; the ticket is None when caching is disabled or
+        the query could not be embedded.
+        """
+        from config import get_response_cache_settings
+        settings = get_response_cache_settings()
+        if not settings["enabled"]:
+            return None, None
+        try:
+            from llm_service import LLMService
+            from rag_service import RAGService
+            _response_cache.maxsize = settings["max_entries"]
+            _response_cache.ttl = settings["ttl"]
+
+            style = LLMService.get_bot_style(style_name)
+            # 與知識庫搜尋共用查詢向量快取，檢索時不會再次計算
+            vector = RAGService.get_query_embedding(query)
+            if vector is None:
+                return None, None
+
+            version = ResponseCacheService._version(style)
+            hit = _response_cache.get(vector, style.name, version, settings["threshold"])
+            if hit:
+                answer, similarity = hit
+                logger.info(f"Response cache hit for style {style.name} (similarity {similarity:.3f})")
+                return answer, None
+            return None, (vector, style.name, version, query)
+        except Exception as e:
+            logger.error(f"Error looking up response cache: {e}")
+            return None, None
+
+    @staticmethod
+    def store(ticket, answer):
+        """Cache a generated answer under the ticket returned by lookup()"""
+        if ticket is None or not answer:
+            return
+        vector, style, version, query = ticket
+        _response_cache.put(vector, style, version, query, answer)
+
+    @staticmethod
+    def stats():
+        return _response_cache.stats()
+
+    @staticmethod
+    def clear():
+        _response_cache.clear()
+
+
+# 行程層級的回答快取，常見問題不必每次呼叫 LLM
+_response_cache = SemanticResponseCache()
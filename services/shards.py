@@ -0,0 +1,148 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+from services.index_holder import IndexHolder
+from services.index_snapshots import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+# 未標記集合的文件屬於預設集合，沿用原本的索引位置
+DEFAULT_COLLECTION = "default"
+COLLECTION_PATTERN = re.compile(r'^[\w-]{1,64}$')
+SEPARATOR_PATTERN = re.compile(r'[,，、\s]+')
+
+
+def parse_collections(value):
+    """Collection names from a comma-separated string (or a list), deduplicated in order
+
+    Names may use letters of any script, digits, ``_`` and ``-``, so
+    Chinese names such as 專業 work; anything else raises ValueError.
+    """
+    if not value:
+        return []
+    parts = value if isinstance(value, (list, tuple, set)) else SEPARATOR_PATTERN.split(value)
+    names = []
+    for part in parts:
+        name = part.strip().lower()
+        if not name:
+            continue
+        if not COLLECTION_PATTERN.match(name):
+            raise ValueError(f"Invalid collection name: {part!r}")
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def format_collections(names):
+    """Stored form of a collection list, None for the default collection only"""
+    names = [name for name in parse_collections(names) if name != DEFAULT_COLLECTION]
+    return ",".join(names) or None
+
+
+def format_style_collections(names):
+    """Stored form of the collections a bot style searches, None for every collection
+
+    Unlike document tags, ``default`` is kept: it stands for the untagged
+    documents, so a style can include them or be limited to them.
+    """
+    return ",".join(parse_collections(names)) or None
+
+
+def document_collections(doc):
+    """Collections a document is indexed in; untagged documents go to the default collection"""
+    try:
+        return parse_collections(doc.collections) or [DEFAULT_COLLECTION]
+    except ValueError:
+        logger.warning(f"Document {doc.id} has invalid collections {doc.collections!r}, using default")
+        return [DEFAULT_COLLECTION]
+
+
+class ShardRegistry:
+    """One independently versioned index shard per document collection
+
+    The default collection lives directly in the knowledge-base directory
+    (where the single index used to be); every other collection has its
+    own snapshot store under ``shards/<name>/``. Each shard gets its own
+    in-memory IndexHolder, created on first use. The shard list is read
+    from disk at most once per check interval, like each holder's CURRENT
+    file, so searches and cache lookups do not list the directory.
+    """
+
+    def __init__(self, root, loader, check_interval=1.0):
+        self.root = root
+        self.shards_dir = os.path.join(root, "shards")
+        self.check_interval = check_interval
+        self._loader = loader
+        self._stores = {}
+        self._holders = {}
+        self._lock = threading.Lock()
+        # (下次檢查時間, 分片名稱)
+        self._listed = None
+
+    def store(self, name):
+        store = self._stores.get(name)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(name)
+                if store is None:
+                    root = self.root if name == DEFAULT_COLLECTION else os.path.join(self.shards_dir, name)
+                    store = SnapshotStore(root)
+                    self._stores[name] = store
+        return store
+
+    def holder(self, name):
+        holder = self._holders.get(name)
+        if holder is None:
+            store = self.store(name)
+            with self._lock:
+                holder = self._holders.get(name)
+                if holder is None:
+                    holder = IndexHolder(lambda: self._loader(name), store.pointer_path)
+                    self._holders[name] = holder
+        return holder
+
+    def _list_names(self):
+        names = [DEFAULT_COLLECTION]
+        try:
+            entries = sorted(os.listdir(self.shards_dir))
+        except OSError:
+            return names
+        for entry in entries:
+            if entry != DEFAULT_COLLECTION and os.path.exists(
+                    os.path.join(self.shards_dir, entry, SnapshotStore.POINTER_NAME)):
+                names.append(entry)
+        return names
+
+    def names(self):
+        """Every shard that has been published, the default one first"""
+        listed = self._listed
+        now = time.monotonic()
+        if listed is None or now >= listed[0]:
+            listed = (now + self.check_interval, self._list_names())
+            self._listed = listed
+        return list(listed[1])
+
+    def version(self):
+        """Version stamps of every shard; changes whenever any shard is republished"""
+        return ",".join(f"{name}:{self.holder(name).disk_version()}" for name in self.names())
+
+    def published(self, name):
+        """Forget the cached state of a shard this process just published"""
+        self.holder(name).invalidate()
+        self._listed = None
+
+    def drop(self, name):
+        """Delete a shard whose collection no longer has documents"""
+        if name == DEFAULT_COLLECTION:
+            return
+        shutil.rmtree(os.path.join(self.shards_dir, name), ignore_errors=True)
+        with self._lock:
+            self._stores.pop(name, None)
+            holder = self._holders.pop(name, None)
+            self._listed = None
+        if holder is not None:
+            holder.invalidate()
+        logger.info(f"Removed index shard {name}")
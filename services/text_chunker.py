@@ -0,0 +1,108 @@
+import re
+from routes.utils.config_service import get_chunk_settings
+
+class TextChunker:
+    """Split documents into overlapping chunks sized for embedding and prompts
+
+    Sizes are counted in characters rather than tokens: Traditional Chinese
+    has no spaces, and one character is roughly one to two tokens, so a
+    few hundred characters keeps every chunk well below the embedding
+    input limit.
+    """
+
+    # 句子結尾：中文與英文標點，以及換行
+    SENTENCE_PATTERN = re.compile(r'[^。！？；!?;\n]*(?:[。！？；!?;]+[」』”’）)]*|\n+|$)')
+
+    @staticmethod
+    def split_sentences(text):
+        """Split text into sentences, keeping the trailing punctuation"""
+        return [s for s in TextChunker.SENTENCE_PATTERN.findall(text) if s.strip()]
+
+    @staticmethod
+    def _overlap_tail(chunk, overlap):
+        """Return the last ``overlap`` characters, starting at a sentence boundary if possible"""
+        if overlap <= 0 or not chunk:
+            return ""
+        tail = chunk[-overlap:]
+        sentences = TextChunker.split_sentences(tail)
+        # 第一句通常被截斷，可能時從完整句子開始
+        if len(sentences) > 1:
+            return tail[tail.index(sentences[1]):]
+        return tail
+
+    @staticmethod
+    def chunk_text(text, chunk_size=None, overlap=None):
+        """Pack sentences into chunks of at most chunk_size characters
+
+        Consecutive chunks share about ``overlap`` characters so a fact that
+        spans a boundary is still retrievable from either side. Sentences
+        longer than chunk_size are cut into fixed-size pieces.
+        """
+        text = text.strip()
+        if not text:
+            return []
+        return list(TextChunker.chunk_stream([text], chunk_size, overlap))
+
+    @staticmethod
+    def chunk_stream(blocks, chunk_size=None, overlap=None):
+        """Chunk text arriving as an iterable of blocks, yielding chunks as they fill
+
+        Only the unfinished tail sentence and the chunk being packed are
+        kept between blocks, so memory does not grow with the size of the
+        text. Produces the same chunks as chunk_text on the joined text.
+        """
+        settings = get_chunk_settings()
+        chunk_size = chunk_size or settings["chunk_size"]
+        overlap = settings["chunk_overlap"] if overlap is None else overlap
+        overlap = min(overlap, chunk_size // 2)
+
+        sentences = TextChunker._stream_sentences(blocks, chunk_size)
+        return TextChunker._pack(TextChunker._pieces(sentences, chunk_size, overlap), chunk_size, overlap)
+
+    @staticmethod
+    def _stream_sentences(blocks, chunk_size):
+        """Yield complete sentences from text blocks, carrying the last one over"""
+        buffer = ""
+        for block in blocks:
+            buffer += block
+            # 累積數個段落大小再切句，避免每個小區塊都重新掃描
+            if len(buffer) < chunk_size * 4:
+                continue
+            matches = [m for m in TextChunker.SENTENCE_PATTERN.findall(buffer) if m]
+            if len(matches) > 1:
+                # 最後一句可能尚未結束，留待下一個區塊
+                for sentence in matches[:-1]:
+                    if sentence.strip():
+                        yield sentence
+                buffer = matches[-1]
+            elif len(buffer) > chunk_size * 16:
+                # 沒有任何句子邊界的超長文字，保留尾端後先行輸出
+                yield buffer[:-chunk_size]
+                buffer = buffer[-chunk_size:]
+        yield from TextChunker.split_sentences(buffer)
+
+    @staticmethod
+    def _pieces(sentences, chunk_size, overlap):
+        """Cut sentences longer than chunk_size into overlapping fixed-size pieces"""
+        for sentence in sentences:
+            while len(sentence) > chunk_size:
+                yield sentence[:chunk_size]
+                sentence = sentence[chunk_size - overlap:]
+            yield sentence
+
+    @staticmethod
+    def _pack(pieces, chunk_size, overlap):
+        """Greedily pack pieces into chunks, carrying an overlap tail between them"""
+        current = ""
+        for piece in pieces:
+            if current and len(current) + len(piece) > chunk_size:
+                if current.strip():
+                    yield current.strip()
+                current = TextChunker._overlap_tail(current, overlap)
+                # 重疊部分加上新句子仍超過上限時，捨棄重疊
+                if len(current) + len(piece) > chunk_size:
+                    current = ""
+            current += piece
+
+        if current.strip():
+            yield current.strip()
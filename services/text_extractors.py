@@ -0,0 +1,252 @@
+import os
+import re
+import codecs
+import logging
+import zipfile
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+class ExtractionError(ValueError):
+    """A file could not be converted to text"""
+
+
+class TextExtractor:
+    """Convert an uploaded file to plain text, yielded as blocks of str
+
+    Subclasses list the file extensions they handle. Everything here is
+    plain stdlib (or lazily imported) and has no application imports, so
+    extractors load quickly in freshly spawned pool processes.
+    """
+
+    extensions = ()
+    BLOCK_SIZE = 64 * 1024
+
+    def iter_blocks(self, path):
+        raise NotImplementedError
+
+
+def iter_text(path, block_size=TextExtractor.BLOCK_SIZE, encoding='utf-8-sig'):
+    """Decode a text file incrementally, yielding str blocks
+
+    A multi-byte character split across two blocks is completed by the
+    incremental decoder, and invalid bytes are replaced rather than
+    failing the whole upload.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+class PlainTextExtractor(TextExtractor):
+    """UTF-8 text, decoded incrementally with invalid bytes replaced"""
+
+    extensions = ("txt",)
+
+    def iter_blocks(self, path):
+        return iter_text(path, self.BLOCK_SIZE)
+
+
+class MarkdownExtractor(PlainTextExtractor):
+    """Markdown with the markup removed, keeping headings, list items and code as text"""
+
+    extensions = ("md", "markdown")
+
+    IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+    LINK_PATTERN = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+    HEADING_PATTERN = re.compile(r'^\s{0,3}#{1,6}\s+')
+    QUOTE_LIST_PATTERN = re.compile(r'^\s*(?:>\s*)+|^\s*(?:[-*+]|\d+[.)])\s+(?:\[[ xX]\]\s+)?')
+    EMPHASIS_PATTERN = re.compile(r'(\*\*|~~|\*|`)(?=\S)(.+?)(?<=\S)\1')
+    # 底線強調需在字詞邊界，避免破壞 snake_case 名稱與產品代碼
+    UNDERSCORE_PATTERN = re.compile(r'(?<!\w)(__|_)(?=\S)(.+?)(?<=\S)\1(?!\w)')
+    HTML_TAG_PATTERN = re.compile(r'</?[A-Za-z][^>]*>')
+    RULE_PATTERN = re.compile(r'^\s*(?:[-*_]\s*){3,}$')
+
+    def _strip_line(self, line):
+        if self.RULE_PATTERN.match(line):
+            return "\n"
+        line = self.HEADING_PATTERN.sub('', line)
+        line = self.QUOTE_LIST_PATTERN.sub('', line)
+        line = self.IMAGE_PATTERN.sub(r'\1', line)
+        line = self.LINK_PATTERN.sub(r'\1', line)
+        line = self.EMPHASIS_PATTERN.sub(r'\2', line)
+        line = self.UNDERSCORE_PATTERN.sub(r'\2', line)
+        return self.HTML_TAG_PATTERN.sub('', line)
+
+    def iter_blocks(self, path):
+        pending = ""
+        in_code = False
+        for block in super().iter_blocks(path):
+            lines = (pending + block).split("\n")
+            # 最後一行可能尚未結束，留待下一個區塊
+            pending = lines.pop()
+            out = []
+            for line in lines:
+                if line.lstrip().startswith(("```", "~~~")):
+                    in_code = not in_code
+                    continue
+                out.append(line if in_code else self._strip_line(line))
+            if out:
+                yield "\n".join(out) + "\n"
+        if pending:
+            yield pending if in_code else self._strip_line(pending)
+
+
+class PdfExtractor(TextExtractor):
+    """PDF text layer, page by page; needs the optional pypdf package"""
+
+    extensions = ("pdf",)
+
+    def iter_blocks(self, path):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise ExtractionError("PDF support requires the pypdf package (pip install pypdf)")
+
+        try:
+            reader = PdfReader(path)
+            if reader.is_encrypted:
+                reader.decrypt("")
+            for page in reader.pages:
+                text = page.extract_text() or ""
+                if text.strip():
+                    yield text + "\n\n"
+        except ExtractionError:
+            raise
+        except Exception as e:
+            raise ExtractionError(f"Cannot read PDF: {e}")
+
+
+class DocxExtractor(TextExtractor):
+    """Word documents, read from word/document.xml without third-party packages"""
+
+    extensions = ("docx",)
+
+    W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+    def iter_blocks(self, path):
+        try:
+            archive = zipfile.ZipFile(path)
+        except zipfile.BadZipFile:
+            raise ExtractionError("Not a valid DOCX file")
+
+        with archive:
+            try:
+                xml_file = archive.open("word/document.xml")
+            except KeyError:
+                raise ExtractionError("DOCX file has no word/document.xml")
+
+            paragraph = []
+            size = 0
+            out = []
+            with xml_file:
+                # 逐段解析，處理完的元素立即清除以限制記憶體
+                for event, elem in ElementTree.iterparse(xml_file, events=("end",)):
+                    tag = elem.tag
+                    if tag == self.W_NS + "t":
+                        paragraph.append(elem.text or "")
+                    elif tag == self.W_NS + "tab":
+                        paragraph.append("\t")
+                    elif tag in (self.W_NS + "br", self.W_NS + "cr"):
+                        paragraph.append("\n")
+                    elif tag == self.W_NS + "p":
+                        text = "".join(paragraph)
+                        paragraph = []
+                        out.append(text + "\n")
+                        size += len(text) + 1
+                        elem.clear()
+                        if size >= self.BLOCK_SIZE:
+                            yield "".join(out)
+                            out, size = [], 0
+                    elif tag == self.W_NS + "body":
+                        elem.clear()
+            if out:
+                yield "".join(out)
+
+
+EXTRACTORS = {}
+for _extractor in (PlainTextExtractor(), MarkdownExtractor(), PdfExtractor(), DocxExtractor()):
+    for _extension in _extractor.extensions:
+        EXTRACTORS[_extension] = _extractor
+
+
+def get_extractor(extension):
+    """Extractor for a file extension (without the dot), or None if unsupported"""
+    return EXTRACTORS.get((extension or "").lower())
+
+
+def extract_to_file(extension, path):
+    """Extract a file into a UTF-8 temporary text file, returning (text_path, characters)
+
+    Runs in pool processes, so the text is passed back through the file
+    system instead of being pickled between processes.
+    """
+    extractor = get_extractor(extension)
+    if extractor is None:
+        raise ExtractionError(f"Unsupported file type: {extension}")
+
+    fd, text_path = tempfile.mkstemp(prefix="kb_text_", suffix=".txt")
+    characters = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            for block in extractor.iter_blocks(path):
+                out.write(block)
+                characters += len(block)
+    except BaseException:
+        os.remove(text_path)
+        raise
+    return text_path, characters
+
+
+def extract_files(items, max_workers=None):
+    """Extract (key, extension, path) items in a process pool
+
+    Yields (key, text_path, characters, error) as each file finishes, so
+    callers can ingest early files while later ones are still parsing.
+    Plain text needs no conversion: it is only decoded in this process to
+    count its characters, and its own path is yielded as the text path.
+    """
+    pooled = []
+    for key, extension, path in items:
+        if type(get_extractor(extension)) is PlainTextExtractor:
+            # 以解碼後的字元數計算，中文每字佔三個位元組，不能以檔案大小代替
+            try:
+                characters = sum(len(block) for block in iter_text(path))
+            except OSError as e:
+                logger.error(f"Text extraction failed for {key}: {e}")
+                yield key, None, 0, e
+                continue
+            yield key, path, characters, None
+        else:
+            pooled.append((key, extension, path))
+    if not pooled:
+        return
+
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(pooled)))
+    # spawn 避免複製含有執行緒與資料庫連線的 Flask 行程
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(extract_to_file, extension, path): key
+            for key, extension, path in pooled
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                text_path, characters = future.result()
+                yield key, text_path, characters, None
+            except Exception as e:
+                logger.error(f"Text extraction failed for {key}: {e}")
+                yield key, None, 0, e
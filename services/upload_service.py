@@ -0,0 +1,92 @@
+import os
+import logging
+import tempfile
+from routes.utils.config_service import get_upload_settings
+from services.text_extractors import extract_files
+
+logger = logging.getLogger(__name__)
+
+class UploadTooLargeError(ValueError):
+    """An uploaded file or the whole request exceeds the configured size cap"""
+
+    def __init__(self, message, per_request=False):
+        super().__init__(message)
+        self.per_request = per_request
+
+
+class UploadSpooler:
+    """Copy uploaded files to temporary files in fixed-size blocks
+
+    Uploads are never read into memory as a whole: each file is streamed
+    to disk while its size is counted against a per-file and a
+    per-request cap, and the text is decoded from disk block by block.
+    Use as a context manager so the temporary files are always removed.
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, max_file_bytes=None, max_request_bytes=None):
+        settings = get_upload_settings()
+        self.extract_workers = settings["extract_workers"]
+        self.max_file_bytes = max_file_bytes or settings["max_file_bytes"]
+        self.max_request_bytes = max_request_bytes or settings["max_request_bytes"]
+        self.total_bytes = 0
+        self._paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def spool(self, file):
+        """Stream a werkzeug FileStorage to a temporary file, returning (path, size)"""
+        fd, path = tempfile.mkstemp(prefix="kb_upload_")
+        self._paths.append(path)
+        size = 0
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = file.stream.read(self.BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > self.max_file_bytes:
+                    raise UploadTooLargeError(
+                        f"{file.filename} exceeds the {self.max_file_bytes // (1024 * 1024)} MB per-file limit"
+                    )
+                if self.total_bytes + size > self.max_request_bytes:
+                    raise UploadTooLargeError(
+                        f"Upload exceeds the {self.max_request_bytes // (1024 * 1024)} MB per-request limit",
+                        per_request=True
+                    )
+                out.write(block)
+        self.total_bytes += size
+        return path, size
+
+    def request_too_large(self, request):
+        """Reject a request by its Content-Length before the body is parsed"""
+        return (request.content_length or 0) > self.max_request_bytes
+
+    def extract(self, items):
+        """Extract spooled (key, extension, path) files to text in the process pool
+
+        Yields (key, text_path, characters, error) as each file finishes;
+        the extracted text files are removed with the spooled uploads.
+        """
+        for key, text_path, characters, error in extract_files(items, self.extract_workers or None):
+            if text_path is not None and text_path not in self._paths:
+                self.track(text_path)
+            yield key, text_path, characters, error
+
+    def track(self, path):
+        """Remove another temporary file (such as extracted text) on close"""
+        self._paths.append(path)
+
+    def close(self):
+        for path in self._paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._paths = []
+
@@ -0,0 +1,191 @@
+import os
+import math
+import time
+import logging
+import numpy as np
+import faiss
+from routes.utils.config_service import get_index_settings
+
+logger = logging.getLogger(__name__)
+
+class VectorIndexFactory:
+    """Build FAISS indexes whose type follows the size of the corpus
+
+    * Flat: exact brute-force search, best for small corpora
+    * IVF:  inverted lists over k-means centroids, trained at build time
+    * HNSW: graph search, fast for very large corpora but cannot remove
+            vectors, so deletions are left as tombstones until the next
+            rebuild
+
+    Vectors stay keyed by DocumentChunk.id whatever the type: Flat and
+    HNSW are wrapped in IndexIDMap2, while IVF stores the ids in its
+    inverted lists itself (wrapping it would break labels after a removal,
+    since IVF does not renumber its entries) and keeps a hashtable direct
+    map so vectors can be reconstructed by id.
+    """
+
+    # 自動選擇索引類型的向量數門檻
+    FLAT_MAX_VECTORS = 50000
+    IVF_MAX_VECTORS = 1000000
+
+    INDEX_TYPES = ("flat", "ivf", "hnsw")
+
+    @staticmethod
+    def choose_type(n_vectors, requested="auto"):
+        """Resolve the configured index type, picking by vector count for 'auto'"""
+        requested = (requested or "auto").lower()
+        if requested in VectorIndexFactory.INDEX_TYPES:
+            index_type = requested
+        elif n_vectors <= VectorIndexFactory.FLAT_MAX_VECTORS:
+            index_type = "flat"
+        elif n_vectors <= VectorIndexFactory.IVF_MAX_VECTORS:
+            index_type = "ivf"
+        else:
+            index_type = "hnsw"
+
+        # IVF 需要足夠的訓練樣本，向量太少時退回精確搜尋
+        if index_type == "ivf" and n_vectors < 39 * VectorIndexFactory.ivf_nlist(n_vectors):
+            index_type = "flat"
+        return index_type
+
+    @staticmethod
+    def ivf_nlist(n_vectors):
+        """Number of IVF centroids, about 4 * sqrt(N)"""
+        return int(min(65536, max(16, 4 * math.sqrt(max(n_vectors, 1)))))
+
+    @staticmethod
+    def create_empty(dim, index_type="flat", n_vectors=0, settings=None):
+        """Create an untrained, empty ID-mapped index of the given type"""
+        settings = settings or get_index_settings()
+        if index_type == "ivf":
+            quantizer = faiss.IndexFlatL2(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, VectorIndexFactory.ivf_nlist(n_vectors))
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return index
+        if index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(dim, settings["hnsw_m"])
+            base.hnsw.efConstruction = settings["hnsw_ef_construction"]
+        else:
+            base = faiss.IndexFlatL2(dim)
+        return faiss.IndexIDMap2(base)
+
+    @staticmethod
+    def build(vectors, ids, dim, settings=None):
+        """Create, train and fill an index for the given vectors and ids"""
+        settings = settings or get_index_settings()
+        n_vectors = len(ids)
+        index_type = VectorIndexFactory.choose_type(n_vectors, settings["index_type"])
+        index = VectorIndexFactory.create_empty(dim, index_type, n_vectors, settings)
+
+        if index_type == "ivf":
+            # 訓練樣本上限為每個中心點 256 筆，避免重建過久
+            nlist = faiss.extract_index_ivf(index).nlist
+            sample_size = min(n_vectors, nlist * 256)
+            sample = vectors[np.random.default_rng(0).choice(n_vectors, sample_size, replace=False)]
+            start = time.perf_counter()
+            index.train(sample)
+            logger.info(f"Trained {nlist} IVF centroids on {sample_size} vectors in {time.perf_counter() - start:.1f}s")
+
+        if n_vectors:
+            index.add_with_ids(vectors, ids)
+        VectorIndexFactory.configure(index, settings)
+        logger.info(f"Built {index_type} index with {index.ntotal} vectors")
+        return index
+
+    @staticmethod
+    def read(path, mmap=False):
+        """Load an index; with mmap the vector data stays in the OS page cache
+
+        A memory-mapped index is read-only and is shared by every process
+        that maps the same file, so gunicorn workers do not each hold a
+        private copy and loading takes no time regardless of index size.
+        """
+        if mmap:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        return faiss.read_index(path)
+
+    @staticmethod
+    def write(index, path):
+        """Write an index to a temporary file and rename it into place
+
+        Overwriting a file in place would corrupt indexes that other
+        processes have memory-mapped; a rename gives the new index a new
+        inode while existing mappings keep the old one.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def is_id_keyed(index):
+        """True for indexes keyed by DocumentChunk.id (older files were keyed by position)"""
+        return isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF))
+
+    @staticmethod
+    def reconstruct(index, ids):
+        """Stored vectors for the given ids as a (len(ids), dim) float32 array"""
+        if not len(ids):
+            return np.zeros((0, index.d), dtype='float32')
+        return np.vstack([index.reconstruct(int(chunk_id)) for chunk_id in ids])
+
+    @staticmethod
+    def index_type_of(index):
+        """Name of the index type behind an ID-mapped index"""
+        base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+        if isinstance(base, faiss.IndexIVF):
+            return "ivf"
+        if isinstance(base, faiss.IndexHNSW):
+            return "hnsw"
+        return "flat"
+
+    @staticmethod
+    def configure(index, settings=None):
+        """Apply the nprobe / efSearch search-time settings to a loaded index"""
+        settings = settings or get_index_settings()
+        index_type = VectorIndexFactory.index_type_of(index)
+        params = faiss.ParameterSpace()
+        if index_type == "ivf":
+            params.set_index_parameter(index, "nprobe", settings["ivf_nprobe"])
+        elif index_type == "hnsw":
+            params.set_index_parameter(index, "efSearch", settings["hnsw_ef_search"])
+        return index
+
+    @staticmethod
+    def evaluate(index, vectors, ids, k=10, n_queries=200):
+        """Compare an approximate index against exact search on the same vectors
+
+        Uses a sample of the stored vectors as queries and reports recall@k
+        of the approximate results against exact search, with the mean
+        query latency of both.
+        """
+        n_vectors = len(vectors)
+        if n_vectors == 0:
+            return None
+        k = min(k, n_vectors)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(n_vectors, min(n_queries, n_vectors), replace=False)]
+
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(vectors)
+        start = time.perf_counter()
+        _, exact_positions = exact.search(queries, k)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        # 精確索引回傳的是位置，需換成 ID 才能比較
+        ids = np.asarray(ids)
+        start = time.perf_counter()
+        _, approx_ids = index.search(queries, k)
+        approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        hits = sum(
+            len(set(ids[row]) & set(approx_row))
+            for row, approx_row in zip(exact_positions, approx_ids)
+        )
+        return {
+            "index_type": VectorIndexFactory.index_type_of(index),
+            "vectors": n_vectors,
+            "k": k,
+            "recall": round(hits / (k * len(queries)), 4),
+            "approx_ms_per_query": round(approx_ms, 4),
+            "exact_ms_per_query": round(exact_ms, 4)
+        }
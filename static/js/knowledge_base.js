@@ -11,6 +11,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize file upload functionality
     initFileUpload();
+    
+    // Initialize index job status polling
+    initIndexJobStatus();
 });
 
 /**
@@ -106,12 +109,93 @@ function initFileUpload() {
             };
             reader.readAsText(file);
         } else {
-            // For non-text files, show a placeholder message
-            contentInput.value = `File content will be processed on upload.\nFile: ${file.name}\nType: ${file.type}\nSize: ${(file.size / 1024).toFixed(2)} KB`;
+            // Binary files are extracted on the server; only hint at it, the field stays empty
+            contentInput.value = '';
+            contentInput.placeholder = `File content will be extracted on upload.\nFile: ${file.name}\nSize: ${(file.size / 1024).toFixed(2)} KB`;
         }
     });
 }
 
+/**
+ * Poll the background index job status and show its progress
+ */
+function initIndexJobStatus() {
+    const container = document.getElementById('indexJobStatus');
+    if (!container) return;
+    
+    const statusUrl = container.getAttribute('data-status-url');
+    const message = document.getElementById('indexJobMessage');
+    const detail = document.getElementById('indexJobDetail');
+    const spinner = document.getElementById('indexJobSpinner');
+    const progressBar = document.getElementById('indexJobProgress');
+    
+    const stageNames = {
+        starting: '準備中',
+        chunking: '切分文件',
+        embedding: '產生向量',
+        building: '建立索引',
+        saving: '儲存索引',
+        indexing: '更新文件索引',
+        removing: '移除文件索引'
+    };
+    
+    // Only poll quickly while a job is queued or running
+    const activeInterval = 2000;
+    let wasActive = false;
+    
+    function render(status) {
+        const active = status.state === 'queued' || status.state === 'running';
+        
+        if (status.state === 'idle' || (!active && !wasActive)) {
+            container.classList.add('d-none');
+            return active;
+        }
+        
+        container.classList.remove('d-none', 'alert-info', 'alert-success', 'alert-danger', 'alert-warning');
+        spinner.classList.toggle('d-none', !active);
+        
+        let percent = 0;
+        if (status.state === 'running') {
+            const stage = stageNames[status.stage] || status.stage;
+            message.textContent = `${status.kind === 'rebuild' ? '重建索引' : '更新索引'}：${stage}`;
+            percent = status.total ? Math.round(status.done * 100 / status.total) : 0;
+            detail.textContent = status.total ? `${status.done} / ${status.total}` : '';
+            if (status.queued) detail.textContent += '（另有請求排隊中）';
+            container.classList.add('alert-info');
+        } else if (status.state === 'queued') {
+            message.textContent = '索引更新已排入佇列';
+            detail.textContent = status.requests > 1 ? `已合併 ${status.requests} 個請求` : '';
+            container.classList.add('alert-info');
+        } else if (status.state === 'succeeded') {
+            message.textContent = '索引更新完成';
+            detail.textContent = '';
+            percent = 100;
+            container.classList.add('alert-success');
+        } else {
+            message.textContent = status.state === 'interrupted' ? '索引更新中斷，請重建索引' : `索引更新失敗：${status.message || ''}`;
+            detail.textContent = '';
+            container.classList.add(status.state === 'interrupted' ? 'alert-warning' : 'alert-danger');
+        }
+        progressBar.style.width = `${percent}%`;
+        return active;
+    }
+    
+    function poll() {
+        fetch(statusUrl, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(status => {
+                const active = render(status);
+                wasActive = wasActive || active;
+                if (active) setTimeout(poll, activeInterval);
+            })
+            .catch(error => {
+                console.error('Error fetching index status:', error);
+            });
+    }
+    
+    poll();
+}
+
 /**
  * Format file size to human-readable format
  * @param {number} bytes - The file size in bytes
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 測試使用本地雜湊嵌入，不需要 API 金鑰或網路
+os.environ["EMBEDDING_BACKEND"] = "hashing"
+os.environ["RAG_ENABLED"] = "True"
+os.environ["DEDUP_MODE"] = "off"
+os.environ["RESPONSE_CACHE_ENABLED"] = "True"
+# main.py 在匯入時建立資料表，指向暫存資料庫
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'main.db')}"
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    from app import create_app
+    db_path = tmp_path_factory.mktemp("db") / "test.db"
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+        "SECRET_KEY": "test",
+        "WTF_CSRF_ENABLED": False,
+        "TESTING": True
+    })
+
+
+@pytest.fixture
+def kb(app, tmp_path, monkeypatch):
+    """Empty database and knowledge-base directory, with the process-wide caches reset"""
+    import rag_service
+    from app import db
+    from routes.utils.config_service import ConfigManager
+    from services.shards import ShardRegistry
+    from services.response_cache import ResponseCacheService
+
+    monkeypatch.chdir(tmp_path)
+    ConfigManager.clear_cache()
+    monkeypatch.setattr(rag_service, "_shards", ShardRegistry(
+        rag_service.RAGService.KNOWLEDGE_BASE_DIR,
+        lambda shard: rag_service.RAGService.initialize_index(read_only=True, shard=shard)
+    ))
+    # 索引工作直接執行，背景執行緒不會在切回工作目錄後寫入 knowledge_base
+    monkeypatch.setattr(rag_service.RAGService, "schedule_index_update", staticmethod(
+        lambda rebuild=False, index_ids=(), remove_ids=(): rag_service.RAGService._run_index_job(
+            rebuild, sorted(index_ids), sorted(remove_ids), lambda stage, done=0, total=0: None
+        )
+    ))
+    rag_service._query_cache.clear()
+    ResponseCacheService.clear()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield rag_service.RAGService
+        db.session.remove()
+    ConfigManager.clear_cache()
+
+
+@pytest.fixture
+def set_config(monkeypatch):
+    """Override settings through the environment for one test"""
+    from routes.utils.config_service import ConfigManager
+
+    def apply(**values):
+        for key, value in values.items():
+            monkeypatch.setenv(key, str(value))
+        ConfigManager.clear_cache()
+    return apply
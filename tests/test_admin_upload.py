@@ -0,0 +1,40 @@
+import io
+import models
+
+PLACEHOLDER = "File content will be processed on upload.\nFile: faq.md\nType: \nSize: 0.10 KB"
+
+
+def admin_client(app):
+    from app import db
+    admin = models.User(username="admin", email="admin@example.com", password_hash="x", is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(admin.id)
+        session["_fresh"] = True
+    return client
+
+
+def test_uploaded_file_wins_over_placeholder_content(app, kb):
+    client = admin_client(app)
+    response = client.post("/admin/knowledge_base/add", data={
+        "title": "退貨政策",
+        "content": PLACEHOLDER,
+        "collections": "",
+        "file": (io.BytesIO("# 退貨政策\n\n商品到貨七天內可以辦理退貨。\n".encode('utf-8')), "faq.md")
+    }, content_type="multipart/form-data")
+    assert response.status_code == 302
+
+    doc = models.Document.query.filter_by(title="退貨政策").one()
+    assert "七天內可以辦理退貨" in doc.content
+    assert "File content will be processed" not in doc.content
+    assert doc.filename == "faq.md"
+
+
+def test_form_content_is_used_without_a_file(app, kb):
+    client = admin_client(app)
+    client.post("/admin/knowledge_base/add", data={
+        "title": "營業時間", "content": "每天早上九點開門。", "collections": ""
+    }, content_type="multipart/form-data")
+    assert models.Document.query.filter_by(title="營業時間").one().content == "每天早上九點開門。"
@@ -0,0 +1,59 @@
+import pytest
+from services.shards import format_collections, format_style_collections
+
+
+@pytest.fixture
+def client():
+    """Client of the main application logged in as the seeded admin"""
+    import main
+    main.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with main.app.app_context():
+        admin = main.User.query.filter_by(is_admin=True).first()
+        admin_id = admin.id
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(admin_id)
+        session["_fresh"] = True
+    yield client
+    with main.app.app_context():
+        main.BotStyle.query.filter(main.BotStyle.name.like("測試%")).delete(synchronize_session=False)
+        main.db.session.commit()
+
+
+def style_collections(name):
+    import main
+    with main.app.app_context():
+        return main.BotStyle.query.filter_by(name=name).one().collections
+
+
+def test_style_collections_keep_the_default_collection():
+    assert format_style_collections("default, tech") == "default,tech"
+    assert format_style_collections("default") == "default"
+    assert format_style_collections("") is None
+    # 文件標記仍省略 default
+    assert format_collections("default, tech") == "tech"
+
+
+def test_add_and_edit_style_keep_untagged_documents(client):
+    response = client.post("/add-bot-style", data={
+        "name": "測試技術", "prompt": "你是技術助理。", "collections": "default, tech"
+    })
+    assert response.status_code == 302
+    assert style_collections("測試技術") == "default,tech"
+
+    import main
+    with main.app.app_context():
+        style_id = main.BotStyle.query.filter_by(name="測試技術").one().id
+    client.post(f"/edit-bot-style/{style_id}", data={
+        "name": "測試技術", "prompt": "你是技術助理。", "collections": "default"
+    })
+    assert style_collections("測試技術") == "default"
+
+
+def test_limited_style_searches_only_its_collections(kb):
+    import models
+    from app import db
+    db.session.add(models.BotStyle(name="測試未標記", prompt="你是助理。",
+                                   collections=format_style_collections("default")))
+    db.session.commit()
+    assert kb.collections_for_style("測試未標記") == ["default"]
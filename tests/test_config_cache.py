@@ -0,0 +1,56 @@
+import models
+from sqlalchemy import event
+
+
+def count_queries(db, func):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    return statements
+
+
+def test_unset_settings_are_not_queried_on_every_search(kb):
+    from app import db
+    db.session.add(models.Document(title="營業時間", content="每天早上九點到晚上九點營業。" * 3, is_active=True))
+    db.session.commit()
+    assert kb.update_index()
+    kb.search("營業時間")
+
+    statements = count_queries(db, lambda: kb.search("幾點開門"))
+    assert not [sql for sql in statements if "config" in sql.lower()]
+
+
+def test_set_replaces_a_cached_default(kb):
+    from routes.utils.config_service import ConfigManager
+    assert ConfigManager.get("RAG_SCORE_GAP", "0.15") == "0.15"
+    ConfigManager.set("RAG_SCORE_GAP", "0.3")
+    assert ConfigManager.get("RAG_SCORE_GAP", "0.15") == "0.3"
+
+
+def test_missing_key_keeps_each_callers_default(kb):
+    from routes.utils.config_service import ConfigManager
+    assert ConfigManager.get("SOME_UNSET_KEY", "a") == "a"
+    assert ConfigManager.get("SOME_UNSET_KEY", "b") == "b"
+
+
+def test_key_saved_by_another_worker_is_seen_after_the_ttl(kb, monkeypatch):
+    import time
+    from app import db
+    from routes.utils import config_service
+    from routes.utils.config_service import ConfigManager
+    monkeypatch.delenv("DEDUP_MODE", raising=False)
+    ConfigManager.clear_cache()
+    assert ConfigManager.get("DEDUP_MODE", "flag") == "flag"
+
+    # 另一個 worker 在管理介面儲存，本行程的快取不會收到通知
+    db.session.add(models.Config(key="DEDUP_MODE", value="merge"))
+    db.session.commit()
+    assert ConfigManager.get("DEDUP_MODE", "flag") == "flag"
+
+    later = time.monotonic() + ConfigManager.MISSING_TTL + 1
+    monkeypatch.setattr(config_service.time, "monotonic", lambda: later)
+    assert ConfigManager.get("DEDUP_MODE", "flag") == "merge"
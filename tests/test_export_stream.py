@@ -0,0 +1,46 @@
+import gzip
+import pytest
+import models
+from sqlalchemy import event
+from services.export_stream import encode_stream, gzip_stream, column_blocks
+
+
+def test_gzip_stream_round_trips():
+    pieces = ["# 匯出\n", "", "內容" * 10000]
+    data = b"".join(gzip_stream(encode_stream(pieces, block_size=1024)))
+    assert gzip.decompress(data).decode('utf-8') == "".join(pieces)
+
+
+def test_column_blocks_read_the_whole_value_in_pieces(kb):
+    from app import db
+    content = "營業時間為每天早上九點到晚上九點。" * 50
+    doc = models.Document(title="營業時間", content=content, is_active=True)
+    db.session.add(doc)
+    db.session.commit()
+
+    query = db.session.query(models.Document).filter(models.Document.id == doc.id)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        blocks = list(column_blocks(query, models.Document.content, block_size=100))
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    assert len(blocks) == 9 and "".join(blocks) == content
+    # 整個欄位只查詢一次，不是每段一次
+    assert len(statements) == 1
+
+
+@pytest.mark.parametrize("export_format", ["markdown", "jsonl"])
+def test_export_fails_before_the_first_piece(kb, export_format):
+    from app import db
+
+    def fail(conn, cursor, statement, parameters, context, executemany):
+        raise RuntimeError("database unavailable")
+    event.listen(db.engine, "before_cursor_execute", fail)
+    try:
+        # 查詢失敗時不可先送出標題，呼叫端才能改為顯示錯誤
+        with pytest.raises(Exception):
+            next(kb.export_knowledge_base(export_format))
+    finally:
+        event.remove(db.engine, "before_cursor_execute", fail)
@@ -0,0 +1,51 @@
+import models
+
+
+def add_document(db, title, content, collections=None):
+    doc = models.Document(title=title, content=content, is_active=True, collections=collections)
+    db.session.add(doc)
+    db.session.commit()
+    return doc
+
+
+def indexed_titles(rag, query, top_k=5):
+    return [result["title"] for result in rag.search(query, top_k) or []]
+
+
+def test_index_document_adds_chunks_without_rebuild(kb):
+    from app import db
+    first = add_document(db, "營業時間", "門市營業時間為每天早上九點到晚上九點，週末照常營業。" * 3)
+    assert kb.update_index()
+
+    second = add_document(db, "退貨政策", "商品到貨七天內可以辦理退貨，請保留發票與完整包裝。" * 3)
+    assert kb.index_document(second)
+
+    assert "退貨政策" in indexed_titles(kb, "退貨需要保留發票嗎")
+    assert "營業時間" in indexed_titles(kb, "門市營業時間")
+    assert models.DocumentChunk.query.filter_by(document_id=first.id).count() > 0
+
+
+def test_remove_from_index_drops_only_that_document(kb):
+    from app import db
+    keep = add_document(db, "運費說明", "訂單滿一千元免運費，未滿則酌收八十元運費。" * 3)
+    drop = add_document(db, "會員點數", "每消費一百元累積一點會員點數，點數可折抵消費。" * 3)
+    assert kb.update_index()
+
+    assert kb.remove_from_index(drop.id)
+
+    assert "會員點數" not in indexed_titles(kb, "會員點數怎麼累積")
+    assert "運費說明" in indexed_titles(kb, "免運費門檻")
+
+
+def test_reindexing_a_document_replaces_its_chunks(kb):
+    from app import db
+    doc = add_document(db, "客服電話", "客服專線為零八零零一二三四五六，服務時間早上九點到下午六點。" * 3)
+    assert kb.update_index()
+
+    doc.content = "客服信箱為 service@example.com，我們會在一個工作天內回覆您的來信。" * 3
+    db.session.commit()
+    assert kb.index_document(doc)
+
+    results = kb.search("客服信箱", 5) or []
+    assert results and all("service@example.com" in result["content"] for result in results
+                           if result["title"] == "客服電話")
@@ -0,0 +1,38 @@
+import time
+from services.index_jobs import IndexJobQueue
+
+
+def wait_for_result(queue, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = queue.status()
+        if status.get("state") in ("succeeded", "failed", "interrupted"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"Index job did not finish: {queue.status()}")
+
+
+def make_queue(tmp_path, runner):
+    return IndexJobQueue(runner, str(tmp_path / "index_job.json"), str(tmp_path / "index_job.lock"))
+
+
+def test_successful_job_is_recorded(app, tmp_path):
+    calls = []
+    queue = make_queue(tmp_path, lambda rebuild, index_ids, remove_ids, progress: calls.append(index_ids) or True)
+    queue.submit(app, index_ids=[3, 1])
+
+    status = wait_for_result(queue)
+    assert status["state"] == "succeeded" and status["kind"] == "documents"
+    assert calls == [[1, 3]]
+
+
+def test_runner_error_is_recorded_as_failed(app, tmp_path):
+    def runner(rebuild, index_ids, remove_ids, progress):
+        raise RuntimeError("embedding backend unavailable")
+    queue = make_queue(tmp_path, runner)
+    queue.submit(app, rebuild=True)
+
+    status = wait_for_result(queue)
+    assert status["state"] == "failed"
+    assert status["message"] == "embedding backend unavailable"
+    assert not status.get("rebuilt_at")
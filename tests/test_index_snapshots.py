@@ -0,0 +1,74 @@
+import os
+from services.index_holder import IndexHolder
+from services.index_snapshots import SnapshotStore
+
+
+def publish(store, content):
+    staging = store.stage()
+    with open(os.path.join(staging, "data.txt"), 'w', encoding='utf-8') as f:
+        f.write(content)
+    return store.publish(staging)
+
+
+def read_current(store):
+    with open(os.path.join(store.current(), "data.txt"), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_publish_switches_current_to_the_new_snapshot(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    assert store.current() is None and store.version() is None
+
+    first = publish(store, "v1")
+    assert store.current() == first and read_current(store) == "v1"
+
+    second = publish(store, "v2")
+    assert store.version() == os.path.basename(second)
+    assert read_current(store) == "v2"
+    assert os.path.isdir(first)
+
+
+def test_garbage_collection_keeps_current_and_newest(tmp_path):
+    store = SnapshotStore(str(tmp_path), keep=2, grace_seconds=0)
+    paths = [publish(store, f"v{i}") for i in range(4)]
+    abandoned = store.stage()
+
+    store.collect_garbage()
+
+    assert [os.path.isdir(path) for path in paths] == [False, False, True, True]
+    assert not os.path.exists(abandoned)
+    assert read_current(store) == "v3"
+
+
+def test_grace_period_protects_recent_snapshots(tmp_path):
+    store = SnapshotStore(str(tmp_path), keep=1, grace_seconds=300)
+    paths = [publish(store, f"v{i}") for i in range(3)]
+    assert all(os.path.isdir(path) for path in paths)
+
+
+def test_reader_sees_the_new_snapshot_after_publish(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    publish(store, "v1")
+    holder = IndexHolder(lambda: read_current(store), store.pointer_path, check_interval=0)
+    assert holder.get() == "v1"
+
+    publish(store, "v2")
+    assert holder.get() == "v2"
+
+
+def test_search_uses_the_republished_index(kb):
+    import models
+    from app import db
+    db.session.add(models.Document(title="營業時間", content="門市營業時間為每天早上九點到晚上九點。" * 3,
+                                   is_active=True))
+    db.session.commit()
+    assert kb.update_index()
+    before = kb.get_knowledge_base_version()
+
+    db.session.add(models.Document(title="退貨政策", content="商品到貨七天內可以辦理退貨，請保留發票。" * 3,
+                                   is_active=True))
+    db.session.commit()
+    assert kb.update_index()
+
+    assert kb.get_knowledge_base_version() != before
+    assert "退貨政策" in [result["title"] for result in kb.search("退貨需要發票嗎", 5) or []]
@@ -0,0 +1,63 @@
+import time
+from types import SimpleNamespace
+import pytest
+from services.message_pipeline import MessagePipeline
+
+
+def text_event(text="門市幾點開門"):
+    return SimpleNamespace(
+        reply_token="token",
+        source=SimpleNamespace(user_id="U1", group_id=None, room_id=None),
+        message=SimpleNamespace(text=text)
+    )
+
+
+@pytest.fixture
+def pipeline(kb, set_config, monkeypatch):
+    """Pipeline with the LINE and OpenAI calls replaced, recording every reply"""
+    set_config(ASYNC_PIPELINE_ENABLED="True", ASYNC_PIPELINE_WORKERS=2)
+    replies = []
+
+    async def no_profile(self, app, user_id):
+        return {}
+
+    async def generate(self, app, event, target, user_message, style_name, rag_context, claim):
+        return "每天早上九點開門", True, False
+
+    monkeypatch.setattr(MessagePipeline, "_fetch_profile", no_profile)
+    monkeypatch.setattr(MessagePipeline, "_generate", generate)
+    monkeypatch.setattr(MessagePipeline, "_reply", staticmethod(lambda token, target, text: replies.append(text)))
+    return MessagePipeline(), replies
+
+
+def test_answer_is_replied_once(pipeline):
+    handler, replies = pipeline
+    timings = handler.handle(text_event())
+    assert replies == ["每天早上九點開門"]
+    assert "generation" in timings
+
+
+def test_timeout_replies_with_one_error_message(pipeline, set_config, monkeypatch):
+    handler, replies = pipeline
+    set_config(ASYNC_PIPELINE_TIMEOUT="0.2")
+
+    def slow_context(query, style):
+        time.sleep(0.6)
+        return None
+    monkeypatch.setattr(MessagePipeline, "_get_context", staticmethod(slow_context))
+
+    assert handler.handle(text_event()) is None
+    # 逾時後仍在執行的管線不可再次回覆
+    time.sleep(0.8)
+    assert replies == [MessagePipeline.ERROR_MESSAGE]
+
+
+def test_stage_error_is_handled_inside_the_pipeline(pipeline, monkeypatch):
+    handler, replies = pipeline
+
+    async def failing(self, app, event, target, user_message, style_name, rag_context, claim):
+        raise RuntimeError("OpenAI API key not configured")
+    monkeypatch.setattr(MessagePipeline, "_generate", failing)
+
+    handler.handle(text_event())
+    assert replies == [MessagePipeline.ERROR_MESSAGE]
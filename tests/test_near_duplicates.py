@@ -0,0 +1,75 @@
+import models
+from services.near_duplicates import MinHasher, NearDuplicateIndex
+
+FAQ = ("本店營業時間為週一至週五上午九點到下午六點，週六上午十點到下午四點，週日及國定假日公休。"
+       "門市位於台北市信義區松仁路一段，捷運市政府站二號出口步行約五分鐘即可抵達。"
+       "店內提供免費無線網路與充電座，攜帶寵物入店請使用提籃或推車，並請勿讓寵物在座位上用餐。"
+       "團體訂位請於三天前來電，十人以上可安排包廂，包廂低消為每人三百元。")
+FAQ_EDITED = FAQ.replace("三百元", "三百五十元")
+SHIPPING = "訂單滿一千元免運費，未滿一千元酌收八十元運費，離島地區另計。" * 3
+
+
+def active_titles():
+    return sorted(doc.title for doc in models.Document.query.filter_by(is_active=True))
+
+
+def test_minhash_similarity_tracks_small_edits():
+    hasher = MinHasher()
+    index = NearDuplicateIndex(hasher)
+    index.add(1, hasher.signature(FAQ))
+    index.add(2, hasher.signature(SHIPPING))
+
+    match = index.query(hasher.signature(FAQ_EDITED), 0.85)
+    assert match is not None and match[0] == 1
+    assert index.query(hasher.signature(FAQ_EDITED), 0.85, keys={2}) is None
+
+
+def test_skip_leaves_the_duplicate_out(kb, set_config):
+    set_config(DEDUP_MODE="skip")
+    ok, ids = kb.add_documents([("營業時間", FAQ, None), ("運費", SHIPPING, None)])
+    assert ok and len(ids) == 2
+
+    ok, ids = kb.add_documents([("營業時間（新）", FAQ_EDITED, None)])
+    assert ok and ids == []
+    assert active_titles() == ["營業時間", "運費"]
+
+
+def test_flag_adds_the_duplicate(kb, set_config):
+    set_config(DEDUP_MODE="flag")
+    kb.add_documents([("營業時間", FAQ, None)])
+    ok, ids = kb.add_documents([("營業時間（新）", FAQ_EDITED, None)])
+    assert ok and len(ids) == 1
+    assert active_titles() == ["營業時間", "營業時間（新）"]
+
+
+def test_merge_replaces_the_matched_document(kb, set_config):
+    set_config(DEDUP_MODE="merge")
+    ok, (original,) = kb.add_documents([("營業時間", FAQ, None)], collections="faq")
+    ok, ids = kb.add_documents([("營業時間（新）", FAQ_EDITED, None)], collections="faq,store")
+    assert ok and ids == [original]
+
+    doc = models.Document.query.get(original)
+    assert doc.title == "營業時間（新）" and doc.content == FAQ_EDITED
+    assert doc.collections == "faq,store"
+
+
+def test_duplicates_in_other_collections_are_kept(kb, set_config):
+    set_config(DEDUP_MODE="merge")
+    kb.add_documents([("營業時間", FAQ, None)], collections="faq")
+    ok, ids = kb.add_documents([("營業時間（門市）", FAQ_EDITED, None)], collections="store")
+    assert ok and len(ids) == 1
+
+    docs = {doc.title: doc.collections for doc in models.Document.query.filter_by(is_active=True)}
+    assert docs == {"營業時間": "faq", "營業時間（門市）": "store"}
+
+
+def test_batch_without_dedup_replaces_the_previous_report(kb, set_config):
+    set_config(DEDUP_MODE="flag")
+    kb.add_documents([("營業時間", FAQ, None)])
+    kb.add_documents([("營業時間（新）", FAQ_EDITED, None)])
+    assert len(kb.get_ingest_report()["items"]) == 1
+
+    set_config(DEDUP_MODE="off")
+    kb.add_documents([("運費", SHIPPING, None)])
+    report = kb.get_ingest_report()
+    assert report["mode"] == "off" and report["items"] == [] and report["added"] == 1
@@ -0,0 +1,57 @@
+import numpy as np
+import models
+from services.response_cache import SemanticResponseCache, ResponseCacheService
+
+
+def vector(*values):
+    return np.array(values, dtype='float32')
+
+
+def test_close_query_hits_and_far_query_misses():
+    cache = SemanticResponseCache()
+    cache.put(vector(1, 0, 0), "預設", "v1", "營業時間?", "每天九點到九點")
+
+    answer, similarity = cache.get(vector(0.98, 0.05, 0), "預設", "v1", 0.95)
+    assert answer == "每天九點到九點" and similarity > 0.95
+    assert cache.get(vector(0, 1, 0), "預設", "v1", 0.95) is None
+
+
+def test_new_version_drops_the_group():
+    cache = SemanticResponseCache()
+    cache.put(vector(1, 0), "預設", "v1", "營業時間?", "舊答案")
+
+    assert cache.get(vector(1, 0), "預設", "v2", 0.9) is None
+    assert cache.stats()["invalidated"] == 1
+
+
+def test_stale_put_does_not_wipe_a_newer_group():
+    cache = SemanticResponseCache()
+    cache.get(vector(1, 0), "預設", "v1", 0.9)
+    # 另一則訊息在生成期間以新版本查詢並填入快取
+    cache.get(vector(0, 1), "預設", "v2", 0.9)
+    cache.put(vector(0, 1), "預設", "v2", "運費?", "滿千免運")
+
+    cache.put(vector(1, 0), "預設", "v1", "營業時間?", "舊答案")
+
+    assert cache.get(vector(1, 0), "預設", "v2", 0.9) is None
+    assert cache.get(vector(0, 1), "預設", "v2", 0.9)[0] == "滿千免運"
+
+
+def test_knowledge_base_update_invalidates_answers(kb):
+    from app import db
+    db.session.add(models.Document(title="營業時間", content="門市營業時間為每天早上九點到晚上九點。" * 3,
+                                   is_active=True))
+    db.session.commit()
+    assert kb.update_index()
+
+    answer, ticket = ResponseCacheService.lookup("門市幾點開門")
+    assert answer is None and ticket is not None
+    ResponseCacheService.store(ticket, "每天早上九點開門")
+    assert ResponseCacheService.lookup("門市幾點開門")[0] == "每天早上九點開門"
+
+    db.session.add(models.Document(title="公休日", content="每月第一個週一門市公休，其餘日期照常營業。" * 3,
+                                   is_active=True))
+    db.session.commit()
+    assert kb.update_index()
+
+    assert ResponseCacheService.lookup("門市幾點開門")[0] is None
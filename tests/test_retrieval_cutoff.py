@@ -0,0 +1,63 @@
+import numpy as np
+import models
+from services.reranker import adaptive_cutoff, hybrid_cutoff, mmr_select
+
+
+def test_adaptive_cutoff_stops_at_floor_and_gap():
+    assert adaptive_cutoff([0.9, 0.85, 0.5, 0.45], 0.3, 0.15) == 2
+    assert adaptive_cutoff([0.2, 0.1], 0.3, 0.15) == 0
+
+
+def test_hybrid_cutoff_without_keywords_is_the_cosine_cut():
+    similarities = np.array([0.4, 0.9, 0.1], dtype='float32')
+    rows, relevance = hybrid_cutoff(similarities, [0, 0, 0], 0.3, 0.6)
+    assert rows.tolist() == [1, 0]
+    assert np.allclose(relevance, similarities[[1, 0]])
+
+
+def test_strong_keyword_hit_survives_the_cosine_floor():
+    # 第 2 列只被 BM25 找到（例如產品代碼），向量相似度低於門檻
+    similarities = np.array([0.8, 0.75, 0.05, 0.02], dtype='float32')
+    keyword_scores = np.array([0.0, 0.0, 9.5, 0.0], dtype='float32')
+    rows, relevance = hybrid_cutoff(similarities, keyword_scores, 0.3, 0.15, exempt_rank=3)
+    assert 2 in rows.tolist()
+    assert 3 not in rows.tolist()
+    # 排序依融合分數，MMR 的相關度與之一致
+    assert list(relevance) == sorted(relevance, reverse=True)
+
+
+def test_keyword_hits_beyond_the_exempt_rank_still_need_cosine():
+    similarities = np.array([0.9, 0.05, 0.04], dtype='float32')
+    keyword_scores = np.array([0.0, 5.0, 4.0], dtype='float32')
+    rows, _ = hybrid_cutoff(similarities, keyword_scores, 0.3, 0.15, exempt_rank=1)
+    assert rows.tolist().count(1) == 1 and 2 not in rows.tolist()
+
+
+def test_mmr_drops_near_duplicates():
+    vectors = np.array([[1, 0], [1, 0.001], [0, 1]], dtype='float32')
+    picked = mmr_select(vectors, np.array([1.0, 0.99, 0.5]), 3, duplicate_similarity=0.95)
+    assert picked == [0, 2]
+
+
+def test_search_returns_exact_code_match_below_similarity_floor(kb, set_config):
+    from app import db
+    set_config(RAG_MIN_SIMILARITY="0.99")
+    db.session.add_all([
+        models.Document(title="產品規格", content="型號 ZX-9071 的電池容量為五千毫安培，重量三百公克。", is_active=True),
+        models.Document(title="保固說明", content="所有產品提供一年保固，人為損壞不在保固範圍內。" * 3, is_active=True)
+    ])
+    db.session.commit()
+    assert kb.update_index()
+
+    results = kb.search("ZX-9071", 3) or []
+    assert [result["title"] for result in results] == ["產品規格"]
+
+
+def test_search_without_hybrid_applies_the_floor(kb, set_config):
+    from app import db
+    set_config(RAG_MIN_SIMILARITY="0.99", RAG_HYBRID_SEARCH="False")
+    db.session.add(models.Document(title="產品規格", content="型號 ZX-9071 的電池容量為五千毫安培。", is_active=True))
+    db.session.commit()
+    assert kb.update_index()
+
+    assert kb.search("ZX-9071", 3) is None
@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+from sqlalchemy import create_engine, inspect, text
+from models import upgrade_schema
+
+
+def columns(engine, table):
+    return {info["name"] for info in inspect(engine).get_columns(table)}
+
+
+def test_missing_columns_are_added_to_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        # 加入集合欄位之前的資料表
+        conn.execute(text("CREATE TABLE document (id INTEGER PRIMARY KEY, title VARCHAR(256), content TEXT)"))
+        conn.execute(text("CREATE TABLE bot_style (id INTEGER PRIMARY KEY, name VARCHAR(64))"))
+        conn.execute(text("INSERT INTO document (title, content) VALUES ('營業時間', '每天九點開門')"))
+
+    db = SimpleNamespace(engine=engine)
+    upgrade_schema(db)
+    upgrade_schema(db)
+
+    assert "collections" in columns(engine, "document")
+    assert "collections" in columns(engine, "bot_style")
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT title, collections FROM document")).all() == [("營業時間", None)]
+
+
+def test_tables_that_do_not_exist_are_skipped(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+    upgrade_schema(SimpleNamespace(engine=engine))
+    assert inspect(engine).get_table_names() == []
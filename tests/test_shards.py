@@ -0,0 +1,40 @@
+import os
+from services.shards import ShardRegistry
+
+
+def publish(registry, name):
+    store = registry.store(name)
+    staging = store.stage()
+    store.publish(staging)
+
+
+def test_shard_list_and_versions_are_read_once_per_interval(tmp_path, monkeypatch):
+    registry = ShardRegistry(str(tmp_path), lambda shard: None, check_interval=60)
+    publish(registry, "faq")
+    assert registry.names() == ["default", "faq"]
+    version = registry.version()
+
+    calls = []
+    monkeypatch.setattr(os, "listdir", lambda path: calls.append(path) or [])
+    monkeypatch.setattr(os, "stat", lambda path, *args, **kwargs: calls.append(path))
+    for _ in range(3):
+        assert registry.names() == ["default", "faq"]
+        assert registry.version() == version
+    assert calls == []
+
+
+def test_publishing_refreshes_the_cached_state(tmp_path):
+    registry = ShardRegistry(str(tmp_path), lambda shard: None, check_interval=60)
+    publish(registry, "faq")
+    version = registry.version()
+
+    publish(registry, "store")
+    registry.published("store")
+    assert registry.names() == ["default", "faq", "store"]
+
+    publish(registry, "faq")
+    registry.published("faq")
+    assert registry.version() != version
+
+    registry.drop("store")
+    assert registry.names() == ["default", "faq"]
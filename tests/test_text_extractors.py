@@ -0,0 +1,25 @@
+import os
+from services.text_extractors import extract_files, extract_to_file
+
+
+def test_plain_text_counts_decoded_characters(tmp_path):
+    path = tmp_path / "faq.txt"
+    path.write_text("營業時間：每天九點到九點。\nOpen 9-21.", encoding='utf-8')
+
+    (key, text_path, characters, error), = extract_files([("faq", "txt", str(path))])
+
+    assert (key, text_path, error) == ("faq", str(path), None)
+    assert characters == len("營業時間：每天九點到九點。\nOpen 9-21.")
+
+
+def test_markdown_is_extracted_to_a_text_file(tmp_path):
+    path = tmp_path / "faq.md"
+    path.write_text("# 退貨政策\n\n七天內可以**退貨**。\n", encoding='utf-8')
+
+    text_path, characters = extract_to_file("md", str(path))
+
+    with open(text_path, encoding='utf-8') as f:
+        text = f.read()
+    os.remove(text_path)
+    assert "退貨政策" in text and "退貨" in text
+    assert characters == len(text)